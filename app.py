@@ -1,47 +1,93 @@
 import os
 import json
+import time
 import threading
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify
-from services.aggregator import get_listings, DISTRICTS, bulk_scrape
+from flask import Flask, Response, render_template, request, jsonify, g, stream_with_context
+from services.aggregator import get_listings, search_area, DISTRICTS, SCRAPERS, enqueue_bulk_scrape, warm_cache
+from services.scheduler import enqueue_refresh, freshness_report
 from services.processor import apply_sort
-from services.db import get_stats, get_historical_stats, get_listing_history, get_posted_stats
+from services.export import stream_export, FORMATS as EXPORT_FORMATS
+from services import metrics
+from scrapers.throttle import throttle_status
+from scrapers.transport import transport_stats
+from services.db import (
+    get_stats, get_historical_stats, get_listing_history, get_listing_histories, get_posted_stats, URL_INDEX,
+    get_cube_stats, get_yields, CUBE_DIMENSIONS, RESOLUTIONS, get_jobs, get_job, cancel_job, detail_queue_stats,
+    get_marks, get_marks_since, set_mark, set_marks, import_marks_file, get_marked_listings,
+    get_changes, latest_seq, wait_for_changes,
+    create_saved_search, get_saved_searches, delete_saved_search, get_inbox, mark_inbox_read,
+)
 
 #aggregation
 
 app = Flask(__name__)
 
-# --- Favorites/Discard persistence (JSON file) ---
-MARKS_LOCK = threading.Lock()
+# Build the in-memory URL index off the request path
+threading.Thread(target=URL_INDEX.load, daemon=True).start()
+# Preload the most-requested listing queries so the first users after a restart hit a warm cache
+threading.Thread(target=warm_cache, daemon=True).start()
+
+# --- Favorites/Discard persistence (SQLite `marks` table) ---
 PROJECT_ROOT = Path(__file__).resolve().parent
+# Legacy JSON store, imported into the database once on first start
 MARKS_FILE = Path(os.environ.get("MARKS_FILE", PROJECT_ROOT / "marks.json"))
+import_marks_file(MARKS_FILE)
 
-def _load_marks():
-    try:
-        if MARKS_FILE.exists():
-            with MARKS_LOCK:
-                with open(MARKS_FILE, "r", encoding="utf-8") as f:
-                    return json.load(f)
-    except Exception:
-        pass
-    return {}
-
-def _save_marks(data: dict):
-    try:
-        MARKS_FILE.parent.mkdir(parents=True, exist_ok=True)
-        tmp = str(MARKS_FILE) + ".tmp"
-        with MARKS_LOCK:
-            with open(tmp, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            os.replace(tmp, MARKS_FILE)
-    except Exception:
-        pass
+# Longest /api/changes long-poll, and the keep-alive interval of its event stream
+CHANGES_MAX_WAIT = 30.0
+SSE_KEEPALIVE = 15.0
+
+# Server-Timing on /api/listings for every request (otherwise only with ?timing=1)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+@app.before_request
+def _start_timing():
+    g.started = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+def _finish_timing(response):
+    elapsed = time.perf_counter() - g.get("started", time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe("http_request_seconds", elapsed, endpoint=endpoint)
+    if request.path == "/api/listings" and (SERVER_TIMING or request.args.get("timing") == "1"):
+        timings = metrics.request_timings()
+        timings["total"] = elapsed
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    return response
 
 @app.get("/")
 def index():
     default_district = request.args.get("district", "Leiria")
     return render_template("dashboard.html", districts=DISTRICTS, default_district=default_district)
 
+def _request_filters():
+    # filtros numéricos (opcionais)
+    def fnum(name):
+        v = request.args.get(name, "").strip()
+        return None if not v else float(v)
+
+    return {
+        "min_price": fnum("min_price"),
+        "max_price": fnum("max_price"),
+        "min_area": fnum("min_area"),
+        "max_area": fnum("max_area"),
+        "only_with_eurm2": request.args.get("only_with_eurm2", "0") == "1",
+        "exclude_temporary": request.args.get("exclude_temporary", "1") == "1",
+    }
+
+def _request_area():
+    """(bbox, center, radius_km) from bbox=min_lng,min_lat,max_lng,max_lat or lat/lng/radius_km; ValueError if malformed."""
+    bbox = center = radius_km = None
+    if request.args.get("bbox"):
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in request.args["bbox"].split(","))
+        bbox = (min_lat, min_lng, max_lat, max_lng)
+    elif request.args.get("lat") and request.args.get("lng"):
+        center = (float(request.args["lat"]), float(request.args["lng"]))
+        radius_km = max(0.05, min(float(request.args.get("radius_km", "1")), 50.0))
+    return bbox, center, radius_km
+
 @app.get("/api/listings")
 def api_listings():
     district = request.args.get("district", "Leiria")
@@ -56,34 +102,41 @@ def api_listings():
     if not sources:
         sources = ["idealista", "imovirtual", "supercasa", "casasapo", "remax", "olx"]
 
-    # filtros numéricos (opcionais)
-    def fnum(name):
-        v = request.args.get(name, "").strip()
-        return None if not v else float(v)
+    filters = _request_filters()
 
-    filters = {
-        "min_price": fnum("min_price"),
-        "max_price": fnum("max_price"),
-        "min_area": fnum("min_area"),
-        "max_area": fnum("max_area"),
-        "only_with_eurm2": request.args.get("only_with_eurm2", "0") == "1",
-        "exclude_temporary": request.args.get("exclude_temporary", "1") == "1",
-    }
+    # collapse=1 shows each property once even if several portals list it
+    collapse = request.args.get("collapse", "0") == "1"
 
     sort = request.args.get("sort", "eur_m2_asc")
     limit = int(request.args.get("limit", "50"))
     limit = max(10, min(limit, 1000))
 
     search_type = request.args.get("search_type", "rent")
+
+    # Full-text query over title/snippet/description: words, "phrases", prefix*, -excluded
+    q = request.args.get("q", "").strip() or None
+
+    # Area search instead of a district
+    try:
+        bbox, center, radius_km = _request_area()
+    except ValueError:
+        return jsonify({"error": "invalid bbox or lat/lng/radius_km"}), 400
+    if bbox or center:
+        results, stats = search_area(
+            sources=sources, filters=filters, sort=sort, limit=limit, typology=typology,
+            search_type=search_type, collapse=collapse, bbox=bbox, center=center, radius_km=radius_km, q=q,
+        )
+        return jsonify({"results": results, "stats": stats})
+
     if search_type == "all":
         # Fetch both and merge
         res_rent, stats_rent = get_listings(
             district=district, pages=pages, sources=sources, filters=filters,
-            sort=sort, limit=limit, typology=typology, search_type="rent"
+            sort=sort, limit=limit, typology=typology, search_type="rent", collapse=collapse, q=q,
         )
         res_buy, stats_buy = get_listings(
             district=district, pages=pages, sources=sources, filters=filters,
-            sort=sort, limit=limit, typology=typology, search_type="buy"
+            sort=sort, limit=limit, typology=typology, search_type="buy", collapse=collapse, q=q,
         )
         results = res_rent + res_buy
         # Combine stats roughly
@@ -104,12 +157,63 @@ def api_listings():
             limit=limit,
             typology=typology,
             search_type=search_type,
+            collapse=collapse,
+            q=q,
         )
     return jsonify({"results": results, "stats": stats})
 
+@app.get("/api/export")
+def api_export():
+    """Every matching listing as CSV or NDJSON, streamed; the filters of /api/listings, without a row cap."""
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"invalid format: {fmt}"}), 400
+    district = request.args.get("district") or None
+    if district and district not in DISTRICTS:
+        return jsonify({"error": f"invalid district: {district}"}), 400
+    search_type = request.args.get("search_type") or None
+    try:
+        filters = _request_filters()
+        bbox, center, radius_km = _request_area()
+    except ValueError:
+        return jsonify({"error": "invalid numeric filter or area"}), 400
+
+    chunks = stream_export(
+        fmt, filters,
+        typology=request.args.get("typology") or None,
+        district=district,
+        search_type=None if search_type == "all" else search_type,
+        sources=request.args.getlist("sources") or None,
+        q=request.args.get("q", "").strip() or None,
+        bbox=bbox, center=center, radius_km=radius_km,
+    )
+    # No Content-Length: the body goes out with chunked transfer encoding as it is read
+    return Response(
+        stream_with_context(chunks), content_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename=listings.{fmt}"},
+    )
+
 @app.get("/api/stats")
 def api_stats():
-    return jsonify(get_stats())
+    collapse = request.args.get("collapse", "0") == "1"
+    return jsonify(get_stats(collapse=collapse))
+
+def _cube_filters():
+    keys = ("district", "search_type", "typology", "source", "day_from", "day_to")
+    return {k: request.args.get(k) for k in keys if request.args.get(k)}
+
+@app.get("/api/stats/cube")
+def api_stats_cube():
+    # e.g. ?by=source,search_type&district=Lisboa
+    by = [d for d in request.args.get("by", "district,search_type").split(",") if d]
+    return jsonify(get_cube_stats(by=by, **_cube_filters()))
+
+@app.get("/api/stats/yields")
+def api_stats_yields():
+    by = request.args.get("by", "district")
+    if by not in CUBE_DIMENSIONS or by == "search_type":
+        return jsonify({"error": f"invalid by: {by}"}), 400
+    return jsonify(get_yields(by=by, **_cube_filters()))
 
 @app.get("/api/history")
 def api_history():
@@ -117,10 +221,14 @@ def api_history():
     search_type = request.args.get("search_type")
     typology = request.args.get("typology")
     mode = request.args.get("mode", "scrape") # "scrape" or "posted"
+    resolution = request.args.get("resolution") # "day", "week" or "month"
+    max_points = request.args.get("max_points", type=int)
+    if resolution and resolution not in RESOLUTIONS:
+        return jsonify({"error": f"invalid resolution: {resolution}"}), 400
     
     if mode == "posted":
-        return jsonify(get_posted_stats(district, search_type, typology))
-    return jsonify(get_historical_stats(district, search_type, typology))
+        return jsonify(get_posted_stats(district, search_type, typology, resolution or "day", max_points))
+    return jsonify(get_historical_stats(district, search_type, typology, resolution, max_points))
 
 @app.get("/api/listing_history")
 def api_listing_history():
@@ -129,21 +237,156 @@ def api_listing_history():
         return jsonify({"error": "missing url"}), 400
     return jsonify(get_listing_history(url))
 
+@app.post("/api/listing_history/bulk")
+def api_listing_history_bulk():
+    # Histories for a whole results page in one query: {url: [{price_eur, date}]}
+    payload = request.get_json(silent=True) or {}
+    urls = payload.get("urls")
+    if not isinstance(urls, list):
+        return jsonify({"error": "missing urls"}), 400
+    if len(urls) > 1000:
+        return jsonify({"error": "too many urls (max 1000)"}), 400
+    return jsonify(get_listing_histories(urls))
+
 @app.post("/api/bulk_scrape")
 def api_bulk_scrape():
     pages = int(request.args.get("pages", "1"))
-    # Run in background
-    thread = threading.Thread(target=bulk_scrape, args=(pages,))
-    thread.start()
-    return jsonify({"ok": True, "message": "Bulk scrape started in background."})
+    pages = max(1, min(pages, 10))
+    # Queued for the workers (automation/worker.py); an identical open sweep is reused
+    job = enqueue_bulk_scrape(pages)
+    message = (f"Bulk scrape queued as job {job['job_id']}." if job["created"]
+               else f"An identical bulk scrape is already queued or running (job {job['job_id']}).")
+    return jsonify({"ok": True, "job_id": job["job_id"], "created": job["created"], "message": message})
+
+@app.post("/api/refresh")
+def api_refresh():
+    # Churn-driven refresh: at most `budget` page requests, where the most is expected to have changed
+    budget = max(1, min(request.args.get("budget", 200, type=int), 5000))
+    job = enqueue_refresh(budget)
+    return jsonify({"ok": True, **job})
+
+@app.get("/api/freshness")
+def api_freshness():
+    keys = ("source", "district", "search_type", "typology")
+    report = freshness_report(**{k: request.args.get(k) for k in keys})
+    limit = request.args.get("limit", type=int)
+    if limit:
+        report["items"] = report["items"][:limit]
+    return jsonify(report)
+
+@app.get("/api/jobs")
+def api_jobs():
+    limit = max(1, min(request.args.get("limit", 20, type=int), 200))
+    return jsonify(get_jobs(limit))
+
+@app.get("/api/jobs/<int:job_id>")
+def api_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
+
+@app.delete("/api/jobs/<int:job_id>")
+def api_cancel_job(job_id):
+    if not cancel_job(job_id):
+        return jsonify({"error": "job not open"}), 409
+    return jsonify({"ok": True})
 
 @app.get("/analytics")
 def analytics():
     return render_template("analytics.html", districts=DISTRICTS)
 
+@app.get("/api/changes")
+def api_changes():
+    """New/repriced listing events after `since`; long-polls with `wait`, streams as SSE when asked for."""
+    sse = request.args.get("stream") == "1" or request.accept_mimetypes.best == "text/event-stream"
+    since = request.args.get("since") or request.headers.get("Last-Event-ID")
+    try:
+        # An event stream without a position starts at the tail; a plain request at the beginning
+        since = int(since) if since else (latest_seq() if sse else 0)
+        limit = max(1, min(int(request.args.get("limit", "500")), 1000))
+        wait = max(0.0, min(float(request.args.get("wait", "0")), CHANGES_MAX_WAIT))
+    except ValueError:
+        return jsonify({"error": "invalid since, limit or wait"}), 400
+    filters = {k: request.args.get(k) or None for k in ("district", "search_type", "source")}
+
+    if not sse:
+        page = get_changes(since, limit, **filters)
+        if not page["changes"] and wait and page["next"] == since:
+            wait_for_changes(since, wait)
+            page = get_changes(since, limit, **filters)
+        return jsonify(page)
+
+    def events(since):
+        while True:
+            page = get_changes(since, limit, **filters)
+            for c in page["changes"]:
+                yield f"id: {c['seq']}\nevent: {c['kind']}\ndata: {json.dumps(c, ensure_ascii=False)}\n\n"
+            since = page["next"]
+            if len(page["changes"]) < limit and wait_for_changes(since, SSE_KEEPALIVE) <= since:
+                yield ": keepalive\n\n"
+
+    return Response(
+        stream_with_context(events(since)), content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/searches")
+def api_saved_searches():
+    return jsonify(get_saved_searches())
+
+@app.post("/api/searches")
+def api_create_saved_search():
+    """Saves the filters of a search; new and repriced listings matching it land in its inbox."""
+    data = request.get_json(silent=True) or {}
+    if data.get("district") and data["district"] not in DISTRICTS:
+        return jsonify({"error": f"invalid district: {data['district']}"}), 400
+    if data.get("source") and data["source"] not in SCRAPERS:
+        return jsonify({"error": f"invalid source: {data['source']}"}), 400
+    try:
+        search = create_saved_search(data)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(search), 201
+
+@app.delete("/api/searches/<int:search_id>")
+def api_delete_saved_search(search_id):
+    if not delete_saved_search(search_id):
+        return jsonify({"error": "search not found"}), 404
+    return jsonify({"ok": True})
+
+@app.get("/api/searches/<int:search_id>/inbox")
+def api_saved_search_inbox(search_id):
+    try:
+        since = request.args.get("since", type=int)
+        limit = max(1, min(int(request.args.get("limit", "100")), 1000))
+    except ValueError:
+        return jsonify({"error": "invalid limit"}), 400
+    inbox = get_inbox(search_id, since, limit)
+    if inbox is None:
+        return jsonify({"error": "search not found"}), 404
+    return jsonify(inbox)
+
+@app.post("/api/searches/<int:search_id>/read")
+def api_saved_search_read(search_id):
+    upto = (request.get_json(silent=True) or {}).get("upto")
+    if upto is not None and not isinstance(upto, int):
+        return jsonify({"error": "invalid upto"}), 400
+    if not mark_inbox_read(search_id, upto):
+        return jsonify({"error": "search not found"}), 404
+    return jsonify({"ok": True})
+
 @app.get("/api/marks")
 def api_get_marks():
-    return jsonify(_load_marks())
+    since = request.args.get("since")
+    if since is None:
+        # Legacy shape: the full {url: state} map
+        return jsonify(get_marks())
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({"error": "invalid since"}), 400
+    return jsonify(get_marks_since(since))
 
 @app.post("/api/marks")
 def api_post_mark():
@@ -153,18 +396,61 @@ def api_post_mark():
         state = (data.get("state") or "").strip() or None
         if not url:
             return jsonify({"error": "missing url"}), 400
-        marks = _load_marks()
-        if state in ("loved", "discarded"):
-            marks[url] = state
-        else:
-            # clear mark when state invalid/empty
-            if url in marks:
-                del marks[url]
-        _save_marks(marks)
-        return jsonify({"ok": True, "state": marks.get(url)})
+        # invalid/empty state clears the mark
+        state, rev = set_mark(url, state)
+        return jsonify({"ok": True, "state": state, "rev": rev})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.post("/api/marks/batch")
+def api_post_marks_batch():
+    try:
+        data = request.get_json(force=True) or {}
+        changes = []
+        for ch in data.get("changes") or []:
+            url = (ch.get("url") or "").strip()
+            if url:
+                changes.append((url, (ch.get("state") or "").strip() or None))
+        if not changes:
+            return jsonify({"error": "no changes"}), 400
+        result = set_marks(changes)
+        return jsonify({"ok": True, "rev": result["rev"], "marks": result["marks"]})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.get("/api/marks/listings")
+def api_marked_listings():
+    state = request.args.get("state") or None
+    if state and state not in ("loved", "discarded"):
+        return jsonify({"error": "invalid state"}), 400
+    return jsonify(get_marked_listings(
+        state=state,
+        district=request.args.get("district") or None,
+        search_type=request.args.get("search_type") or None,
+        typology=request.args.get("typology") or None,
+    ))
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # Point-in-time values from the transport, throttles, URL index and detail queue
+    transport = transport_stats()
+    for host, s in transport["hosts"].items():
+        for k in ("requests", "connections", "tls_handshakes"):
+            metrics.set_total(f"transport_{k}_total", s[k], host=host)
+    for source, s in throttle_status().items():
+        if s["rate_per_sec"] is not None:
+            metrics.set_gauge("throttle_rate_per_second", s["rate_per_sec"], source=source)
+        metrics.set_gauge("breaker_open", 1 if s["breaker"] == "open" else 0, source=source)
+    # Never load the index from a scrape; the gauges appear once the background load is done
+    if URL_INDEX.loaded:
+        index = URL_INDEX.stats()
+        metrics.set_gauge("url_index_urls", index["urls"])
+        metrics.set_gauge("url_index_false_positive_rate", index["false_positive_rate"])
+    for source, counts in detail_queue_stats().items():
+        for status, n in counts.items():
+            metrics.set_gauge("detail_queue", n, source=source, status=status)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     host = os.environ.get("HOST", "127.0.0.1")
     port = int(os.environ.get("PORT", "5000"))
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
+import os
 import logging
+import argparse
 import sys
 from pathlib import Path
 
@@ -8,7 +10,8 @@ PROJECT_ROOT = Path(__file__).resolve().parent.parent
 sys.path.append(str(PROJECT_ROOT))
 
 from services.aggregator import bulk_scrape, run_maintenance
-from services.database import optimize_db
+from services.db import optimize_db
+from services.profiler import profile
 
 # Configure logging
 logging.basicConfig(
@@ -22,21 +25,31 @@ logging.basicConfig(
 logger = logging.getLogger("cron_job")
 
 def main():
+    parser = argparse.ArgumentParser(description="Nightly maintenance, bulk scrape and VACUUM.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Sample the run and write wall/CPU flamegraph stacks plus a JSON summary (or PROFILE=1)")
+    args = parser.parse_args()
+    profiling = args.profile or os.environ.get("PROFILE") == "1"
+
     logger.info("Starting scheduled bulk scrape...")
     
     try:
-        # Run maintenance before scraping
-        logger.info("Maintenance: Checking and fixing district mismatches...")
-        run_maintenance()
-        
-        # Run bulk scrape
-        # We use 2 pages per query for the daily run to get good coverage
-        logger.info("Running bulk scrape (2 pages per query)...")
-        bulk_scrape(pages_per_query=2)
-        
-        # Optimize database after all operations
-        logger.info("Maintenance: Optimizing database (VACUUM)...")
-        optimize_db()
+        with profile("cron_bulk_scrape", enabled=profiling) as prof:
+            # Run maintenance before scraping
+            logger.info("Maintenance: Checking and fixing district mismatches...")
+            with prof.phase("maintenance"):
+                run_maintenance()
+            
+            # Run bulk scrape
+            # We use 2 pages per query for the daily run to get good coverage
+            logger.info("Running bulk scrape (2 pages per query)...")
+            with prof.phase("bulk_scrape"):
+                bulk_scrape(pages_per_query=2)
+            
+            # Optimize database after all operations
+            logger.info("Maintenance: Optimizing database (VACUUM)...")
+            with prof.phase("optimize_db"):
+                optimize_db()
         
         logger.info("Scheduled bulk scrape completed successfully.")
     except Exception as e:
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Writes listings, price history and daily stats to partitioned Parquet/Arrow files for analytics.
+
+    python automation/export_snapshot.py                  # incremental, into exports/
+    python automation/export_snapshot.py --format arrow --out /data/imo
+"""
+import sys
+import logging
+import argparse
+from pathlib import Path
+
+# Add project root to sys.path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from services.snapshot import export_snapshot, TABLES, BATCH_ROWS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+)
+logger = logging.getLogger("export_snapshot")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a read-only columnar snapshot of the database.")
+    parser.add_argument("--out", help="Output directory (default EXPORT_DIR or exports/)")
+    parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+    parser.add_argument("--tables", default=",".join(TABLES), help="Comma list of " + ", ".join(TABLES))
+    parser.add_argument("--full", action="store_true", help="Export everything, ignoring the saved watermarks")
+    parser.add_argument("--batch", type=int, default=BATCH_ROWS, help="Rows read and written per batch")
+    args = parser.parse_args()
+
+    tables = [t for t in args.tables.split(",") if t]
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(sorted(unknown))}")
+    try:
+        written = export_snapshot(args.out, args.format, tables, args.full, args.batch)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    logger.info(f"Snapshot done: {written}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Scrape worker: claims queued scrape tasks from the database and runs them.
+
+Run one or more of these next to the web app; `/api/bulk_scrape` only
+enqueues. Each thread leases one task at a time; a worker killed mid-task
+leaves its lease to expire and another worker (or this one, restarted)
+picks the task up again.
+
+    python automation/worker.py                       # serve the queue until stopped
+    python automation/worker.py --enqueue-bulk 2 --drain   # queue a sweep, run it, exit
+    python automation/worker.py --enqueue-refresh 300 --drain   # spend 300 requests where churn is highest
+    python automation/worker.py --enrich              # also fetch detail pages of new listings
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+# Add project root to sys.path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from scrapers.throttle import SourceBlockedError
+from services.aggregator import SCRAPERS, enqueue_bulk_scrape, run_scrape_task
+from services.scheduler import enqueue_refresh
+from services import enrichment
+from services.db import claim_task, complete_task, fail_task, open_task_count, update_daily_stats, backoff
+from services.profiler import profile
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+)
+logger = logging.getLogger("worker")
+
+STOP = threading.Event()
+
+
+def work(worker_id, poll, drain):
+    while not STOP.is_set():
+        task = claim_task(worker_id)
+        if task is None:
+            if drain and open_task_count() == 0:
+                return
+            STOP.wait(poll)
+            continue
+
+        label = (f"{task['source']} {task['district']}/{task['search_type']}/{task['typology']} "
+                 f"page {task['page']} (attempt {task['attempts']})")
+        try:
+            items, new_items, more = run_scrape_task(task)
+        except SourceBlockedError as e:
+            # Come back once the breaker lets this source through again
+            retry_in = SCRAPERS[task["source"]].breaker.retry_in() + backoff(1)
+            logger.warning(f"{label}: blocked, retrying in {retry_in:.0f}s: {e}")
+            finished = fail_task(task, worker_id, str(e), retry_in)
+        except Exception as e:
+            retry_in = backoff(task["attempts"])
+            logger.error(f"{label}: failed, retrying in {retry_in:.0f}s: {e}")
+            finished = fail_task(task, worker_id, f"{type(e).__name__}: {e}", retry_in)
+        else:
+            logger.info(f"{label}: {items} listings, {new_items} new{', next page queued' if more else ''}")
+            finished = complete_task(task, worker_id, items, new_items, more)
+
+        if finished:
+            logger.info(f"Job {task['job_id']} finished; refreshing daily stats")
+            update_daily_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued scrape tasks.")
+    parser.add_argument("--threads", type=int, default=len(SCRAPERS),
+                        help="Tasks run at once (at most one per source is leased across all workers)")
+    parser.add_argument("--poll", type=float, default=5.0, help="Seconds between polls of an empty queue")
+    parser.add_argument("--drain", action="store_true", help="Exit once no task is queued or running")
+    parser.add_argument("--enqueue-bulk", type=int, metavar="PAGES",
+                        help="Queue a bulk scrape with PAGES pages per search before starting")
+    parser.add_argument("--enqueue-refresh", type=int, metavar="BUDGET",
+                        help="Queue a churn-driven refresh of at most BUDGET page requests before starting")
+    parser.add_argument("--enrich", action="store_true",
+                        help="Fetch queued detail pages in the background (bounded per source)")
+    parser.add_argument("--profile", action="store_true", help="Write a sampled profile of the run to profiles/")
+    args = parser.parse_args()
+
+    if args.enrich:
+        # Tasks run here queue detail pages too, whatever ENRICH_DETAILS says
+        enrichment.ENRICH_DETAILS = True
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        # Let running tasks finish; their leases would otherwise have to expire
+        signal.signal(sig, lambda *_: STOP.set())
+
+    if args.enqueue_bulk:
+        job = enqueue_bulk_scrape(args.enqueue_bulk)
+        logger.info(f"Bulk scrape job {job['job_id']} ({'queued' if job['created'] else 'already open'})")
+    if args.enqueue_refresh:
+        job = enqueue_refresh(args.enqueue_refresh)
+        logger.info(f"Refresh job {job['job_id']} ({'queued' if job['created'] else 'already open or nothing to do'})")
+
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Worker {name} starting {args.threads} threads")
+    with profile("worker", enabled=args.profile) as prof, prof.phase("work"):
+        threads = [
+            threading.Thread(target=work, args=(f"{name}:{i}", args.poll, args.drain), daemon=True)
+            for i in range(args.threads)
+        ]
+        for t in threads:
+            t.start()
+        if args.enrich:
+            # Not waited on: they stop with the work threads
+            enrichment.start_enrichment(SCRAPERS, STOP)
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.5)
+    logger.info(f"Worker {name} stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Record/replay of scraper HTTP traffic, so benchmarks run offline.
+
+In record mode every scraper's session is wrapped and each response body is
+saved by URL; in replay mode the sessions are replaced by a stub that
+serves those bodies (404 for anything not recorded) and the rate limiters
+are lifted, so `get_listings` runs its real parse/clean/save path without
+touching the network.
+
+    python benchmarks/fixtures.py record --district Lisboa --typology T2 --out benchmarks/fixtures/lisboa.json.gz
+"""
+import sys
+import gzip
+import json
+import argparse
+import threading
+from pathlib import Path
+
+import requests
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from scrapers.throttle import AdaptiveRateLimiter, CircuitBreaker
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+class FixtureResponse:
+    """The part of requests.Response the scrapers use."""
+
+    def __init__(self, url, status_code, text):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} for {self.url} (fixture)", response=self)
+
+
+class FixtureStore:
+    """url -> (status, body), loaded from / saved to a gzipped JSON file."""
+
+    def __init__(self, pages=None):
+        self.pages = pages or {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, paths):
+        pages = {}
+        for path in paths:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                pages.update(json.load(f))
+        return cls(pages)
+
+    def save(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self.lock, gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(self.pages, f)
+
+    def get(self, url):
+        hit = self.pages.get(url)
+        if hit is None:
+            return FixtureResponse(url, 404, "")
+        return FixtureResponse(url, hit["status"], hit["text"])
+
+    def put(self, url, status, text):
+        with self.lock:
+            self.pages[url] = {"status": status, "text": text}
+
+
+class ReplaySession:
+    """Session stand-in answering from a FixtureStore."""
+
+    def __init__(self, store):
+        self.store = store
+        self.headers = {}
+        self.cookies = {"fixture": "1"}  # skips the scrapers' cookie warm-up visit
+
+    def get(self, url, **kwargs):
+        return self.store.get(url)
+
+    def head(self, url, **kwargs):
+        return self.store.get(url)
+
+
+class RecordingSession:
+    """Wraps a real session and stores every GET response in a FixtureStore."""
+
+    def __init__(self, session, store):
+        self.session = session
+        self.store = store
+        self.headers = session.headers
+        self.cookies = session.cookies
+
+    def get(self, url, **kwargs):
+        r = self.session.get(url, **kwargs)
+        self.store.put(url, r.status_code, r.text)
+        return r
+
+    def head(self, url, **kwargs):
+        return self.session.head(url, **kwargs)
+
+
+def install_replay(store, scrapers=None):
+    """Points every scraper (default: services.aggregator.SCRAPERS) at the fixtures, unthrottled."""
+    if scrapers is None:
+        from services.aggregator import SCRAPERS as scrapers
+    for scraper in scrapers.values():
+        scraper.session = ReplaySession(store)
+        scraper.limiter = AdaptiveRateLimiter(1e9, 1e9, 1e9, burst=1e9)
+        scraper.breaker = CircuitBreaker()
+
+
+def install_recording(store, scrapers=None):
+    if scrapers is None:
+        from services.aggregator import SCRAPERS as scrapers
+    for scraper in scrapers.values():
+        scraper.session = RecordingSession(scraper.session, store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record scraper fixtures (needs network).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rec = sub.add_parser("record")
+    rec.add_argument("--district", default="Lisboa")
+    rec.add_argument("--typology", default="T2")
+    rec.add_argument("--search-type", default="rent")
+    rec.add_argument("--pages", type=int, default=1)
+    rec.add_argument("--out", default=str(FIXTURES_DIR / "recorded.json.gz"))
+    args = parser.parse_args()
+
+    from scrapers.utils import slugify_pt
+    from services.aggregator import SCRAPERS
+
+    store = FixtureStore()
+    install_recording(store, SCRAPERS)
+    for name, scraper in SCRAPERS.items():
+        try:
+            items = scraper.scrape(args.district, slugify_pt(args.district), args.pages, args.typology, args.search_type)
+            print(f"{name}: {len(items)} items")
+        except Exception as e:
+            print(f"{name}: failed ({e})")
+    store.save(args.out)
+    print(f"Saved {len(store.pages)} pages to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Listings storage before/after the listing_rows migration.
+
+Builds a database with the old layout (`listings` table keyed by the URL
+text, text columns for source/district/search_type/typology) filled with
+synthetic listings, measures it, then lets `init_db` migrate it to the
+integer-keyed, dictionary-encoded `listing_rows` and measures again.
+
+    python benchmarks/listings_schema.py --rows 1000000
+
+Reports the file size, the bytes used by the listings table and its
+indexes, and the median latency of the queries the app runs most.
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import statistics
+import tempfile
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from benchmarks.synthetic import synthetic_listings, SOURCES, TYPOLOGIES
+from services.processor import DISTRICTS
+
+LEGACY_DDL = (
+    """
+    CREATE TABLE listings (
+        url TEXT PRIMARY KEY,
+        source TEXT,
+        district TEXT,
+        title TEXT,
+        price_eur REAL,
+        area_m2 REAL,
+        eur_m2 REAL,
+        search_type TEXT,
+        snippet TEXT,
+        first_seen DATETIME,
+        last_seen DATETIME,
+        typology TEXT,
+        posted_at DATETIME,
+        actualized_at DATETIME,
+        is_active INTEGER DEFAULT 1,
+        property_id INTEGER,
+        id INTEGER
+    )
+    """,
+    "CREATE INDEX idx_listings_search_type ON listings(search_type)",
+    "CREATE INDEX idx_listings_district ON listings(district)",
+    "CREATE INDEX idx_listings_typology ON listings(typology)",
+    "CREATE INDEX idx_listings_posted_at ON listings(posted_at)",
+    "CREATE INDEX idx_listings_property_id ON listings(property_id)",
+    "CREATE UNIQUE INDEX idx_listings_id ON listings(id)",
+)
+
+_COLUMNS = (
+    "url", "source", "district", "title", "price_eur", "area_m2", "eur_m2", "search_type",
+    "snippet", "first_seen", "last_seen", "typology", "posted_at", "is_active",
+)
+
+
+def build_legacy(path, rows):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    for stmt in LEGACY_DDL:
+        cur.execute(stmt)
+    sql = f"INSERT INTO listings (id, {', '.join(_COLUMNS)}) VALUES (?, {', '.join('?' * len(_COLUMNS))})"
+    cur.executemany(sql, (
+        (i + 1, *(item[c] for c in _COLUMNS)) for i, item in enumerate(synthetic_listings(rows))
+    ))
+    conn.commit()
+    conn.close()
+
+
+def storage(path, tables):
+    conn = sqlite3.connect(path)
+    conn.execute("VACUUM")
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT SUM(pgsize) FROM dbstat
+        WHERE name IN ({','.join('?' * len(tables))})
+           OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ({','.join('?' * len(tables))}))
+    """, tables + tables)
+    listing_bytes = cur.fetchone()[0]
+    conn.close()
+    return os.path.getsize(path), listing_bytes
+
+
+def timed(cur, sql, params_list):
+    """Median milliseconds of running `sql` once per params tuple."""
+    samples = []
+    for params in params_list:
+        t = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        samples.append((time.perf_counter() - t) * 1000)
+    return statistics.median(samples)
+
+
+def run_queries(path, rows, url_table):
+    rng = random.Random(1)
+    urls = [item["url"] for item in synthetic_listings(rows)]
+    sample = rng.sample(urls, 2000)
+    combos = [(rng.choice(DISTRICTS), rng.choice(("rent", "buy")), rng.choice(TYPOLOGIES)) for _ in range(30)]
+
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    out = {
+        "listings by district/type/typology": timed(cur, """
+            SELECT * FROM listings WHERE district = ? AND search_type = ? AND typology = ? AND is_active = 1
+        """, combos),
+        "one listing by url": timed(cur, "SELECT * FROM listings WHERE url = ?", [(u,) for u in sample]),
+        "500 known urls (ingest check)": timed(
+            cur, f"SELECT url FROM {url_table} WHERE url IN ({','.join('?' * 500)})",
+            [tuple(sample[i:i + 500]) for i in range(0, 2000, 500)],
+        ),
+        "avg eur/m2 per district/type": timed(cur, """
+            SELECT district, search_type, AVG(eur_m2), COUNT(*) FROM listings
+            WHERE is_active = 1 GROUP BY district, search_type
+        """, [()] * 3),
+        "count per source": timed(cur, """
+            SELECT source, COUNT(*) FROM listings WHERE source = ? AND is_active = 1
+        """, [(s,) for s in SOURCES]),
+    }
+    conn.close()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dir", default=None, help="Where to put the database (default: a temp dir)")
+    args = parser.parse_args()
+
+    workdir = Path(args.dir or tempfile.mkdtemp(prefix="listings_bench_"))
+    path = workdir / "bench.db"
+    if path.exists():
+        path.unlink()
+
+    t = time.perf_counter()
+    build_legacy(path, args.rows)
+    print(f"Built legacy database with {args.rows} listings in {time.perf_counter() - t:.1f}s ({path})")
+    before_size = storage(path, ["listings"])
+    before = run_queries(path, args.rows, "listings")
+
+    # init_db runs on import and migrates the database named by DB_PATH
+    os.environ["DB_PATH"] = str(path)
+    t = time.perf_counter()
+    import services.db  # noqa: F401
+    print(f"Migrated in {time.perf_counter() - t:.1f}s (includes building the stats cube and rollups)")
+    after_size = storage(path, ["listing_rows", "sources", "districts", "search_types", "typologies"])
+    after = run_queries(path, args.rows, "listing_rows")
+
+    mb = 1024 * 1024
+    print()
+    print(f"{'':38} {'before':>12} {'after':>12}")
+    print(f"{'file size (MB, incl. new tables)':38} {before_size[0] / mb:12.1f} {after_size[0] / mb:12.1f}")
+    print(f"{'listings + indexes (MB)':38} {before_size[1] / mb:12.1f} {after_size[1] / mb:12.1f}")
+    for name in before:
+        print(f"{name + ' (ms)':38} {before[name]:12.3f} {after[name]:12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""End-to-end load benchmark for the API.
+
+Fills a scratch database with synthetic listings, serves `app.py` from an
+in-process threaded werkzeug server with the scrapers replaying recorded
+fixtures (fully offline), and drives `/api/listings`, `/api/stats` and
+`/api/history` from concurrent clients. Reports p50/p95/p99 latency per
+endpoint, throughput and database size.
+
+    python benchmarks/load.py --rows 100000 --concurrency 8 --duration 30
+    python benchmarks/load.py --db /tmp/big.db --rows 10000000 --mix listings=8,stats=1,history=1
+
+Pass --url to drive an already-running server instead (the client threads
+then don't compete with the server for the GIL).
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+import requests
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from benchmarks.synthetic import TYPOLOGIES
+from services.processor import DISTRICTS
+
+logger = logging.getLogger("benchmarks.load")
+
+DEFAULT_MIX = "listings=6,stats=2,history=2"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(REQUESTS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def _listings(rng):
+    return "/api/listings", {
+        "district": rng.choice(DISTRICTS),
+        "typology": rng.choice(TYPOLOGIES),
+        "search_type": rng.choice(("rent", "buy")),
+        "sort": rng.choice(("eur_m2_asc", "price_asc", "price_desc")),
+        "limit": 50,
+        "pages": 1,
+    }
+
+
+def _stats(rng):
+    return "/api/stats", {"collapse": "1" if rng.random() < 0.1 else "0"}
+
+
+def _history(rng):
+    return "/api/history", {
+        "district": rng.choice(DISTRICTS + [""]),
+        "search_type": rng.choice(("rent", "buy")),
+        "typology": rng.choice(TYPOLOGIES),
+        "mode": rng.choice(("scrape", "posted")),
+        "resolution": rng.choice(("day", "week", "month")),
+        "max_points": 300,
+    }
+
+
+REQUESTS = {"listings": _listings, "stats": _stats, "history": _history}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def drive(base_url, mix, concurrency, duration, seed=0):
+    """Runs `concurrency` client threads for `duration` seconds. Returns {endpoint: [ms...]}, errors, elapsed."""
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    samples = {n: [] for n in names}
+    errors = {n: 0 for n in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        rng = random.Random(seed * 1000 + i)
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            path, params = REQUESTS[name](rng)
+            t = time.perf_counter()
+            try:
+                r = session.get(base_url + path, params=params, timeout=60)
+                ok = r.status_code == 200
+            except requests.RequestException:
+                ok = False
+            ms = (time.perf_counter() - t) * 1000
+            with lock:
+                if ok:
+                    samples[name].append(ms)
+                else:
+                    errors[name] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, errors, time.perf_counter() - started
+
+
+def db_size(path):
+    total = 0
+    for suffix in ("", "-wal", "-shm"):
+        p = Path(str(path) + suffix)
+        if p.exists():
+            total += p.stat().st_size
+    return total
+
+
+def report(samples, errors, elapsed, size):
+    total = sum(len(v) for v in samples.values())
+    out = {"elapsed_s": round(elapsed, 2), "requests": total, "throughput_rps": round(total / elapsed, 1),
+           "db_bytes": size, "endpoints": {}}
+    for name, values in samples.items():
+        values.sort()
+        out["endpoints"][name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+        }
+    return out
+
+
+def print_report(out):
+    print()
+    print(f"{'endpoint':12} {'count':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, s in out["endpoints"].items():
+        cells = [f"{s[k]:9.1f}" if s[k] is not None else f"{'-':>9}" for k in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{name:12} {s['count']:8} {s['errors']:7} {' '.join(cells)}")
+    print(f"\n{out['requests']} requests in {out['elapsed_s']}s = {out['throughput_rps']} req/s; "
+          f"database {out['db_bytes'] / 1e6:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, default=100_000, help="Synthetic listings to load (10k-10M)")
+    parser.add_argument("--db", default=None, help="Database file; reused if it already holds listings")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. listings=6,stats=2,history=2")
+    parser.add_argument("--fixtures", nargs="*", default=None,
+                        help="Recorded scraper fixtures (default: every file in benchmarks/fixtures/)")
+    parser.add_argument("--url", default=None, help="Drive this server instead of starting one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    mix = parse_mix(args.mix)
+
+    base_url = args.url
+    path = None
+    if base_url is None:
+        path = Path(args.db) if args.db else Path(tempfile.mkdtemp(prefix="load_bench_")) / "bench.db"
+        # Everything below (init_db on import included) uses this database
+        os.environ["DB_PATH"] = str(path)
+        from services.db.connection import get_connection
+        from benchmarks.synthetic import populate
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM listing_rows")
+        existing = cur.fetchone()[0]
+        conn.close()
+        if existing == 0:
+            logger.info(f"Loading {args.rows} synthetic listings into {path}...")
+            populate(args.rows, seed=args.seed)
+        else:
+            logger.info(f"Reusing {existing} listings in {path}")
+
+        from benchmarks.fixtures import FixtureStore, FIXTURES_DIR, install_replay
+        fixture_files = args.fixtures if args.fixtures is not None else sorted(FIXTURES_DIR.glob("*.json.gz"))
+        store = FixtureStore.load(fixture_files)
+        install_replay(store)
+        logger.info(f"Scrapers replay {len(store.pages)} recorded pages (404 for the rest)")
+
+        from werkzeug.serving import make_server
+        from app import app
+        # Request logs would dominate the run
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+    logger.info(f"Driving {base_url} with {args.concurrency} clients for {args.duration}s, mix {mix}")
+    samples, errors, elapsed = drive(base_url, mix, args.concurrency, args.duration, args.seed)
+    out = report(samples, errors, elapsed, db_size(path) if path else None)
+    if args.json:
+        print(json.dumps(out, indent=2))
+    else:
+        if out["db_bytes"] is None:
+            out["db_bytes"] = 0
+        print_report(out)
+
+
+if __name__ == "__main__":
+    main()
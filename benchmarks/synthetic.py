@@ -0,0 +1,175 @@
+"""Deterministic synthetic listings for benchmarks.
+
+The shape follows what the scrapers produce: six portals, the 19 districts,
+T0-T4, rent and buy prices on a log-normal spread and timestamps over the
+last two years. `populate` loads them (with price-change histories and
+daily_stats snapshots) into the database named by DB_PATH, at 10k-10M rows.
+"""
+import math
+import time
+import random
+import logging
+import datetime
+from services.processor import DISTRICTS
+
+logger = logging.getLogger("benchmarks.synthetic")
+
+# price_points.day counts days since 1970-01-01
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+SOURCES = ("idealista", "imovirtual", "supercasa", "casasapo", "remax", "olx")
+TYPOLOGIES = ("T0", "T1", "T2", "T3", "T4")
+_WORDS = (
+    "apartamento", "moradia", "renovado", "varanda", "garagem", "centro", "vista", "mar",
+    "rio", "cozinha", "equipada", "suite", "terraco", "jardim", "piscina", "metro",
+    "luminoso", "condominio", "elevador", "arrecadacao", "novo", "duplex", "praia", "sol",
+)
+
+
+def synthetic_listings(n, seed=0, now=None):
+    """Yields `n` listing dicts (scraper item shape plus search_type/first_seen/last_seen/is_active)."""
+    rng = random.Random(seed)
+    now = now or datetime.datetime(2025, 1, 1)
+    for i in range(n):
+        source = rng.choice(SOURCES)
+        search_type = "rent" if rng.random() < 0.5 else "buy"
+        typology = rng.choice(TYPOLOGIES)
+        rooms = int(typology[1])
+        area = round(max(20.0, rng.gauss(45 + rooms * 25, 12)), 1)
+        base = 16.0 if search_type == "rent" else 3200.0
+        eur_m2 = base * math.exp(rng.gauss(0, 0.35))
+        price = round(eur_m2 * area, 0)
+        words = rng.sample(_WORDS, 6)
+        first_seen = now - datetime.timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60))
+        last_seen = first_seen + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 60))
+        posted_at = first_seen - datetime.timedelta(days=rng.randint(0, 30))
+        yield {
+            "url": f"https://www.{source}.pt/imovel/{seed}-{i}/",
+            "source": source,
+            "district": rng.choice(DISTRICTS),
+            "title": f"{typology} {' '.join(words[:3])}",
+            "snippet": " ".join(words),
+            "price_eur": price,
+            "area_m2": area,
+            "eur_m2": round(price / area, 2),
+            "search_type": search_type,
+            "typology": typology,
+            "first_seen": first_seen.isoformat(),
+            "last_seen": min(last_seen, now).isoformat(),
+            "posted_at": posted_at.date().isoformat(),
+            "is_active": 1 if rng.random() < 0.9 else 0,
+        }
+
+
+def price_changes(item, rng):
+    """[(date, price)] for a listing: the first price, then 0-4 changes of a few percent."""
+    first = datetime.datetime.fromisoformat(item["first_seen"]).date()
+    last = datetime.datetime.fromisoformat(item["last_seen"]).date()
+    points = [(first, item["price_eur"])]
+    if rng.random() < 0.3 and last > first:
+        price = item["price_eur"]
+        days = sorted(rng.sample(range(1, (last - first).days + 1), min(rng.randint(1, 4), (last - first).days)))
+        for d in days:
+            # Mostly reductions, the occasional increase
+            price = round(price * rng.uniform(0.90, 1.03), 0)
+            points.append((first + datetime.timedelta(days=d), price))
+    return points
+
+
+def _drop_rollup_triggers(cur):
+    cur.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type = 'trigger' AND tbl_name = 'listing_rows'
+          AND (name LIKE 'trg_stats_cube_%' OR name LIKE 'trg_posted_rollup_%')
+    """)
+    for (name,) in cur.fetchall():
+        cur.execute(f"DROP TRIGGER {name}")
+
+
+def populate(rows, seed=0, history_days=365, batch_size=50_000):
+    """Fills the database at DB_PATH with `rows` synthetic listings.
+
+    Writes listing_rows, price_points and `history_days` of daily_stats
+    snapshots in bulk. The stats cube / rollup triggers are dropped during
+    the load and the aggregates rebuilt once at the end, which is what
+    keeps 10M rows practical.
+    """
+    from services.db.connection import get_connection
+    from services.db.schema import dimension_ids
+    from services.db.stats import create_stats_cube, rebuild_stats_cube, create_rollups, rebuild_rollups
+    from services.db.deals import rebuild_deal_scores
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("PRAGMA synchronous = OFF")
+    _drop_rollup_triggers(cur)
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM listing_rows")
+    next_id = cur.fetchone()[0] + 1
+
+    rng = random.Random(seed + 1)
+    dims = {}
+    listing_batch, point_batch = [], []
+    started = time.perf_counter()
+
+    def flush():
+        cur.executemany("""
+            INSERT INTO listing_rows (
+                id, url, source_id, district_id, search_type_id, typology_id, title, price_eur, area_m2,
+                eur_m2, snippet, first_seen, last_seen, posted_at, is_active
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, listing_batch)
+        cur.executemany(
+            "INSERT OR REPLACE INTO price_points (listing_id, day, sec, price_eur) VALUES (?, ?, 0, ?)", point_batch
+        )
+        conn.commit()
+        listing_batch.clear()
+        point_batch.clear()
+
+    for i, item in enumerate(synthetic_listings(rows, seed)):
+        listing_id = next_id + i
+        points = price_changes(item, rng)
+        ids = dimension_ids(cur, item, dims)
+        listing_batch.append((
+            listing_id, item["url"], ids["source_id"], ids["district_id"], ids["search_type_id"],
+            ids["typology_id"], item["title"], points[-1][1], item["area_m2"],
+            round(points[-1][1] / item["area_m2"], 2), item["snippet"], item["first_seen"],
+            item["last_seen"], item["posted_at"], item["is_active"],
+        ))
+        for day, price in points:
+            point_batch.append((listing_id, day.toordinal() - _EPOCH_ORDINAL, price))
+        if len(listing_batch) >= batch_size:
+            flush()
+            logger.info(f"{i + 1}/{rows} listings ({(i + 1) / (time.perf_counter() - started):.0f}/s)")
+    flush()
+
+    # daily_stats snapshots: each group's current average, drifting back in time
+    cur.execute("""
+        SELECT district, search_type, typology, AVG(eur_m2), AVG(price_eur), COUNT(*)
+        FROM listings WHERE is_active = 1 GROUP BY 1, 2, 3
+    """)
+    groups = cur.fetchall()
+    today = datetime.date.today()
+    snapshots = []
+    for district, search_type, typology, eur_m2, price, count in groups:
+        drift = 1.0
+        for d in range(history_days):
+            day = today - datetime.timedelta(days=d)
+            snapshots.append((
+                day.isoformat(), district, search_type, typology,
+                eur_m2 * drift, price * drift, max(1, int(count * drift)), max(1, int(count * drift * 0.8)),
+            ))
+            drift *= rng.uniform(0.997, 1.002)
+    cur.executemany("""
+        INSERT OR REPLACE INTO daily_stats (
+            date, district, search_type, typology, avg_eur_m2, avg_price_eur, count, unique_count
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, snapshots)
+
+    create_stats_cube(cur)
+    create_rollups(cur)
+    rebuild_stats_cube(cur)
+    rebuild_rollups(cur)
+    rebuild_deal_scores(cur)
+    conn.commit()
+    conn.close()
+    logger.info(f"Populated {rows} listings in {time.perf_counter() - started:.1f}s")
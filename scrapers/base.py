@@ -1,9 +1,16 @@
-import time
-import random
+import re
+import datetime
 import requests
 import logging
 from bs4 import BeautifulSoup
 
+from scrapers.throttle import CircuitBreaker, SourceBlockedError, get_breaker, get_limiter
+from scrapers.transport import new_session
+from scrapers.utils import (
+    json_ld_objects, parse_area_m2, parse_floor, parse_energy_rating, parse_coordinates, parse_portuguese_date,
+)
+from services import metrics
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -11,13 +18,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger("scrapers")
 
+# Status codes the portals use to push back on scraping
+SOFT_BLOCK_CODES = (429, 403, 503)
+
 class BaseScraper:
     name = "base"
     base = ""
+    # Requests/second: starting rate and the bounds the adaptive limiter stays in
+    rate = 1.0
+    min_rate = 0.05
+    max_rate = 2.0
+    # Send the previous result page as Referer, like a person paging through results
+    chain_referer = False
+    # Detail pages fetched at once by the enrichment stage
+    detail_concurrency = 2
+    # Where the full description lives on detail pages, tried in order
+    description_selectors = ('[itemprop="description"]', ".comment", ".description", "#description")
 
     def __init__(self):
         self.logger = logging.getLogger(f"scrapers.{self.name}")
-        self.session = requests.Session()
+        # Limiter and breaker are shared by every scraper instance of the same source
+        self.limiter = get_limiter(self.name, self.rate, self.min_rate, self.max_rate)
+        self.breaker = get_breaker(self.name)
+        # Own cookies/headers, but connection pools and DNS cache are shared process-wide
+        self.session = new_session()
         # Use a realistic desktop browser UA and common headers to reduce bot-blocking
         self.session.headers.update({
             "User-Agent": (
@@ -39,7 +63,15 @@ class BaseScraper:
             "DNT": "1"
         })
 
-    def fetch(self, url: str) -> str:
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise SourceBlockedError(
+                f"{self.name} is blocking us; circuit open for another {self.breaker.retry_in():.0f}s"
+            )
+
+    def fetch(self, url: str, extra_headers: dict = None) -> str:
+        self._check_breaker()
+
         self.logger.info(f"Fetching URL: {url}")
         from urllib.parse import urlparse
         parsed = urlparse(url)
@@ -53,46 +85,210 @@ class BaseScraper:
                  # Visit a common entry point first
                  # Use very minimal headers for origin visit
                  h = {"User-Agent": self.session.headers.get("User-Agent"), "Accept": "text/html"}
+                 self.limiter.acquire()
                  self.session.get(origin, timeout=15, headers=h)
-                 self.polite_sleep()
-             except:
+             except Exception:
                  pass
 
         for attempt in range(2):
-            try:
-                # Use a Referer that looks like a search engine or the site itself
-                headers = {"Referer": origin}
-                if attempt > 0:
-                     headers["Referer"] = "https://www.google.com/"
-                     # Update headers to match a Windows Chrome on retry
-                     self.session.headers.update({
-                         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36",
-                         "Sec-Ch-Ua-Platform": '"Windows"'
-                     })
+            # The first attempt's failure may have opened the circuit (or another
+            # worker's may have); a half-open breaker only lets its one trial through
+            if attempt > 0:
+                self._check_breaker()
+            # Use a Referer that looks like a search engine or the site itself
+            headers = {"Referer": origin}
+            if extra_headers:
+                headers.update(extra_headers)
+            if attempt > 0:
+                 headers["Referer"] = "https://www.google.com/"
+                 # Update headers to match a Windows Chrome on retry
+                 self.session.headers.update({
+                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36",
+                     "Sec-Ch-Ua-Platform": '"Windows"'
+                 })
 
+            try:
+                # The limiter paces every request to this source (no fixed sleeps)
+                self.limiter.acquire()
                 r = self.session.get(url, timeout=25, headers=headers, allow_redirects=True)
-                # Retry on common soft-block status codes
-                if r.status_code in (429, 403, 503) and attempt == 0:
-                    self.logger.warning(f"Soft-block status code {r.status_code} for {url}. Sleeping and retrying...")
-                    self.polite_sleep()
-                    continue
+            except Exception as e:
+                last_exc = e
+                self.breaker.record_error()
+                self.logger.error(f"Error fetching {url} (attempt {attempt+1}): {e}")
+                continue
+
+            # Soft-block: slow this source down and let the breaker count it
+            if r.status_code in SOFT_BLOCK_CODES:
+                self.limiter.on_block()
+                self.breaker.record_block()
+                last_exc = requests.HTTPError(f"Soft-block status code {r.status_code} for {url}", response=r)
+                self.logger.warning(
+                    f"Soft-block status code {r.status_code} for {url}. "
+                    f"Rate lowered to {self.limiter.rate:.3f} req/s."
+                )
+                if self.breaker.state == CircuitBreaker.OPEN:
+                    self.logger.error(f"Circuit opened for {self.name} after repeated blocks.")
+                    break
+                continue
+
+            try:
                 r.raise_for_status()
-                return r.text
             except Exception as e:
                 last_exc = e
+                self.breaker.record_error()
                 self.logger.error(f"Error fetching {url} (attempt {attempt+1}): {e}")
-                if attempt == 0:
-                    self.polite_sleep()
-                    continue
+                continue
+
+            self.limiter.on_success()
+            self.breaker.record_success()
+            return r.text
+
         # If we reach here, raise the last exception
         self.logger.error(f"Failed to fetch {url} after retries.")
         raise last_exc
 
+    def fetch_detail(self, url: str) -> tuple:
+        """One GET of a listing's detail page, as (status code, html); the caller has already taken a limiter token.
+
+        No retry: enrichment just comes back later. Blocks and errors still
+        feed the source's limiter and breaker, which the main scrape shares.
+        """
+        if not self.breaker.allow():
+            raise SourceBlockedError(
+                f"{self.name} is blocking us; circuit open for another {self.breaker.retry_in():.0f}s"
+            )
+        with metrics.timer("scraper_stage_seconds", source=self.name, stage="detail"):
+            try:
+                r = self.session.get(url, timeout=25, headers={"Referer": self.base + "/"}, allow_redirects=True)
+            except Exception:
+                self.breaker.record_error()
+                raise
+        if r.status_code in SOFT_BLOCK_CODES:
+            self.limiter.on_block()
+            self.breaker.record_block()
+            raise SourceBlockedError(f"Soft-block status code {r.status_code} for {url}")
+        if r.status_code not in (404, 410):
+            try:
+                r.raise_for_status()
+            except Exception:
+                self.breaker.record_error()
+                raise
+        self.limiter.on_success()
+        self.breaker.record_success()
+        metrics.inc("detail_pages_total", source=self.name)
+        # Gone listings still answer; the caller decides what a 404 means
+        return r.status_code, r.text
+
+    def parse_detail(self, html: str) -> dict:
+        """Fields from a listing detail page: description, area_m2, floor, energy_rating, latitude, longitude, posted_at.
+
+        Generic: JSON-LD, meta tags and Portuguese label patterns, which the
+        portals share. Missing fields are None; scrapers can override.
+        """
+        soup = self.soup(html)
+        ld = json_ld_objects(soup)
+        out = dict.fromkeys(("description", "area_m2", "floor", "energy_rating", "latitude", "longitude", "posted_at"))
+
+        for obj in ld:
+            if not out["description"] and isinstance(obj.get("description"), str):
+                out["description"] = obj["description"].strip()
+            size = obj.get("floorSize")
+            if out["area_m2"] is None and isinstance(size, dict):
+                try:
+                    out["area_m2"] = float(str(size.get("value")).replace(",", "."))
+                except ValueError:
+                    pass
+            if not out["posted_at"] and isinstance(obj.get("datePosted"), str):
+                try:
+                    out["posted_at"] = datetime.datetime.fromisoformat(obj["datePosted"][:19]).isoformat()
+                except ValueError:
+                    pass
+        if not out["description"]:
+            for sel in self.description_selectors:
+                node = soup.select_one(sel)
+                if node and node.get_text(strip=True):
+                    out["description"] = node.get_text(" ", strip=True)
+                    break
+        if not out["description"]:
+            meta = soup.select_one('meta[property="og:description"], meta[name="description"]')
+            if meta and meta.get("content"):
+                out["description"] = meta["content"].strip()
+
+        text = soup.get_text(" ", strip=True)
+        if out["area_m2"] is None:
+            # Only labelled areas: a bare "m²" on a detail page may belong to a neighbouring ad
+            m = re.search(r"[áa]rea\s*(?:[úu]til|bruta|habitacional)?\s*[:\-]?\s*\d", text, re.IGNORECASE)
+            if m:
+                out["area_m2"] = parse_area_m2(text[m.start():m.start() + 60])
+        out["floor"] = parse_floor(text)
+        out["energy_rating"] = parse_energy_rating(text)
+        coords = parse_coordinates(soup, html, ld)
+        if coords:
+            out["latitude"], out["longitude"] = coords
+        if not out["posted_at"]:
+            m = re.search(r"(?:publicado|anúncio atualizado|atualizado)[^.]{0,40}", text, re.IGNORECASE)
+            if m:
+                out["posted_at"] = parse_portuguese_date(m.group(0))
+        return out
+
     def soup(self, html: str) -> BeautifulSoup:
         return BeautifulSoup(html, "lxml")
 
-    def polite_sleep(self):
-        time.sleep(random.uniform(0.6, 1.3))
-
-    def scrape(self, district_name: str, district_slug: str, pages: int, typology: str = "T2", search_type: str = "rent"):
+    def build_url(self, district_slug: str, page: int, typology: str = "T2", search_type: str = "rent") -> str:
         raise NotImplementedError
+
+    def parse_page(self, html: str, district_name: str, search_type: str = "rent"):
+        """Parses one result page; scrapers whose parser needs the search type override this."""
+        return self.parse_listings(html, district_name)
+
+    def scrape_page(self, district_name: str, district_slug: str, page: int, typology: str = "T2",
+                    search_type: str = "rent", referer: str = None):
+        """Fetches and parses a single result page. Returns (page_url, items)."""
+        url = self.build_url(district_slug, page, typology, search_type)
+        with metrics.timer("scraper_stage_seconds", timing=f"fetch.{self.name}", source=self.name, stage="fetch"):
+            html = self.fetch(url, extra_headers={"Referer": referer} if referer else None)
+        metrics.inc("scraper_pages_total", source=self.name)
+        metrics.inc("scraper_bytes_total", len(html.encode("utf-8")), source=self.name)
+        with metrics.timer("scraper_stage_seconds", timing=f"parse.{self.name}", source=self.name, stage="parse"):
+            items = self.parse_page(html, district_name, search_type)
+        metrics.inc("scraper_listings_total", len(items), source=self.name)
+        return url, items
+
+    def scrape(self, district_name: str, district_slug: str, pages: int, typology: str = "T2",
+               search_type: str = "rent", known_urls=None):
+        """Walks result pages in order and stops as soon as a page brings nothing new.
+
+        `known_urls` is an optional callable that takes a list of URLs and
+        returns the subset already stored; when every listing on a page is
+        known, the following pages are assumed to be known too.
+        """
+        out = []
+        seen = set()
+        last_url = self.base + "/"
+        for page in range(1, pages + 1):
+            try:
+                url, items = self.scrape_page(
+                    district_name, district_slug, page, typology, search_type,
+                    referer=last_url if self.chain_referer else None,
+                )
+            except Exception as e:
+                # Nothing scraped yet: let the caller see the failure
+                if not out:
+                    raise
+                self.logger.warning(f"Stopping at page {page}, keeping {len(out)} listings: {e}")
+                break
+            last_url = url
+
+            fresh = [x for x in items if x.get("url") and x["url"] not in seen]
+            seen.update(x["url"] for x in fresh)
+            out.extend(fresh)
+
+            if not fresh:
+                self.logger.info(f"Page {page} returned no new listings, stopping pagination.")
+                break
+            if known_urls is not None and page < pages:
+                known = known_urls([x["url"] for x in fresh])
+                if len(known) >= len(fresh):
+                    self.logger.info(f"All {len(fresh)} listings on page {page} are already known, stopping pagination.")
+                    break
+        return out
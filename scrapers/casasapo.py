@@ -80,11 +80,5 @@ class CasaSapoScraper(BaseScraper):
             out.append(x)
         return out
 
-    def scrape(self, district_name: str, district_slug: str, pages: int, typology: str = "T2", search_type: str = "rent"):
-        out = []
-        for page in range(1, pages + 1):
-            url = self.build_url(district_slug, page, typology, search_type)
-            html = self.fetch(url)
-            out.extend(self.parse_listings(html, district_name, search_type))
-            self.polite_sleep()
-        return out
+    def parse_page(self, html: str, district_name: str, search_type: str = "rent"):
+        return self.parse_listings(html, district_name, search_type)
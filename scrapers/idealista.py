@@ -1,6 +1,4 @@
 import re
-import time
-import random
 from scrapers.base import BaseScraper
 from scrapers.utils import (
     parse_eur_amount, parse_area_m2, parse_eur_m2, 
@@ -10,6 +8,15 @@ from scrapers.utils import (
 class IdealistaScraper(BaseScraper):
     name = "idealista"
     base = "https://www.idealista.pt"
+    # Idealista is very aggressive with bot detection: start at roughly one
+    # request every 11 s (the old 7-15 s sleep) and never go faster than one per 5 s
+    rate = 1 / 11
+    min_rate = 1 / 60
+    max_rate = 1 / 5
+    # Human-like pagination: each page is requested with the previous one as Referer
+    chain_referer = True
+    # Detail pages compete for the same slow budget: one at a time
+    detail_concurrency = 1
 
     def build_url(self, district_slug: str, page: int, typology: str = "T2", search_type: str = "rent") -> str:
         # /arrendar-casas/<distrito>-distrito/[com-tN]/ + /pagina-2
@@ -92,26 +99,3 @@ class IdealistaScraper(BaseScraper):
                 "actualized_at": actualized_at,
             })
         return items
-
-    def scrape(self, district_name: str, district_slug: str, pages: int, typology: str = "T2", search_type: str = "rent"):
-        out = []
-        # Human-like pagination: maintain a Referer that points to the previous page
-        # and visit the home page first if we don't have a session yet.
-        # Requirement: go to random pages until all entries are filled.
-        last_url = self.base + "/"
-        page_indices = list(range(1, pages + 1))
-        random.shuffle(page_indices)
-        
-        for page in page_indices:
-            url = self.build_url(district_slug, page, typology, search_type)
-            html = self.fetch(url, extra_headers={"Referer": last_url})
-            out.extend(self.parse_listings(html, district_name))
-            last_url = url
-            self.polite_sleep()
-        return out
-
-    def polite_sleep(self):
-        # Idealista is very aggressive with bot detection, 
-        # so we use a much longer and more variable sleep time.
-        # Human-like: 7 to 15 seconds
-        time.sleep(random.uniform(7.0, 15.0))
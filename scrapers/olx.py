@@ -1,7 +1,7 @@
 from scrapers.base import BaseScraper
 from scrapers.utils import (
     parse_eur_amount, parse_area_m2, parse_eur_m2, 
-    parse_typology, parse_portuguese_date, absolutize
+    parse_typology, parse_portuguese_date, absolutize, in_portugal
 )
 
 
@@ -130,6 +130,16 @@ class OLXScraper(BaseScraper):
                     posted_at = to_iso(created_time)
                     actualized_at = to_iso(refresh_time)
 
+                    # Ads carry the pin of their map (exact or approximate)
+                    latitude = longitude = None
+                    ad_map = ad.get("map") or {}
+                    try:
+                        lat, lng = float(ad_map.get("lat")), float(ad_map.get("lon"))
+                        if in_portugal(lat, lng):
+                            latitude, longitude = lat, lng
+                    except (TypeError, ValueError):
+                        pass
+
                     if not typology:
                         typology = parse_typology(title)
 
@@ -152,6 +162,8 @@ class OLXScraper(BaseScraper):
                         "typology": typology,
                         "posted_at": posted_at,
                         "actualized_at": actualized_at,
+                        "latitude": latitude,
+                        "longitude": longitude,
                     })
                 
                 if items:
@@ -171,12 +183,3 @@ class OLXScraper(BaseScraper):
             seen.add(x["url"])
             out.append(x)
         return out
-
-    def scrape(self, district_name: str, district_slug: str, pages: int, typology: str = "T2", search_type: str = "rent"):
-        out = []
-        for page in range(1, pages + 1):
-            url = self.build_url(district_slug, page, typology, search_type)
-            html = self.fetch(url)
-            out.extend(self.parse_listings(html, district_name))
-            self.polite_sleep()
-        return out
@@ -0,0 +1,190 @@
+import time
+import random
+import threading
+
+
+class SourceBlockedError(RuntimeError):
+    """Raised when a source's circuit breaker is open and requests are refused."""
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate adapts with AIMD.
+
+    Every success adds `increase` requests/second to the rate (additive
+    increase); every soft-block multiplies it by `decrease` (multiplicative
+    decrease). The rate is always kept within [min_rate, max_rate].
+    """
+
+    def __init__(self, rate, min_rate, max_rate, burst=1.0, increase=None, decrease=0.5, jitter=0.3):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        # Default step: 20 clean responses to climb from zero to the ceiling
+        self.increase = increase if increase is not None else max_rate / 20
+        self.decrease = decrease
+        self.jitter = jitter
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        # acquire() calls currently sleeping for a token
+        self.waiting = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        waited = False
+        try:
+            while True:
+                with self.lock:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    wait = (1.0 - self.tokens) / self.rate
+                    if not waited:
+                        waited = True
+                        self.waiting += 1
+                # Randomize the wait a little so the request pattern looks less mechanical
+                time.sleep(wait * random.uniform(1.0, 1.0 + self.jitter))
+        finally:
+            if waited:
+                with self.lock:
+                    self.waiting -= 1
+
+    def try_acquire(self, background=False):
+        """Consume a token only if one is available right now.
+
+        With background=True the token is also refused while an acquire()
+        is waiting, so background work (detail enrichment) only ever uses
+        capacity the main scrape leaves idle.
+        """
+        with self.lock:
+            if background and self.waiting:
+                return False
+            self._refill(time.monotonic())
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_block(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Drop any saved-up burst so the next request really waits
+            self.tokens = min(self.tokens, 0.0)
+
+
+class CircuitBreaker:
+    """Stops traffic to a source after repeated soft-blocks.
+
+    closed -> open after `threshold` consecutive blocks; open -> half-open
+    once `cooldown` seconds have passed, letting a single trial request
+    through; a successful trial closes the circuit, a failed one re-opens it
+    with a doubled cooldown (capped at `max_cooldown`).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=3, cooldown=300.0, max_cooldown=3600.0):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def retry_in(self):
+        with self.lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self.trial_in_flight = False
+
+    def record_error(self):
+        # Network errors and non-block HTTP errors say nothing about blocking,
+        # but a half-open trial that hit one must free the slot for the next try
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_block(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._open()
+            elif self.failures >= self.threshold:
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+
+_LIMITERS = {}
+_BREAKERS = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_limiter(source, rate, min_rate, max_rate):
+    """Returns the process-wide limiter for a source, creating it on first use."""
+    with _REGISTRY_LOCK:
+        if source not in _LIMITERS:
+            _LIMITERS[source] = AdaptiveRateLimiter(rate, min_rate, max_rate)
+        return _LIMITERS[source]
+
+
+def get_breaker(source):
+    """Returns the process-wide circuit breaker for a source."""
+    with _REGISTRY_LOCK:
+        if source not in _BREAKERS:
+            _BREAKERS[source] = CircuitBreaker()
+        return _BREAKERS[source]
+
+
+def throttle_status():
+    """Current rate and breaker state per source (for logs and diagnostics)."""
+    with _REGISTRY_LOCK:
+        names = set(_LIMITERS) | set(_BREAKERS)
+        out = {}
+        for name in sorted(names):
+            lim = _LIMITERS.get(name)
+            br = _BREAKERS.get(name)
+            out[name] = {
+                "rate_per_sec": round(lim.rate, 4) if lim else None,
+                "breaker": br.state if br else None,
+                "consecutive_blocks": br.failures if br else 0,
+            }
+        return out
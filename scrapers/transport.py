@@ -0,0 +1,195 @@
+import os
+import time
+import socket
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+logger = logging.getLogger("scrapers.transport")
+
+# Connections kept per host. Each source scrapes sequentially, so a few
+# cover the scraper plus concurrent maintenance/enrichment traffic.
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get("SCRAPER_MAX_CONNECTIONS_PER_HOST", "4"))
+# Distinct hosts whose pools stay cached (6 portals, their CDNs and redirects)
+MAX_HOSTS = int(os.environ.get("SCRAPER_MAX_HOSTS", "32"))
+DNS_TTL = float(os.environ.get("SCRAPER_DNS_TTL", "300"))
+# Opt-in HTTP/2 (multiplexed, one connection per host); needs `httpx[http2]`
+USE_HTTP2 = os.environ.get("SCRAPER_HTTP2", "0") == "1"
+
+_STATS_LOCK = threading.Lock()
+_HOST_STATS = {}
+_DNS_STATS = {"hits": 0, "misses": 0}
+
+
+def _count(host, field):
+    with _STATS_LOCK:
+        s = _HOST_STATS.setdefault(host, {"requests": 0, "connections": 0, "tls_handshakes": 0})
+        s[field] += 1
+
+
+class DnsCache:
+    """Caches getaddrinfo results for DNS_TTL seconds, shared by every connection."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port):
+        now = time.monotonic()
+        with self.lock:
+            hit = self.entries.get((host, port))
+            if hit and hit[1] > now:
+                _DNS_STATS["hits"] += 1
+                return hit[0]
+        try:
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError:
+            # Let urllib3 resolve (and report the error) itself
+            return host
+        addr = infos[0][4][0]
+        with self.lock:
+            self.entries[(host, port)] = (addr, now + self.ttl)
+            _DNS_STATS["misses"] += 1
+        return addr
+
+
+DNS_CACHE = DnsCache(DNS_TTL)
+
+
+class _CountingMixin:
+    """Counts requests and new sockets per host and connects through the DNS cache."""
+
+    def _new_conn(self):
+        # Only the socket target changes; Host header, SNI and certificate
+        # checks keep using the real hostname
+        dns_host = self._dns_host
+        self._dns_host = DNS_CACHE.resolve(dns_host, self.port)
+        try:
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = dns_host
+        _count(self.host, "connections")
+        if isinstance(self, HTTPSConnection):
+            _count(self.host, "tls_handshakes")
+        return sock
+
+    def request(self, *args, **kwargs):
+        _count(self.host, "requests")
+        return super().request(*args, **kwargs)
+
+
+class CountingHTTPConnection(_CountingMixin, HTTPConnection):
+    pass
+
+
+class CountingHTTPSConnection(_CountingMixin, HTTPSConnection):
+    pass
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+class SharedAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools count connection reuse and use the DNS cache."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+# One adapter (and so one set of per-host keep-alive pools) for the whole
+# process; sessions keep their own cookies and headers on top of it
+ADAPTER = SharedAdapter(pool_connections=MAX_HOSTS, pool_maxsize=MAX_CONNECTIONS_PER_HOST, max_retries=0)
+
+
+class Http2Session:
+    """Minimal requests.Session look-alike backed by an HTTP/2 httpx client."""
+
+    def __init__(self):
+        import httpx
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=MAX_HOSTS * MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=MAX_HOSTS,
+            ),
+        )
+        self.headers = self.client.headers
+        self.cookies = self.client.cookies
+
+    def _trace(self, host):
+        def trace(event, info):
+            if event == "connection.connect_tcp.complete":
+                _count(host, "connections")
+            elif event == "connection.start_tls.complete":
+                _count(host, "tls_handshakes")
+        return trace
+
+    def request(self, method, url, timeout=None, headers=None, allow_redirects=True):
+        import httpx
+        host = httpx.URL(url).host
+        _count(host, "requests")
+        return self.client.request(
+            method, url, timeout=timeout, headers=headers, follow_redirects=allow_redirects,
+            extensions={"trace": self._trace(host)},
+        )
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+
+def new_session():
+    """A session on the shared transport: HTTP/2 when enabled and available, else pooled HTTP/1.1."""
+    if USE_HTTP2:
+        try:
+            return Http2Session()
+        except ImportError:
+            logger.warning("SCRAPER_HTTP2=1 but httpx[http2] is not installed; using HTTP/1.1 pools.")
+    session = requests.Session()
+    session.mount("https://", ADAPTER)
+    session.mount("http://", ADAPTER)
+    return session
+
+
+_SHARED = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_session():
+    """Process-wide cookie-less session for one-off requests (e.g. liveness checks)."""
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = new_session()
+            _SHARED.headers.update({"User-Agent": "Mozilla/5.0"})
+        return _SHARED
+
+
+def transport_stats():
+    """Requests, new connections and TLS handshakes per host, with the reuse ratio."""
+    with _STATS_LOCK:
+        hosts = {h: dict(s) for h, s in _HOST_STATS.items()}
+        dns = dict(_DNS_STATS)
+    total = {"requests": 0, "connections": 0, "tls_handshakes": 0}
+    for s in hosts.values():
+        for k in total:
+            total[k] += s[k]
+    for s in list(hosts.values()) + [total]:
+        # Share of requests served on an already-open connection
+        s["reuse_ratio"] = round(1 - s["connections"] / s["requests"], 4) if s["requests"] else None
+    return {"hosts": hosts, "total": total, "dns": dns, "http2": USE_HTTP2}
@@ -147,3 +147,91 @@ def parse_portuguese_date(text: str):
 
 def absolutize(base: str, href: str) -> str:
     return urljoin(base, href)
+
+def json_ld_objects(soup):
+    """Every JSON object in the page's <script type="application/ld+json"> blocks, nested ones included."""
+    import json
+    out = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            out.append(node)
+            for v in node.values():
+                walk(v)
+        elif isinstance(node, list):
+            for v in node:
+                walk(v)
+
+    for tag in soup.select('script[type="application/ld+json"]'):
+        try:
+            walk(json.loads(tag.string or tag.get_text() or ""))
+        except ValueError:
+            continue
+    return out
+
+def parse_floor(text: str):
+    """Floor as a short string: "r/c", "cave", "sótão" or the number ("3")."""
+    if not text:
+        return None
+    t = text.lower()
+    m = re.search(r"(\d{1,2})\s*(?:º|o|ª)?\s*(?:andar|piso)\b", t)
+    if m:
+        return m.group(1)
+    m = re.search(r"\b(?:andar|piso)\s*[:\-]?\s*(\d{1,2})\b", t)
+    if m:
+        return m.group(1)
+    if re.search(r"r[ée]s[\s\-]do[\s\-]ch[ãa]o|\br/c\b", t):
+        return "r/c"
+    if re.search(r"\bcave\b|\bsubcave\b", t):
+        return "cave"
+    if re.search(r"\bs[óo]t[ãa]o\b", t):
+        return "sótão"
+    return None
+
+def parse_energy_rating(text: str):
+    """Energy certificate class (A+ ... F) or "isento"."""
+    if not text:
+        return None
+    m = re.search(
+        r"(?:certifica(?:do|ção)\s+energ[ée]tic[oa]|classe\s+energ[ée]tica|efici[êe]ncia\s+energ[ée]tica)"
+        r"\s*[:\-]?\s*(?:classe\s*)?(A\+|A|B-|B|C|D|E|F|isento|em\s+tr[âa]mite)",
+        text, re.IGNORECASE,
+    )
+    if not m:
+        return None
+    v = m.group(1)
+    return v.upper() if len(v) <= 2 else v.lower()
+
+def in_portugal(lat, lng):
+    # Mainland, Madeira and the Azores
+    return 32.0 <= lat <= 42.5 and -31.5 <= lng <= -6.0
+
+def parse_coordinates(soup, html: str, ld_objects=()):
+    """(latitude, longitude) from JSON-LD geo, map meta tags or inline map settings; None if nothing plausible."""
+    candidates = []
+    for obj in ld_objects:
+        geo = obj.get("geo") if isinstance(obj.get("geo"), dict) else obj
+        if "latitude" in geo and "longitude" in geo:
+            candidates.append((geo["latitude"], geo["longitude"]))
+    lat = soup.select_one('meta[property="place:location:latitude"], meta[name="latitude"]')
+    lng = soup.select_one('meta[property="place:location:longitude"], meta[name="longitude"]')
+    if lat and lng:
+        candidates.append((lat.get("content"), lng.get("content")))
+    pos = soup.select_one('meta[name="geo.position"], meta[name="ICBM"]')
+    if pos and pos.get("content"):
+        parts = re.split(r"[;,]\s*", pos["content"])
+        if len(parts) >= 2:
+            candidates.append((parts[0], parts[1]))
+    for p in (
+        r'"lat(?:itude)?"\s*:\s*"?(-?\d+\.\d+)"?\s*,\s*"(?:lng|lon|longitude)"\s*:\s*"?(-?\d+\.\d+)',
+        r'data-lat(?:itude)?="(-?\d+\.\d+)"[^>]*data-(?:lng|lon|longitude)="(-?\d+\.\d+)"',
+    ):
+        candidates.extend(m.groups() for m in re.finditer(p, html))
+    for lat, lng in candidates:
+        try:
+            lat, lng = float(lat), float(lng)
+        except (TypeError, ValueError):
+            continue
+        if in_portugal(lat, lng):
+            return lat, lng
+    return None
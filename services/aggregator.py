@@ -1,5 +1,9 @@
+import os
 import time
 import logging
+import datetime
+import threading
+import contextvars
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from scrapers.idealista import IdealistaScraper
@@ -8,9 +12,18 @@ from scrapers.supercasa import SupercasaScraper
 from scrapers.casasapo import CasaSapoScraper
 from scrapers.remax import RemaxScraper
 from scrapers.olx import OLXScraper
+from scrapers.throttle import SourceBlockedError
+from scrapers.transport import shared_session, transport_stats
 from scrapers.utils import slugify_pt
-from services.db import save_listings, get_listings_from_db, update_daily_stats
-from services.processor import apply_filters, clean_data, apply_sort, calculate_stats, apply_sources, DISTRICTS
+from services.db import (
+    save_listings, get_listings_from_db, update_daily_stats, filter_known_urls, enqueue_job, get_listings_in_area,
+    log_queries, get_top_queries,
+)
+from services.processor import (
+    apply_filters, clean_data, apply_sort, calculate_stats, apply_sources, collapse_duplicates, DISTRICTS,
+)
+from services import metrics
+from services.enrichment import fill_from_details, queue_after_save
 from services.property_matcher import normalize_typology, match_property_typology
 
 from cachetools import TTLCache
@@ -28,24 +41,46 @@ SCRAPERS = {
 
 CACHE = TTLCache(maxsize=256, ttl=600)  # Query result cache (10 min)
 
-def get_listings(district, pages, sources, filters, sort, limit, typology, search_type="rent"):
+# Query keys preloaded into CACHE on start (0 disables), and how often query counts are written to query_log
+WARM_QUERIES = int(os.environ.get("WARM_QUERIES", "50"))
+QUERY_LOG_FLUSH_SECONDS = 60.0
+
+_query_counts = {}
+_query_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+# What a bulk scrape sweeps for every district
+BULK_SEARCH_TYPES = ["rent", "buy"]
+BULK_TYPOLOGIES = ["T1", "T2", "T3"]
+
+def get_listings(district, pages, sources, filters, sort, limit, typology, search_type="rent", collapse=False, q=None):
     if district not in DISTRICTS:
         district = "Leiria"
 
     district_slug = slugify_pt(district)
     sources = [s for s in sources if s in SCRAPERS]
     norm_typology = normalize_typology(typology)
+    # The deal sort is served by the database, so `limit` keeps the best-scored listings
+    order = "deal" if sort == "deal" else None
 
-    cache_key = (district, district_slug, pages, tuple(sorted(sources)), norm_typology, search_type, limit)
+    cache_key = (district, district_slug, pages, tuple(sorted(sources)), norm_typology, search_type, limit, q, order)
+    _log_query(cache_key)
     if cache_key in CACHE:
+        metrics.inc("listings_cache_requests_total", result="hit")
         items = CACHE[cache_key]
     else:
+        metrics.inc("listings_cache_requests_total", result="miss")
         # 1. Try search on the database first
-        db_items = get_listings_from_db(district, search_type, norm_typology, limit=limit)
+        with metrics.timer("pipeline_stage_seconds", stage="db_read"):
+            db_items = get_listings_from_db(district, search_type, norm_typology, limit=limit, order=order)
         
         if len(db_items) >= limit:
             logger.info(f"Found sufficient results ({len(db_items)}) in DB for {district} ({search_type}, {typology})")
             items = db_items
+            if q:
+                # Whether to scrape is decided on the whole search; the text query narrows what is returned
+                with metrics.timer("pipeline_stage_seconds", stage="text_search"):
+                    items = get_listings_from_db(district, search_type, norm_typology, limit=limit, q=q, order=order)
         else:
             if db_items:
                 logger.info(f"Found {len(db_items)} results in DB, but need {limit}. Scraping for more...")
@@ -54,60 +89,154 @@ def get_listings(district, pages, sources, filters, sort, limit, typology, searc
 
             # 2. Scrape if not enough data in DB
             scraped_items = []
-            with ThreadPoolExecutor(max_workers=min(8, len(sources) or 1)) as ex:
-                futs = []
+            with metrics.timer("pipeline_stage_seconds", stage="scrape"), \
+                    ThreadPoolExecutor(max_workers=min(8, len(sources) or 1)) as ex:
+                futs = {}
                 for s in sources:
-                    futs.append(ex.submit(SCRAPERS[s].scrape, district, district_slug, pages, typology, search_type))
+                    # Scrapers stop paginating once a page holds only listings we already have.
+                    # Each runs in a copy of this context so its fetch/parse timings reach this request.
+                    futs[ex.submit(
+                        contextvars.copy_context().run,
+                        SCRAPERS[s].scrape, district, district_slug, pages, typology, search_type,
+                        known_urls=filter_known_urls,
+                    )] = s
                 for f in as_completed(futs):
                     try:
                         res = f.result()
                         for item in res:
                             item['search_type'] = search_type
                         scraped_items.extend(res)
+                    except SourceBlockedError as e:
+                        metrics.inc("scraper_errors_total", source=futs[f], kind="blocked")
+                        logger.warning(f"Skipping blocked source: {e}")
                     except Exception as e:
+                        metrics.inc("scraper_errors_total", source=futs[f], kind="error")
                         logger.error(f"Scraper failed with exception: {e}")
 
-            # dedupe por URL
-            seen = {x['url'] for x in db_items if 'url' in x}
-            new_items = []
+            # dedupe por URL (within this scrape; new vs already-stored is
+            # settled by the URL index inside save_listings)
+            seen = set()
+            unique_items = []
             for x in scraped_items:
                 u = x.get("url")
                 if not u or u in seen:
                     continue
                 seen.add(u)
-                new_items.append(x)
-
-            # 3. Clean and Save new items
-            if new_items:
-                cleaned_new = clean_data(new_items, district=district, search_type=search_type)
-                logger.info(f"Saving {len(cleaned_new)} new listings to DB (out of {len(new_items)} scraped)")
-                save_listings(cleaned_new, search_type, norm_typology)
-                update_daily_stats()
+                unique_items.append(x)
+
+            # 3. Clean and Save (inserts new listings, refreshes known ones)
+            if unique_items:
+                with metrics.timer("pipeline_stage_seconds", stage="clean"):
+                    fill_from_details(unique_items)
+                    cleaned = clean_data(unique_items, district=district, search_type=search_type)
+                with metrics.timer("pipeline_stage_seconds", stage="save"):
+                    saved = save_listings(cleaned, search_type, norm_typology)
+                    queue_after_save(unique_items, saved, search_type, norm_typology)
+                refreshed = len(cleaned) - len(saved['inserted'])
+                metrics.inc("listings_saved_total", len(saved['inserted']), outcome="inserted")
+                metrics.inc("listings_saved_total", refreshed, outcome="refreshed")
+                logger.info(
+                    f"Saved {len(saved['inserted'])} new listings and refreshed "
+                    f"{refreshed} known ones (out of {len(unique_items)} scraped)"
+                )
+                with metrics.timer("pipeline_stage_seconds", stage="daily_stats"):
+                    update_daily_stats()
             
             # 4. Final collection
-            items = get_listings_from_db(district, search_type, norm_typology, limit=limit)
+            with metrics.timer("pipeline_stage_seconds", stage="db_reread"):
+                items = get_listings_from_db(district, search_type, norm_typology, limit=limit, q=q, order=order)
             CACHE[cache_key] = items
 
+    return _present(items, sources, filters, sort, typology, collapse)
+
+def _log_query(cache_key):
+    """Counts a query for the access log; the counts are written out at most every QUERY_LOG_FLUSH_SECONDS."""
+    global _query_counts, _last_flush
+    key = cache_key[:1] + cache_key[2:]
+    now = datetime.datetime.now().isoformat()
+    with _query_lock:
+        hits = _query_counts.get(key, (0, now))[0]
+        _query_counts[key] = (hits + 1, now)
+        if time.monotonic() - _last_flush < QUERY_LOG_FLUSH_SECONDS:
+            return
+        counts, _query_counts = _query_counts, {}
+        _last_flush = time.monotonic()
+    try:
+        log_queries(counts)
+    except Exception as e:
+        # The log only steers warm-up; losing a minute of counts is harmless
+        logger.warning(f"Could not write the query log: {e}")
+
+def warm_cache(n=None):
+    """Preloads the `n` most-requested queries (per query_log) into CACHE from the database. Returns how many.
+
+    Only queries the database can answer in full are cached, as in
+    get_listings; the others still go to the scrapers on first request.
+    """
+    n = WARM_QUERIES if n is None else n
+    if n <= 0:
+        return 0
+    started = time.perf_counter()
+    warmed = 0
+    for district, pages, sources, norm_typology, search_type, limit, q, order in get_top_queries(n):
+        cache_key = (district, slugify_pt(district), pages, sources, norm_typology, search_type, limit, q, order)
+        if cache_key in CACHE:
+            continue
+        items = get_listings_from_db(district, search_type, norm_typology, limit=limit, order=order)
+        if len(items) < limit:
+            continue
+        if q:
+            items = get_listings_from_db(district, search_type, norm_typology, limit=limit, q=q, order=order)
+        CACHE[cache_key] = items
+        warmed += 1
+    metrics.inc("listings_cache_warmed_total", warmed)
+    logger.info(f"Cache warm-up: preloaded {warmed} queries in {time.perf_counter() - started:.2f}s")
+    return warmed
+
+def search_area(sources, filters, sort, limit, typology, search_type="rent", collapse=False,
+                bbox=None, center=None, radius_km=None, q=None):
+    """Like get_listings for a bounding box or a radius instead of a district, from the geo index only.
+
+    Portals can't be searched by area, so nothing is scraped; only geocoded
+    listings are found.
+    """
+    sources = [s for s in sources if s in SCRAPERS]
+    with metrics.timer("pipeline_stage_seconds", stage="geo_read"):
+        items = get_listings_in_area(
+            bbox=bbox, center=center, radius_km=radius_km,
+            search_type=None if search_type == "all" else search_type,
+            typology=normalize_typology(typology), limit=limit, q=q,
+        )
+    if center is not None and sort == "distance":
+        # Already nearest first
+        sort = None
+    return _present(items, sources, filters, sort, typology, collapse)
+
+def _present(items, sources, filters, sort, typology, collapse):
     # 5. Apply transient filters, typology matching (if generic search), source filtering and sorting
-    filtered = apply_sources(items, sources)
-    filtered = match_property_typology(filtered, typology)
-    filtered = apply_filters(filtered, filters)
-    sorted_items = apply_sort(filtered, sort)
+    with metrics.timer("pipeline_stage_seconds", stage="filter_sort"):
+        filtered = apply_sources(items, sources)
+        filtered = match_property_typology(filtered, typology)
+        filtered = apply_filters(filtered, filters)
+        sorted_items = apply_sort(filtered, sort) if sort else filtered
+    if collapse:
+        # One row per property: the same flat on several portals shows once
+        with metrics.timer("pipeline_stage_seconds", stage="collapse"):
+            sorted_items = collapse_duplicates(sorted_items)
     
     # 6. Stats of what is VISIBLE
-    stats = calculate_stats(sorted_items)
+    with metrics.timer("pipeline_stage_seconds", stage="stats"):
+        stats = calculate_stats(sorted_items)
     return sorted_items, stats
 
 def bulk_scrape(pages_per_query=1):
     """Run a comprehensive scrape for all districts and typical typologies."""
     logger.info("Starting bulk scrape for all districts...")
     sources = list(SCRAPERS.keys())
-    typologies = ["T1", "T2", "T3"]
-    search_types = ["rent", "buy"]
     
     for district in DISTRICTS:
-        for st in search_types:
-            for ty in typologies:
+        for st in BULK_SEARCH_TYPES:
+            for ty in BULK_TYPOLOGIES:
                 try:
                     logger.info(f"Bulk scraping: {district} | {st} | {ty}")
                     # side effect of saving to DB
@@ -125,14 +254,70 @@ def bulk_scrape(pages_per_query=1):
                 except Exception as e:
                     logger.error(f"Error in bulk scrape for {district}/{st}/{ty}: {e}")
     
-    logger.info("Bulk scrape finished.")
+    logger.info(f"Bulk scrape finished. Transport: {transport_stats()['total']}")
+
+def enqueue_bulk_scrape(pages_per_query=1):
+    """Queues a bulk scrape for the workers (automation/worker.py): one task per source and search.
+
+    Returns {"job_id", "created"}; while the same sweep is still open it is returned instead of a new one.
+    """
+    tasks = [
+        (source, district, st, ty, pages_per_query)
+        for district in DISTRICTS
+        for st in BULK_SEARCH_TYPES
+        for ty in BULK_TYPOLOGIES
+        for source in SCRAPERS
+    ]
+    return enqueue_job("bulk_scrape", {"pages": pages_per_query}, tasks)
+
+def run_scrape_task(task):
+    """Scrapes and stores one result page for a queued task. Returns (items, new_items, more).
+
+    `more` says whether the next page is worth a task: the page held
+    listings and not all of them were already stored.
+    """
+    scraper = SCRAPERS[task["source"]]
+    district, page = task["district"], task["page"]
+    district_slug = slugify_pt(district)
+    referer = None
+    if scraper.chain_referer and page > 1:
+        referer = scraper.build_url(district_slug, page - 1, task["typology"], task["search_type"])
+    _, items = scraper.scrape_page(
+        district, district_slug, page, task["typology"], task["search_type"], referer=referer,
+    )
+
+    seen = set()
+    unique_items = []
+    for x in items:
+        u = x.get("url")
+        if not u or u in seen:
+            continue
+        seen.add(u)
+        x["search_type"] = task["search_type"]
+        unique_items.append(x)
+    if not unique_items:
+        return 0, 0, False
+
+    known = filter_known_urls(list(seen))
+    fill_from_details(unique_items)
+    cleaned = clean_data(unique_items, district=district, search_type=task["search_type"])
+    if cleaned:
+        saved = save_listings(cleaned, task["search_type"], normalize_typology(task["typology"]))
+        queue_after_save(unique_items, saved, task["search_type"], normalize_typology(task["typology"]))
+    new_items = len(unique_items) - len(known)
+    return len(unique_items), new_items, new_items > 0
 
 def run_maintenance():
     """Maintenance task: fix district mismatches and check URL activity"""
     logger.info("Running maintenance: checking all listings for district mismatches and activity...")
-    from services.db import DB_PATH
+    from services.db import DB_PATH, backfill_properties
+
+    # Group listings stored before cross-source dedupe existed
+    backfilled = backfill_properties()
+    if backfilled:
+        logger.info(f"Maintenance: assigned property ids to {backfilled} listings.")
+
     import sqlite3
-    import requests
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     
@@ -142,6 +327,9 @@ def run_maintenance():
     wrong_count = 0
     deactivated_count = 0
     
+    # Liveness checks reuse pooled keep-alive connections instead of a fresh TCP+TLS handshake per URL
+    session = shared_session()
+
     # Simple activity check: only for a sample or all? Let's do a basic HEAD request.
     # To avoid being too slow, we could skip this or do it in parallel.
     # The user said "label the listing has active or not based on the url, that is true maintenence"
@@ -169,7 +357,7 @@ def run_maintenance():
         # We only do this if it wasn't just updated
         try:
             # Short timeout, we don't want to hang
-            resp = requests.head(url, timeout=5, allow_redirects=True, headers={"User-Agent": "Mozilla/5.0"})
+            resp = session.head(url, timeout=5, allow_redirects=True)
             if resp.status_code == 404:
                 cur.execute("UPDATE listings SET is_active = 0 WHERE url = ?", (url,))
                 deactivated_count += 1
@@ -185,3 +373,4 @@ def run_maintenance():
         logger.info("Maintenance: No changes needed.")
     
     conn.close()
+    logger.info(f"Maintenance transport: {transport_stats()['total']}")
@@ -1,6 +1,27 @@
 from .connection import DB_PATH
-from .repository import init_db, save_listings, get_listings_from_db, get_listing_history, optimize_db
-from .stats import get_stats, get_historical_stats, update_daily_stats, get_posted_stats
+from .repository import (
+    init_db, save_listings, get_listings_from_db, get_listing_history, get_listing_histories, optimize_db,
+    filter_known_urls,
+)
+from .url_index import URL_INDEX
+from .dedupe import backfill_properties
+from .marks import get_marks, get_marks_since, set_mark, set_marks, import_marks_file, get_marked_listings
+from .stats import get_stats, get_historical_stats, update_daily_stats, get_posted_stats, get_cube_stats, get_yields
+from .jobs import (
+    enqueue_job, claim_task, complete_task, fail_task, cancel_job, get_jobs, get_job, open_task_count, backoff,
+    get_refresh_history,
+)
+from .geo import get_listings_in_area, haversine_km
+from .search import parse_search
+from .export import iter_listings
+from .changes import get_changes, latest_seq, wait_for_changes
+from .saved_searches import (
+    create_saved_search, get_saved_searches, delete_saved_search, get_inbox, mark_inbox_read, SEARCH_INDEX,
+)
+from .schema import LIST_COLUMNS
+from .query_log import log_queries, get_top_queries
+from .details import queue_details, claim_detail, store_detail, fail_detail, get_cached_details, detail_queue_stats
+from .stats import CUBE_DIMENSIONS, RESOLUTIONS, rebuild_stats_cube, rebuild_rollups, get_slice_activity
 
 def cleanup_old_listings(days=7):
     # Data deletion disabled
@@ -0,0 +1,105 @@
+"""Change feed: new and repriced listings as an append-only log.
+
+`save_listings` appends one row per inserted listing ("new") and per
+price change ("price") to `listing_changes` in the same transaction as
+the change itself. `seq` is an AUTOINCREMENT key, never reused. SQLite
+has a single writer, so sequence numbers become visible in order and a
+consumer that remembers the last `seq` it processed never misses an
+event by asking for `since=<that seq>`.
+
+`wait_for_changes` blocks until something past `since` exists. Writes
+from this process wake it at once; writes from other processes (scrape
+workers) are noticed within POLL_SECONDS.
+"""
+import time
+import sqlite3
+import threading
+from .connection import get_connection
+
+POLL_SECONDS = 1.0
+
+_CHANGED = threading.Condition()
+
+
+def create_changes_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS listing_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            listing_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            price_eur REAL,
+            old_price_eur REAL,
+            changed_at DATETIME
+        )
+    """)
+
+
+def record_changes(cur, events):
+    """Appends (listing_id, kind, price_eur, old_price_eur, changed_at) rows; call inside the writing transaction."""
+    cur.executemany("""
+        INSERT INTO listing_changes (listing_id, kind, price_eur, old_price_eur, changed_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, events)
+
+
+def notify_changes():
+    """Wakes waiters in this process; call after committing recorded changes."""
+    with _CHANGED:
+        _CHANGED.notify_all()
+
+
+def latest_seq():
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(seq), 0) FROM listing_changes")
+    seq = cur.fetchone()[0]
+    conn.close()
+    return seq
+
+
+def get_changes(since=0, limit=500, district=None, search_type=None, source=None):
+    """Events after `since`, oldest first, with the listing's current data.
+
+    Returns {"changes": [...], "next": seq to pass as `since` next time}.
+    `next` moves past filtered-out events too, so a filtered consumer
+    doesn't scan them again.
+    """
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute("SELECT seq FROM listing_changes WHERE seq > ? ORDER BY seq LIMIT 1 OFFSET ?", (since, limit - 1))
+    row = cur.fetchone()
+    # Events considered in this page: (since, upto]
+    if row:
+        upto = row["seq"]
+    else:
+        cur.execute("SELECT COALESCE(MAX(seq), ?) FROM listing_changes", (since,))
+        upto = max(since, cur.fetchone()[0])
+    query = """
+        SELECT c.seq, c.kind, c.price_eur, c.old_price_eur, c.changed_at,
+               l.url, l.title, l.source, l.district, l.search_type, l.typology,
+               l.area_m2, l.eur_m2, l.property_id, l.is_active
+        FROM listing_changes c JOIN listings l ON l.id = c.listing_id
+        WHERE c.seq > ? AND c.seq <= ?
+    """
+    params = [since, upto]
+    for column, value in (("district", district), ("search_type", search_type), ("source", source)):
+        if value:
+            query += f" AND l.{column} = ?"
+            params.append(value)
+    cur.execute(query + " ORDER BY c.seq", params)
+    changes = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return {"changes": changes, "next": upto}
+
+
+def wait_for_changes(since, timeout):
+    """Blocks until an event after `since` exists or `timeout` seconds pass. Returns the latest seq."""
+    deadline = time.monotonic() + timeout
+    while True:
+        seq = latest_seq()
+        remaining = deadline - time.monotonic()
+        if seq > since or remaining <= 0:
+            return seq
+        with _CHANGED:
+            _CHANGED.wait(min(POLL_SECONDS, remaining))
@@ -1,8 +1,11 @@
+import os
 import sqlite3
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
-DB_PATH = PROJECT_ROOT / "data.db"
+# Overridable so benchmarks and scratch runs don't touch the real database
+DB_PATH = Path(os.environ.get("DB_PATH") or PROJECT_ROOT / "data.db")
 
 def get_connection():
-    return sqlite3.connect(DB_PATH)
+    # Worker processes write while the web process reads; wait for locks rather than fail
+    return sqlite3.connect(DB_PATH, timeout=30)
@@ -0,0 +1,153 @@
+"""Deal score: how far below its peers a listing's €/m² is.
+
+Peers are the active listings of the same (district, search_type,
+typology). For each such group `deal_stats` keeps the median and the
+median absolute deviation (MAD) of €/m², and every listing gets
+
+    deal_score = (median - eur_m2) / (1.4826 * MAD)
+
+a robust z-score: 0 is a typical price, 2 is two "standard deviations"
+cheaper than usual, negative is dearer. Median and MAD ignore the odd
+mistyped price that would drag a mean and standard deviation around.
+
+Scores are written at ingest: `save_listings` passes the ids it inserted
+or repriced to `score_listings`, which scores them against their group's
+stored statistics. A group's statistics are recomputed (and the whole
+group rescored in one batch) once the listings scored since the last
+computation reach REFRESH_SHARE of the group, or after REFRESH_AGE.
+`deal_score` is indexed per group, so `sort=deal` reads the top of the
+index instead of scoring anything per request.
+"""
+import datetime
+import logging
+import statistics
+
+logger = logging.getLogger("deals")
+
+# 1.4826 * MAD estimates the standard deviation of normally distributed data
+MAD_SCALE = 1.4826
+# Groups smaller than this get no score
+MIN_GROUP = 5
+REFRESH_SHARE = 0.1
+REFRESH_AGE = datetime.timedelta(days=1)
+
+_GROUP = ("district_id", "search_type_id", "typology_id")
+
+
+def create_deals_schema(cur):
+    """deal_stats and the per-group index on listing_rows.deal_score (added by the listings schema)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS deal_stats (
+            district_id INTEGER NOT NULL,
+            search_type_id INTEGER NOT NULL,
+            typology_id INTEGER NOT NULL,
+            median_eur_m2 REAL,
+            mad_eur_m2 REAL,
+            count INTEGER NOT NULL,
+            pending INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME,
+            PRIMARY KEY (district_id, search_type_id, typology_id)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_listing_rows_deal
+        ON listing_rows(district_id, search_type_id, typology_id, deal_score)
+    """)
+
+
+def _score(eur_m2, median, scale):
+    if eur_m2 is None or median is None:
+        return None
+    return round((median - eur_m2) / scale, 3)
+
+
+def _scale(median, mad):
+    # A group of identical prices has MAD 0; 1% of the median keeps scores finite
+    return MAD_SCALE * max(mad, abs(median) * 0.01, 1e-9)
+
+
+def _refresh_group(cur, key, now):
+    """Recomputes one group's median/MAD from its active listings and rescores all of them in one batch."""
+    cur.execute("""
+        SELECT id, eur_m2 FROM listing_rows
+        WHERE district_id = ? AND search_type_id = ? AND typology_id = ? AND is_active = 1
+    """, key)
+    rows = cur.fetchall()
+    values = [v for _, v in rows if v is not None]
+    if len(values) >= MIN_GROUP:
+        median = statistics.median(values)
+        mad = statistics.median([abs(v - median) for v in values])
+        scale = _scale(median, mad)
+        scores = [(_score(v, median, scale), i) for i, v in rows]
+    else:
+        median = mad = None
+        scores = [(None, i) for i, _ in rows]
+    cur.executemany("UPDATE listing_rows SET deal_score = ? WHERE id = ?", scores)
+    cur.execute("""
+        INSERT OR REPLACE INTO deal_stats (district_id, search_type_id, typology_id, median_eur_m2, mad_eur_m2, count, pending, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+    """, (*key, median, mad, len(values), now.isoformat()))
+    return median, mad
+
+
+def score_listings(cur, listing_ids):
+    """Scores inserted/repriced listings against their groups; call inside the writing transaction.
+
+    Groups whose statistics are missing or stale are recomputed first.
+    """
+    if not listing_ids:
+        return
+    now = datetime.datetime.now()
+    by_group = {}
+    for i in range(0, len(listing_ids), 500):
+        chunk = listing_ids[i:i + 500]
+        cur.execute(f"""
+            SELECT id, {', '.join(_GROUP)}, eur_m2 FROM listing_rows
+            WHERE id IN ({','.join('?' * len(chunk))})
+        """, chunk)
+        for listing_id, *key, eur_m2 in cur.fetchall():
+            by_group.setdefault(tuple(key), []).append((listing_id, eur_m2))
+
+    refreshed = 0
+    for key, listings in by_group.items():
+        cur.execute("""
+            SELECT median_eur_m2, mad_eur_m2, count, pending, updated_at FROM deal_stats
+            WHERE district_id = ? AND search_type_id = ? AND typology_id = ?
+        """, key)
+        row = cur.fetchone()
+        pending = (row[3] if row else 0) + len(listings)
+        stale = (
+            row is None
+            or pending >= max(MIN_GROUP, row[2] * REFRESH_SHARE)
+            or now - datetime.datetime.fromisoformat(row[4]) > REFRESH_AGE
+        )
+        if stale:
+            # Rescores these listings along with the rest of the group
+            _refresh_group(cur, key, now)
+            refreshed += 1
+            continue
+        median, mad = row[0], row[1]
+        if median is None:
+            continue
+        scale = _scale(median, mad)
+        cur.executemany(
+            "UPDATE listing_rows SET deal_score = ? WHERE id = ?",
+            [(_score(v, median, scale), i) for i, v in listings],
+        )
+        cur.execute("""
+            UPDATE deal_stats SET pending = ?
+            WHERE district_id = ? AND search_type_id = ? AND typology_id = ?
+        """, (pending, *key))
+    if refreshed:
+        logger.info(f"Deal statistics refreshed for {refreshed} groups")
+
+
+def rebuild_deal_scores(cur):
+    """Recomputes every group's statistics and scores."""
+    now = datetime.datetime.now()
+    cur.execute("DELETE FROM deal_stats")
+    cur.execute(f"SELECT DISTINCT {', '.join(_GROUP)} FROM listing_rows")
+    groups = cur.fetchall()
+    for key in groups:
+        _refresh_group(cur, key, now)
+    logger.info(f"Deal scores rebuilt for {len(groups)} groups.")
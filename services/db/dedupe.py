@@ -0,0 +1,253 @@
+"""Cross-source duplicate detection (MinHash + LSH banding).
+
+The same flat is often listed on several portals under different URLs.
+Every listing gets a MinHash signature built from its normalized
+title/snippet words plus price and area buckets. The signature is cut into
+bands; listings that share a band bucket (scoped to district, search type
+and a coarse price range) become candidates, and only candidates are
+compared. Listings judged to be the same property share a `property_id`.
+
+Signatures and buckets are keyed by the integer listing id: every listing
+has BANDS bucket rows, so repeating its URL in each would make these
+tables many times the size of the listings themselves.
+"""
+import math
+import array
+import hashlib
+import logging
+from scrapers.utils import slugify_pt
+from .connection import get_connection
+
+logger = logging.getLogger("dedupe")
+
+NUM_HASHES = 64
+BANDS = 32
+ROWS = NUM_HASHES // BANDS
+# Minimum estimated Jaccard similarity for two candidates to be merged
+MIN_SIMILARITY = 0.4
+# Price/area must also agree within these relative tolerances
+PRICE_TOLERANCE = 0.05
+AREA_TOLERANCE = 0.08
+# Bucket tokens are repeated so price/area weigh as much as a few words
+BUCKET_WEIGHT = 4
+
+_MASK64 = (1 << 64) - 1
+
+
+_STOPWORDS = {
+    "a", "o", "as", "os", "de", "do", "da", "dos", "das", "em", "no", "na", "nos", "nas",
+    "e", "com", "para", "por", "um", "uma", "ao", "m2", "eur",
+}
+
+
+def create_dedupe_schema(cur):
+    """properties, listing_signatures and lsh_buckets; moves URL-keyed tables of the first layout over."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS properties (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            canonical_url TEXT
+        )
+    """)
+    cur.execute("PRAGMA table_info(listing_signatures)")
+    url_keyed = "url" in [r[1] for r in cur.fetchall()]
+    if url_keyed:
+        cur.execute("ALTER TABLE listing_signatures RENAME TO listing_signatures_old")
+        cur.execute("ALTER TABLE lsh_buckets RENAME TO lsh_buckets_old")
+        cur.execute("DROP INDEX IF EXISTS idx_lsh_buckets_bucket")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS listing_signatures (
+            listing_id INTEGER PRIMARY KEY,
+            signature BLOB,
+            price_eur REAL,
+            area_m2 REAL,
+            property_id INTEGER
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS lsh_buckets (
+            bucket INTEGER,
+            listing_id INTEGER,
+            PRIMARY KEY (bucket, listing_id)
+        ) WITHOUT ROWID
+    """)
+    # Bucket rows of a deleted listing are left behind: without a signature they join to nothing
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_listing_signatures_delete AFTER DELETE ON listing_rows
+        BEGIN DELETE FROM listing_signatures WHERE listing_id = OLD.id; END
+    """)
+    if url_keyed:
+        cur.execute("""
+            INSERT OR REPLACE INTO listing_signatures (listing_id, signature, price_eur, area_m2, property_id)
+            SELECT l.id, s.signature, s.price_eur, s.area_m2, s.property_id
+            FROM listing_signatures_old s JOIN listing_rows l ON l.url = s.url
+        """)
+        cur.execute("""
+            INSERT OR IGNORE INTO lsh_buckets (bucket, listing_id)
+            SELECT b.bucket, l.id FROM lsh_buckets_old b JOIN listing_rows l ON l.url = b.url
+        """)
+        cur.execute("DROP TABLE listing_signatures_old")
+        cur.execute("DROP TABLE lsh_buckets_old")
+        logger.info("Dedupe tables re-keyed by listing id.")
+
+
+def _tokens(item):
+    text = slugify_pt(f"{item.get('title') or ''} {item.get('snippet') or ''}")
+    words = [w for w in text.split("-") if w and not w.isdigit() and w not in _STOPWORDS]
+    shingles = set(words)
+    shingles.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+
+    price = item.get("price_eur")
+    area = item.get("area_m2")
+    if price and price > 0:
+        # ~5% wide log-scale buckets, so "650 €" and "660 €" land together
+        pb = int(math.log(price) / math.log(1.05))
+        shingles.update(f"p:{pb}#{i}" for i in range(BUCKET_WEIGHT))
+    if area and area > 0:
+        ab = int(area // 5)
+        shingles.update(f"a:{ab}#{i}" for i in range(BUCKET_WEIGHT))
+    return shingles
+
+
+def _token_hashes(token):
+    # One SHAKE-128 call yields all NUM_HASHES independent 64-bit hashes of a token
+    values = array.array("Q")
+    values.frombytes(hashlib.shake_128(token.encode("utf-8")).digest(NUM_HASHES * 8))
+    return values
+
+
+def minhash(item):
+    """MinHash signature (NUM_HASHES unsigned 64-bit values) for a listing."""
+    columns = [_token_hashes(t) for t in _tokens(item)]
+    if not columns:
+        return None
+    return [min(col) for col in zip(*columns)]
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity between two signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_HASHES
+
+
+def price_block(price):
+    """Coarse ~10% log-scale price range used to scope LSH buckets."""
+    if not price or price <= 0:
+        return None
+    return int(math.log(price) / math.log(1.10))
+
+
+def band_keys(sig, district, search_type, block):
+    """One signed 64-bit bucket key per band, scoped to district, search type and price block."""
+    scope = int.from_bytes(
+        hashlib.blake2b(f"{district}|{search_type}|{block}".encode("utf-8"), digest_size=8).digest(), "little"
+    )
+    keys = []
+    for band in range(BANDS):
+        h = scope ^ (band * 0x9E3779B97F4A7C15)
+        for v in sig[band * ROWS:(band + 1) * ROWS]:
+            # Cheap multiply-xor mixing; a rare collision only adds a candidate
+            h = ((h ^ v) * 0xBF58476D1CE4E5B9) & _MASK64
+        keys.append(h - (1 << 64) if h >= (1 << 63) else h)
+    return keys
+
+
+def _close(a, b, tol):
+    if a is None or b is None:
+        return True
+    return abs(a - b) <= tol * max(a, b)
+
+
+def _pack(sig):
+    return array.array("Q", sig).tobytes()
+
+
+def _unpack(blob):
+    sig = array.array("Q")
+    sig.frombytes(blob)
+    return list(sig)
+
+
+def assign_properties(cur, urls):
+    """Gives each listing in `urls` a property_id, reusing the id of a likely duplicate.
+
+    Runs inside the caller's transaction (`cur`), so it is atomic with the
+    ingest that produced the URLs. Cost is linear in the batch size plus the
+    number of LSH candidates, never pairwise over the table.
+    """
+    urls = list(urls)
+    rows = []
+    for i in range(0, len(urls), 500):
+        chunk = urls[i:i + 500]
+        cur.execute(f"""
+            SELECT id, url, district, search_type, title, snippet, price_eur, area_m2
+            FROM listings WHERE url IN ({','.join('?' * len(chunk))}) AND property_id IS NULL
+        """, chunk)
+        rows.extend(cur.fetchall())
+
+    merged = 0
+    for listing_id, url, district, search_type, title, snippet, price, area in rows:
+        item = {"title": title, "snippet": snippet, "price_eur": price, "area_m2": area}
+        sig = minhash(item)
+        if sig is None:
+            # Nothing to compare on: the listing is its own property
+            cur.execute("INSERT INTO properties (canonical_url) VALUES (?)", (url,))
+            cur.execute("UPDATE listing_rows SET property_id = ? WHERE id = ?", (cur.lastrowid, listing_id))
+            continue
+        block = price_block(price)
+        keys = band_keys(sig, district, search_type, block)
+        # Look in the neighbouring price blocks too, so prices straddling a
+        # block boundary still meet
+        probe = list(keys)
+        if block is not None:
+            probe += band_keys(sig, district, search_type, block - 1)
+            probe += band_keys(sig, district, search_type, block + 1)
+
+        # One query per listing: band hits joined to their signatures, with
+        # the price/area tolerance applied before any signature is compared
+        cur.execute(f"""
+            SELECT DISTINCT s.listing_id, s.signature, s.price_eur, s.area_m2, s.property_id
+            FROM lsh_buckets b JOIN listing_signatures s ON s.listing_id = b.listing_id
+            WHERE b.bucket IN ({','.join('?' * len(probe))})
+        """, probe)
+        best_id, best_sim = None, MIN_SIMILARITY
+        for c_id, c_blob, c_price, c_area, c_pid in cur.fetchall():
+            if c_id == listing_id:
+                continue
+            if not (_close(price, c_price, PRICE_TOLERANCE) and _close(area, c_area, AREA_TOLERANCE)):
+                continue
+            sim = similarity(sig, _unpack(c_blob))
+            if sim >= best_sim:
+                best_id, best_sim = c_pid, sim
+
+        if best_id is None:
+            cur.execute("INSERT INTO properties (canonical_url) VALUES (?)", (url,))
+            best_id = cur.lastrowid
+        else:
+            merged += 1
+
+        cur.execute(
+            "INSERT OR REPLACE INTO listing_signatures (listing_id, signature, price_eur, area_m2, property_id) VALUES (?, ?, ?, ?, ?)",
+            (listing_id, _pack(sig), price, area, best_id),
+        )
+        cur.executemany("INSERT OR IGNORE INTO lsh_buckets (bucket, listing_id) VALUES (?, ?)", [(k, listing_id) for k in keys])
+        cur.execute("UPDATE listing_rows SET property_id = ? WHERE id = ?", (best_id, listing_id))
+
+    if merged:
+        logger.info(f"Dedupe: {merged} of {len(rows)} listings matched an existing property")
+    return merged
+
+
+def backfill_properties(batch_size=2000):
+    """Assigns property ids to listings stored before dedupe existed. Returns how many were processed."""
+    conn = get_connection()
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute("SELECT url FROM listing_rows WHERE property_id IS NULL LIMIT ?", (batch_size,))
+        urls = [r[0] for r in cur.fetchall()]
+        if not urls:
+            break
+        assign_properties(cur, urls)
+        conn.commit()
+        total += len(urls)
+    conn.close()
+    return total
@@ -0,0 +1,211 @@
+"""Detail-page queue and cache for listing enrichment.
+
+`detail_pages` holds one row per listing URL whose detail page is wanted
+or was fetched: the queue state (pending/fetching/done/failed/gone, with a
+lease like job_tasks) and the cached result, i.e. the fields parsed from
+the page and a hash of them. Only new and repriced listings are queued, and
+cards that `clean_data` would drop for lack of an area (with the card kept,
+so the listing can be stored once the page supplies it).
+
+A refetch whose fields hash the same as last time does not touch
+listing_rows. Detail fields only fill gaps in card data (area, eur_m2,
+posted_at) and set the columns cards never carry (description, floor,
+energy_rating, latitude, longitude).
+"""
+import json
+import time
+import logging
+import datetime
+import sqlite3
+from .connection import get_connection
+
+logger = logging.getLogger("details")
+
+DETAIL_LEASE_SECONDS = 120
+DETAIL_MAX_ATTEMPTS = 3
+
+
+def create_details_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS detail_pages (
+            url TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            card TEXT,
+            search_type TEXT,
+            typology TEXT,
+            content_hash TEXT,
+            fields TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL DEFAULT 0,
+            lease_until REAL,
+            queued_at DATETIME,
+            fetched_at DATETIME,
+            error TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_detail_pages_claim ON detail_pages(source, status, run_after)")
+
+
+def queue_details(items, saved, search_type, typology):
+    """Queues detail pages after a save: new and repriced listings, plus cards missing an area.
+
+    `items` are the scraped cards (before cleaning), `saved` what
+    save_listings returned. Repriced listings are fetched again even if
+    cached; everything else already queued or fetched is left alone.
+    Returns the number of URLs queued.
+    """
+    now = datetime.datetime.now().isoformat()
+    by_url = {x["url"]: x for x in items if x.get("url")}
+    rows = []
+    for url in saved["inserted"]:
+        if url in by_url:
+            rows.append((url, by_url[url]["source"], None, search_type, typology, now))
+    for url, x in by_url.items():
+        price, area = x.get("price_eur"), x.get("area_m2")
+        if price and price > 0 and not (area and area > 0):
+            rows.append((url, x["source"], json.dumps(x, ensure_ascii=False), search_type, typology, now))
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.executemany("""
+        INSERT OR IGNORE INTO detail_pages (url, source, card, search_type, typology, queued_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, rows)
+    queued = cur.rowcount if cur.rowcount > 0 else 0
+    repriced = [(now, url) for url in saved["repriced"]]
+    cur.executemany("""
+        UPDATE detail_pages SET status = 'pending', attempts = 0, run_after = 0, queued_at = ?
+        WHERE url = ? AND status IN ('done', 'failed')
+    """, repriced)
+    queued += cur.rowcount if cur.rowcount > 0 else 0
+    conn.commit()
+    conn.close()
+    return queued
+
+
+def claim_detail(source, lease_seconds=DETAIL_LEASE_SECONDS):
+    """Leases the oldest runnable detail page of `source`. Returns a dict (card decoded) or None."""
+    now = time.time()
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("""
+        UPDATE detail_pages SET status = 'fetching', lease_until = ?, attempts = attempts + 1
+        WHERE url = (
+            SELECT url FROM detail_pages
+            WHERE source = ?
+              AND ((status = 'pending' AND run_after <= ?) OR (status = 'fetching' AND lease_until < ?))
+            ORDER BY queued_at LIMIT 1
+        )
+        RETURNING url, source, card, search_type, typology, attempts
+    """, (now + lease_seconds, source, now, now))
+    row = cur.fetchone()
+    conn.commit()
+    conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job["card"] = json.loads(job["card"]) if job["card"] else None
+    return job
+
+
+def store_detail(url, fields, content_hash):
+    """Caches a fetched detail page and applies its fields to the listing.
+
+    Returns "updated", "unchanged" (same content as the last fetch, listing
+    already enriched) or "missing" (no stored listing with this URL).
+    """
+    now = datetime.datetime.now().isoformat()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("SELECT content_hash FROM detail_pages WHERE url = ?", (url,))
+    row = cur.fetchone()
+    changed = row is None or row[0] != content_hash
+    cur.execute("""
+        INSERT INTO detail_pages (url, source, status, content_hash, fields, fetched_at, queued_at)
+        VALUES (?, '', 'done', ?, ?, ?, ?)
+        ON CONFLICT(url) DO UPDATE SET
+            status = 'done', content_hash = excluded.content_hash, fields = excluded.fields,
+            fetched_at = excluded.fetched_at, lease_until = NULL, error = NULL
+    """, (url, content_hash, json.dumps(fields, ensure_ascii=False), now, now))
+    area = fields.get("area_m2")
+    cur.execute("""
+        UPDATE listing_rows SET
+            area_m2 = COALESCE(area_m2, :area),
+            eur_m2 = COALESCE(eur_m2, CASE WHEN :area > 0 AND price_eur > 0 THEN ROUND(price_eur / :area, 2) END),
+            posted_at = COALESCE(posted_at, :posted_at),
+            description = COALESCE(:description, description),
+            floor = COALESCE(:floor, floor),
+            energy_rating = COALESCE(:energy_rating, energy_rating),
+            latitude = COALESCE(:latitude, latitude),
+            longitude = COALESCE(:longitude, longitude),
+            enriched_at = :now
+        WHERE url = :url AND (:changed OR enriched_at IS NULL)
+    """, {
+        "area": area, "posted_at": fields.get("posted_at"), "description": fields.get("description"),
+        "floor": fields.get("floor"), "energy_rating": fields.get("energy_rating"),
+        "latitude": fields.get("latitude"), "longitude": fields.get("longitude"),
+        "now": now, "url": url, "changed": changed,
+    })
+    if cur.rowcount:
+        result = "updated"
+    else:
+        cur.execute("SELECT 1 FROM listing_rows WHERE url = ?", (url,))
+        result = "unchanged" if cur.fetchone() else "missing"
+    conn.commit()
+    conn.close()
+    return result
+
+
+def fail_detail(url, error, retry_in=None, gone=False):
+    """Records a failed fetch: retried after `retry_in` seconds, failed for good after
+    DETAIL_MAX_ATTEMPTS (or when retry_in is None), or `gone` for 404/410."""
+    conn = get_connection()
+    cur = conn.cursor()
+    if gone:
+        cur.execute(
+            "UPDATE detail_pages SET status = 'gone', lease_until = NULL, error = ?, fetched_at = ? WHERE url = ?",
+            (error, datetime.datetime.now().isoformat(), url),
+        )
+    else:
+        cur.execute("""
+            UPDATE detail_pages SET
+                status = CASE WHEN ? IS NULL OR attempts >= ? THEN 'failed' ELSE 'pending' END,
+                run_after = ?, lease_until = NULL, error = ?
+            WHERE url = ?
+        """, (retry_in, DETAIL_MAX_ATTEMPTS, time.time() + (retry_in or 0), error, url))
+    conn.commit()
+    conn.close()
+
+
+def get_cached_details(urls):
+    """{url: fields} of the fetched detail pages among `urls`."""
+    conn = get_connection()
+    cur = conn.cursor()
+    out = {}
+    urls = list(dict.fromkeys(u for u in urls if u))
+    for i in range(0, len(urls), 500):
+        chunk = urls[i:i + 500]
+        cur.execute(f"""
+            SELECT url, fields FROM detail_pages
+            WHERE status = 'done' AND url IN ({','.join('?' * len(chunk))})
+        """, chunk)
+        for url, fields in cur.fetchall():
+            out[url] = json.loads(fields)
+    conn.close()
+    return out
+
+
+def detail_queue_stats():
+    """{source: {status: count}} of the detail-page queue."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT source, status, COUNT(*) FROM detail_pages GROUP BY source, status")
+    out = {}
+    for source, status, n in cur.fetchall():
+        out.setdefault(source, {})[status] = n
+    conn.close()
+    return out
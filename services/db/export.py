@@ -0,0 +1,80 @@
+"""Streaming reads of listings for bulk export.
+
+`iter_listings` runs one query and hands rows back in batches of
+`batch_rows` dicts, read with `fetchmany` from the open cursor, so memory
+stays flat however many rows match. Rows come in id order (no sort: an
+ORDER BY on anything else would make SQLite collect every row first).
+"""
+import sqlite3
+from .connection import get_connection
+from .schema import LIST_COLUMNS
+from .search import text_match_sql
+from .geo import radius_bbox, haversine_km
+
+BATCH_ROWS = 1000
+
+
+def iter_listings(district=None, search_type=None, typology=None, sources=None, q=None,
+                  bbox=None, center=None, radius_km=None, only_active=True, batch_rows=BATCH_ROWS):
+    """Yields lists of listing dicts matching the structured filters, `batch_rows` at a time.
+
+    `bbox` (min_lat, min_lng, max_lat, max_lng) or `center` + `radius_km`
+    go through the geo index like get_listings_in_area; radius rows carry
+    `distance_km`. The connection stays open until the generator finishes
+    or is closed.
+    """
+    if center is not None:
+        bbox = radius_bbox(center[0], center[1], radius_km)
+    cols = ", ".join("l." + c for c in LIST_COLUMNS)
+    if bbox is not None:
+        min_lat, min_lng, max_lat, max_lng = bbox
+        query = f"""
+            SELECT {cols} FROM listing_geo g CROSS JOIN listings l ON l.id = g.id
+            WHERE g.max_lat >= ? AND g.min_lat <= ? AND g.max_lng >= ? AND g.min_lng <= ?
+              AND l.latitude BETWEEN ? AND ? AND l.longitude BETWEEN ? AND ?
+        """
+        params = [min_lat, max_lat, min_lng, max_lng, min_lat, max_lat, min_lng, max_lng]
+    else:
+        query = f"SELECT {cols} FROM listings l WHERE 1 = 1"
+        params = []
+    for column, value in (("district", district), ("search_type", search_type)):
+        if value:
+            query += f" AND l.{column} = ?"
+            params.append(value)
+    if typology and typology != "T*":
+        query += " AND l.typology = ?"
+        params.append(typology)
+    if sources:
+        query += f" AND l.source IN ({','.join('?' * len(sources))})"
+        params += list(sources)
+    if only_active:
+        query += " AND l.is_active = 1"
+    match_sql, match_params = text_match_sql(q)
+    if match_sql:
+        query += " AND " + match_sql
+        params += match_params
+    if bbox is None:
+        query += " ORDER BY l.id"
+
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    try:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_rows)
+            if not rows:
+                break
+            batch = [dict(r) for r in rows]
+            if center is not None:
+                kept = []
+                for r in batch:
+                    d = haversine_km(center[0], center[1], r["latitude"], r["longitude"])
+                    if d <= radius_km:
+                        r["distance_km"] = round(d, 3)
+                        kept.append(r)
+                batch = kept
+            if batch:
+                yield batch
+    finally:
+        conn.close()
@@ -0,0 +1,135 @@
+"""Spatial index over listing coordinates.
+
+`listing_geo` is an R*Tree virtual table holding one point (a zero-size
+box) per geocoded listing, keyed by the listing id. Triggers on
+`listing_rows` keep it in step with `latitude`/`longitude`, so bounding
+box and radius searches read only the index nodes covering the area
+instead of scanning listings.
+
+R*Tree stores 32-bit floats and rounds boxes outwards, so candidates are
+checked again against the exact coordinates in listing_rows. Queries use
+CROSS JOIN to keep the index as the outer loop; otherwise the planner
+may prefer scanning a search_type index instead.
+"""
+import math
+import sqlite3
+import logging
+from .connection import get_connection
+from .schema import LIST_COLUMNS
+from .search import text_match_sql
+
+logger = logging.getLogger("geo")
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def create_geo_index(cur):
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS listing_geo USING rtree(
+            id, min_lat, max_lat, min_lng, max_lng
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_listing_geo_insert AFTER INSERT ON listing_rows
+        WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            INSERT OR REPLACE INTO listing_geo VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_listing_geo_update AFTER UPDATE OF latitude, longitude ON listing_rows
+        WHEN OLD.latitude IS NOT NEW.latitude OR OLD.longitude IS NOT NEW.longitude
+        BEGIN
+            DELETE FROM listing_geo WHERE id = OLD.id;
+            INSERT INTO listing_geo
+            SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+            WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_listing_geo_delete AFTER DELETE ON listing_rows
+        BEGIN
+            DELETE FROM listing_geo WHERE id = OLD.id;
+        END
+    """)
+
+
+def rebuild_geo_index(cur):
+    """Refills listing_geo from listing_rows."""
+    cur.execute("DELETE FROM listing_geo")
+    cur.execute("""
+        INSERT INTO listing_geo
+        SELECT id, latitude, latitude, longitude, longitude FROM listing_rows
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """)
+    logger.info(f"Geo index rebuilt with {cur.rowcount} listings.")
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def radius_bbox(lat, lng, radius_km):
+    """(min_lat, min_lng, max_lat, max_lng) enclosing the circle."""
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    dlng = radius_km / (KM_PER_DEGREE_LAT * max(0.01, math.cos(math.radians(lat))))
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+
+def get_listings_in_area(bbox=None, center=None, radius_km=None, search_type=None, typology=None,
+                         limit=None, only_active=True, q=None):
+    """Listings inside `bbox` (min_lat, min_lng, max_lat, max_lng) or within `radius_km` of `center` (lat, lng).
+
+    Radius results carry `distance_km` and come nearest first. `search_type`
+    and `typology` (None or "T*" for any) and the full-text query `q`
+    narrow the result.
+    """
+    if center is not None:
+        bbox = radius_bbox(center[0], center[1], radius_km)
+    min_lat, min_lng, max_lat, max_lng = bbox
+
+    query = f"""
+        SELECT {', '.join('l.' + c for c in LIST_COLUMNS)} FROM listing_geo g
+        CROSS JOIN listings l ON l.id = g.id
+        WHERE g.max_lat >= ? AND g.min_lat <= ? AND g.max_lng >= ? AND g.min_lng <= ?
+          AND l.latitude BETWEEN ? AND ? AND l.longitude BETWEEN ? AND ?
+    """
+    params = [min_lat, max_lat, min_lng, max_lng, min_lat, max_lat, min_lng, max_lng]
+    if search_type:
+        query += " AND l.search_type = ?"
+        params.append(search_type)
+    if typology and typology != "T*":
+        query += " AND l.typology = ?"
+        params.append(typology)
+    if only_active:
+        query += " AND l.is_active = 1"
+    match_sql, match_params = text_match_sql(q)
+    if match_sql:
+        query += " AND " + match_sql
+        params += match_params
+    if limit is not None and center is None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute(query, params)
+    rows = [dict(r) for r in cur.fetchall()]
+    conn.close()
+
+    if center is None:
+        return rows
+    out = []
+    for r in rows:
+        d = haversine_km(center[0], center[1], r["latitude"], r["longitude"])
+        if d <= radius_km:
+            r["distance_km"] = round(d, 3)
+            out.append(r)
+    out.sort(key=lambda r: r["distance_km"])
+    return out[:limit] if limit is not None else out
@@ -0,0 +1,340 @@
+"""Durable job queue for scraping, stored in the database (no outside broker).
+
+A job (e.g. a bulk scrape) is a set of tasks, one per (source, district,
+search_type, typology, page). Only page 1 of each search is enqueued up
+front; a worker that finds new listings on page N adds page N+1, so sweeps
+stop paginating where the data is already known, as `BaseScraper.scrape`
+does in-process.
+
+Workers claim a task by leasing it (`lease_until`); a worker that dies
+leaves its lease to expire and the task is claimed again, so a crash or
+restart resumes where it stopped. At most one task per source is leased
+at a time across all workers, which keeps every portal at the pace of one
+rate limiter however many worker processes run. Failed tasks are retried
+with exponential backoff up to MAX_ATTEMPTS.
+"""
+import json
+import time
+import random
+import logging
+import datetime
+import sqlite3
+from .connection import get_connection
+
+logger = logging.getLogger("jobs")
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 30.0
+BACKOFF_MAX = 1800.0
+
+
+def create_jobs_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            dedupe_key TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            created_at DATETIME,
+            started_at DATETIME,
+            finished_at DATETIME
+        )
+    """)
+    # One open job per kind + parameters: enqueueing the same sweep twice returns the first
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_open ON jobs(dedupe_key)
+        WHERE status IN ('queued', 'running')
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS job_tasks (
+            id INTEGER PRIMARY KEY,
+            job_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            district TEXT NOT NULL,
+            search_type TEXT NOT NULL,
+            typology TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            max_page INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL DEFAULT 0,
+            lease_until REAL,
+            worker TEXT,
+            items INTEGER,
+            new_items INTEGER,
+            error TEXT,
+            updated_at DATETIME,
+            UNIQUE (job_id, source, district, search_type, typology, page)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_job_tasks_claim ON job_tasks(status, run_after)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_job_tasks_job ON job_tasks(job_id, status)")
+
+
+def backoff(attempts):
+    """Seconds before retry number `attempts`: doubling from BACKOFF_BASE, jittered, capped."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+def enqueue_job(kind, params, tasks):
+    """Creates a job from (source, district, search_type, typology, max_page) tuples, page 1 each.
+
+    If a job with the same kind and params is still queued or running, that
+    one is returned instead. Returns {"job_id": id, "created": bool}.
+    """
+    dedupe_key = f"{kind}:{json.dumps(params, sort_keys=True)}"
+    now = datetime.datetime.now().isoformat()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute(
+        "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')", (dedupe_key,)
+    )
+    row = cur.fetchone()
+    if row:
+        conn.rollback()
+        conn.close()
+        return {"job_id": row[0], "created": False}
+    cur.execute(
+        "INSERT INTO jobs (kind, params, dedupe_key, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+        (kind, json.dumps(params), dedupe_key, now),
+    )
+    job_id = cur.lastrowid
+    cur.executemany("""
+        INSERT OR IGNORE INTO job_tasks (
+            job_id, source, district, search_type, typology, page, max_page, updated_at
+        ) VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+    """, [(job_id, *t, now) for t in tasks])
+    conn.commit()
+    conn.close()
+    logger.info(f"Enqueued {kind} job {job_id} with {len(tasks)} searches")
+    return {"job_id": job_id, "created": True}
+
+
+def claim_task(worker, lease_seconds=LEASE_SECONDS):
+    """Leases the oldest runnable task whose source is not already being scraped. Returns a dict or None.
+
+    Runnable means queued and past its backoff, or running with an expired
+    lease (its worker died). Tasks that keep losing their lease are failed
+    after MAX_ATTEMPTS.
+    """
+    now = time.time()
+    now_iso = datetime.datetime.now().isoformat()
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("""
+        UPDATE job_tasks SET status = 'failed', error = 'lease expired too many times', updated_at = ?
+        WHERE status = 'running' AND lease_until < ? AND attempts >= ?
+        RETURNING job_id
+    """, (now_iso, now, MAX_ATTEMPTS))
+    # A job whose last open task just failed is finished, or its dedupe key would block new sweeps
+    for job_id in {r["job_id"] for r in cur.fetchall()}:
+        _finish_job_if_drained(cur, job_id)
+    cur.execute("""
+        UPDATE job_tasks
+        SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+        WHERE id = (
+            SELECT id FROM job_tasks
+            WHERE ((status = 'queued' AND run_after <= ?) OR (status = 'running' AND lease_until < ?))
+              AND source NOT IN (
+                  SELECT source FROM job_tasks WHERE status = 'running' AND lease_until >= ?
+              )
+            ORDER BY id LIMIT 1
+        )
+        RETURNING id, job_id, source, district, search_type, typology, page, max_page, attempts
+    """, (worker, now + lease_seconds, now_iso, now, now, now))
+    row = cur.fetchone()
+    task = dict(row) if row else None
+    if task:
+        cur.execute(
+            "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued'",
+            (now_iso, task["job_id"]),
+        )
+    conn.commit()
+    conn.close()
+    return task
+
+
+def _finish_job_if_drained(cur, job_id):
+    """Marks the job done once it has no open tasks. True if this call did it."""
+    cur.execute("""
+        UPDATE jobs SET status = 'done', finished_at = ?
+        WHERE id = ? AND status IN ('queued', 'running')
+          AND NOT EXISTS (SELECT 1 FROM job_tasks WHERE job_id = ? AND status IN ('queued', 'running'))
+    """, (datetime.datetime.now().isoformat(), job_id, job_id))
+    return cur.rowcount > 0
+
+
+def complete_task(task, worker, items, new_items, more):
+    """Marks a leased task done and, if `more`, enqueues the next page. True if the job is now finished.
+
+    Ignored (returns False) when the lease was lost to another worker.
+    """
+    now = datetime.datetime.now().isoformat()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("""
+        UPDATE job_tasks SET status = 'done', items = ?, new_items = ?, error = NULL, lease_until = NULL, updated_at = ?
+        WHERE id = ? AND worker = ? AND status = 'running'
+    """, (items, new_items, now, task["id"], worker))
+    if cur.rowcount == 0:
+        conn.rollback()
+        conn.close()
+        return False
+    if more and task["page"] < task["max_page"]:
+        cur.execute("""
+            INSERT OR IGNORE INTO job_tasks (
+                job_id, source, district, search_type, typology, page, max_page, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (task["job_id"], task["source"], task["district"], task["search_type"], task["typology"],
+              task["page"] + 1, task["max_page"], now))
+    finished = _finish_job_if_drained(cur, task["job_id"])
+    conn.commit()
+    conn.close()
+    return finished
+
+
+def fail_task(task, worker, error, retry_in=None):
+    """Records a failed attempt: requeued after `retry_in` seconds, or failed for good when None.
+
+    True if this left the job finished.
+    """
+    now = datetime.datetime.now().isoformat()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    if retry_in is not None and task["attempts"] < MAX_ATTEMPTS:
+        cur.execute("""
+            UPDATE job_tasks SET status = 'queued', run_after = ?, lease_until = NULL, error = ?, updated_at = ?
+            WHERE id = ? AND worker = ? AND status = 'running'
+        """, (time.time() + retry_in, error, now, task["id"], worker))
+    else:
+        cur.execute("""
+            UPDATE job_tasks SET status = 'failed', lease_until = NULL, error = ?, updated_at = ?
+            WHERE id = ? AND worker = ? AND status = 'running'
+        """, (error, now, task["id"], worker))
+    finished = _finish_job_if_drained(cur, task["job_id"])
+    conn.commit()
+    conn.close()
+    return finished
+
+
+def cancel_job(job_id):
+    """Drops a job's queued tasks (leased ones finish). Returns False if the job was not open."""
+    now = datetime.datetime.now().isoformat()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute(
+        "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+        (now, job_id),
+    )
+    cancelled = cur.rowcount > 0
+    if cancelled:
+        cur.execute(
+            "UPDATE job_tasks SET status = 'cancelled', updated_at = ? WHERE job_id = ? AND status = 'queued'",
+            (now, job_id),
+        )
+    conn.commit()
+    conn.close()
+    return cancelled
+
+
+def _job_dict(row, counts):
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job.pop("dedupe_key", None)
+    job["tasks"] = counts
+    total = sum(counts.values())
+    settled = total - counts.get("queued", 0) - counts.get("running", 0)
+    # Pages are enqueued lazily, so the total grows while the job runs
+    job["progress"] = round(settled / total, 4) if total else None
+    return job
+
+
+def get_jobs(limit=20):
+    """Most recent jobs with their task counts by status."""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+    jobs = cur.fetchall()
+    counts = {}
+    if jobs:
+        ids = [j["id"] for j in jobs]
+        cur.execute(f"""
+            SELECT job_id, status, COUNT(*) FROM job_tasks
+            WHERE job_id IN ({','.join('?' * len(ids))}) GROUP BY job_id, status
+        """, ids)
+        for job_id, status, n in cur.fetchall():
+            counts.setdefault(job_id, {})[status] = n
+    conn.close()
+    return [_job_dict(j, counts.get(j["id"], {})) for j in jobs]
+
+
+def get_job(job_id, errors=50):
+    """One job with task counts, per-source progress and the latest task errors, or None."""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    row = cur.fetchone()
+    if row is None:
+        conn.close()
+        return None
+    cur.execute("SELECT status, COUNT(*) FROM job_tasks WHERE job_id = ? GROUP BY status", (job_id,))
+    job = _job_dict(row, {status: n for status, n in cur.fetchall()})
+    cur.execute("""
+        SELECT source, status, COUNT(*) AS tasks, COALESCE(SUM(items), 0) AS items,
+               COALESCE(SUM(new_items), 0) AS new_items
+        FROM job_tasks WHERE job_id = ? GROUP BY source, status
+    """, (job_id,))
+    by_source = {}
+    for r in cur.fetchall():
+        s = by_source.setdefault(r["source"], {"tasks": {}, "items": 0, "new_items": 0})
+        s["tasks"][r["status"]] = r["tasks"]
+        s["items"] += r["items"]
+        s["new_items"] += r["new_items"]
+    job["by_source"] = by_source
+    cur.execute("""
+        SELECT source, district, search_type, typology, page, status, attempts, error, updated_at
+        FROM job_tasks WHERE job_id = ? AND error IS NOT NULL
+        ORDER BY updated_at DESC LIMIT ?
+    """, (job_id, errors))
+    job["errors"] = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return job
+
+
+def open_task_count():
+    """Tasks still queued (including those waiting out a backoff) or running."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM job_tasks WHERE status IN ('queued', 'running')")
+    n = cur.fetchone()[0]
+    conn.close()
+    return n
+
+
+def get_refresh_history():
+    """Last finished scrape task per (source, district, search_type, typology), and mean listings per page by source.
+
+    Returns ({key: finished_at}, {source: listings per page}).
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT source, district, search_type, typology, MAX(updated_at) FROM job_tasks
+        WHERE status = 'done' GROUP BY source, district, search_type, typology
+    """)
+    last = {tuple(r[:4]): r[4] for r in cur.fetchall()}
+    cur.execute("SELECT source, AVG(items) FROM job_tasks WHERE status = 'done' AND items > 0 GROUP BY source")
+    page_sizes = {source: avg for source, avg in cur.fetchall()}
+    conn.close()
+    return last, page_sizes
@@ -0,0 +1,140 @@
+import json
+import logging
+import datetime
+import sqlite3
+from .connection import get_connection
+
+logger = logging.getLogger("marks")
+
+MARK_STATES = ("loved", "discarded")
+
+
+def get_marks():
+    """Returns the {url: state} map of every marked listing."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT url, state FROM marks WHERE state IS NOT NULL")
+    rows = cur.fetchall()
+    conn.close()
+    return {url: state for url, state in rows}
+
+
+def get_marks_since(since):
+    """Changes after revision `since`: {"rev": current, "changes": {url: state or None}}.
+
+    None means the mark was cleared. With since=0 only live marks are sent,
+    since a fresh client has nothing to clear.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(rev), 0) FROM marks")
+    rev = cur.fetchone()[0]
+    if since <= 0:
+        cur.execute("SELECT url, state FROM marks WHERE state IS NOT NULL")
+    else:
+        cur.execute("SELECT url, state FROM marks WHERE rev > ?", (since,))
+    changes = {url: state for url, state in cur.fetchall()}
+    conn.close()
+    return {"rev": rev, "changes": changes}
+
+
+def set_mark(url, state):
+    """Sets or clears one mark (single-key upsert). Returns (resulting state, revision)."""
+    result = set_marks([(url, state)])
+    return result["marks"][url], result["rev"]
+
+
+def set_marks(changes):
+    """Applies many (url, state) changes in one transaction under a single new revision.
+
+    Any state other than loved/discarded clears the mark.
+    Returns {"rev": new revision, "marks": {url: resulting state}}.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    now = datetime.datetime.now().isoformat()
+    # Take the write lock before reading MAX(rev) so concurrent batches
+    # can never be given the same revision
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("SELECT COALESCE(MAX(rev), 0) + 1 FROM marks")
+    rev = cur.fetchone()[0]
+    out = {}
+    for url, state in changes:
+        state = state if state in MARK_STATES else None
+        cur.execute("""
+            INSERT INTO marks (url, state, updated_at, rev) VALUES (?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at, rev = excluded.rev
+        """, (url, state, now, rev))
+        out[url] = state
+    conn.commit()
+    conn.close()
+    return {"rev": rev, "marks": out}
+
+
+def import_marks_file(path):
+    """One-off import of the legacy marks.json; later starts skip it. Returns how many marks were imported."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT value FROM meta WHERE key = 'marks_json_imported'")
+    if cur.fetchone():
+        conn.close()
+        return 0
+
+    count = 0
+    try:
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+            now = datetime.datetime.now().isoformat()
+            cur.execute("SELECT COALESCE(MAX(rev), 0) + 1 FROM marks")
+            rev = cur.fetchone()[0]
+            for url, state in data.items():
+                if url and state in MARK_STATES:
+                    # Marks already in the table are newer than the file
+                    cur.execute(
+                        "INSERT OR IGNORE INTO marks (url, state, updated_at, rev) VALUES (?, ?, ?, ?)",
+                        (url, state, now, rev),
+                    )
+                    count += cur.rowcount
+    except Exception as e:
+        logger.error(f"Could not import marks from {path}: {e}")
+        conn.close()
+        return 0
+
+    cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('marks_json_imported', ?)", (str(path),))
+    conn.commit()
+    conn.close()
+    if count:
+        logger.info(f"Imported {count} marks from {path}")
+    return count
+
+
+def get_marked_listings(state=None, district=None, search_type=None, typology=None, limit=None):
+    """Listings joined with their mark, filtered in SQL (state=None means any mark)."""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+
+    query = "SELECT l.*, m.state AS mark FROM marks m JOIN listings l ON l.url = m.url WHERE m.state IS NOT NULL"
+    params = []
+    if state:
+        query += " AND m.state = ?"
+        params.append(state)
+    if district:
+        query += " AND l.district = ?"
+        params.append(district)
+    if search_type:
+        query += " AND l.search_type = ?"
+        params.append(search_type)
+    if typology:
+        query += " AND l.typology = ?"
+        params.append(typology)
+    query += " ORDER BY m.updated_at DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
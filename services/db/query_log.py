@@ -0,0 +1,63 @@
+"""Access log of /api/listings queries, for warming the cache after a restart.
+
+One row per distinct query key (the parts of the aggregator's cache key)
+with a hit count and the time it was last asked for. The aggregator counts
+queries in memory and writes them here in batches, so serving a request
+doesn't cost a write. NULL key parts are stored as '' so they can be part
+of the primary key.
+"""
+import datetime
+from .connection import get_connection
+
+# Cache-key parts, in the order the aggregator builds them (minus the district slug)
+QUERY_KEY = ("district", "pages", "sources", "typology", "search_type", "lim", "q", "ord")
+
+
+def create_query_log_schema(cur):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS query_log (
+            district TEXT NOT NULL,
+            pages INTEGER NOT NULL,
+            sources TEXT NOT NULL,
+            typology TEXT NOT NULL,
+            search_type TEXT NOT NULL,
+            lim INTEGER NOT NULL,
+            q TEXT NOT NULL,
+            ord TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            last_at DATETIME,
+            PRIMARY KEY ({', '.join(QUERY_KEY)})
+        ) WITHOUT ROWID
+    """)
+
+
+def log_queries(counts):
+    """Adds {(district, pages, sources tuple, typology, search_type, limit, q, order): (hits, last_at)} to the log."""
+    rows = []
+    for (district, pages, sources, typology, search_type, limit, q, order), (hits, last_at) in counts.items():
+        rows.append((district, pages, ",".join(sources), typology, search_type, limit, q or "", order or "", hits, last_at))
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.executemany(f"""
+        INSERT INTO query_log ({', '.join(QUERY_KEY)}, hits, last_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT({', '.join(QUERY_KEY)}) DO UPDATE SET
+            hits = hits + excluded.hits, last_at = MAX(last_at, excluded.last_at)
+    """, rows)
+    conn.commit()
+    conn.close()
+
+
+def get_top_queries(limit=50, days=7):
+    """The most-hit query keys asked for in the last `days`, as tuples in log_queries' key layout."""
+    since = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {', '.join(QUERY_KEY)} FROM query_log
+        WHERE last_at >= ? ORDER BY hits DESC LIMIT ?
+    """, (since, limit))
+    out = []
+    for district, pages, sources, typology, search_type, lim, q, order in cur.fetchall():
+        out.append((district, pages, tuple(sources.split(",")) if sources else (), typology, search_type, lim, q or None, order or None))
+    conn.close()
+    return out
@@ -1,38 +1,117 @@
 import datetime
+import logging
 import sqlite3
 from .connection import get_connection
+from .url_index import URL_INDEX
+from .dedupe import assign_properties, create_dedupe_schema
+from .schema import create_listings_schema, migrate_legacy_listings, dimension_ids, LIST_COLUMNS
+from .stats import create_stats_cube, rebuild_stats_cube, create_rollups, rebuild_rollups
+from .jobs import create_jobs_schema
+from .details import create_details_schema
+from .geo import create_geo_index, rebuild_geo_index
+from .search import create_search_index, rebuild_search_index, text_match_sql
+from .changes import create_changes_schema, record_changes, notify_changes
+from .saved_searches import create_saved_searches_schema, match_saved_searches
+from .deals import create_deals_schema, rebuild_deal_scores, score_listings
+from .query_log import create_query_log_schema
+
+logger = logging.getLogger("repository")
+
+# Stored in PRAGMA user_version once init_db has brought a database up to date.
+# Bump it with every schema change below, or existing databases won't get it.
+SCHEMA_VERSION = 4
+
+# Appends a price point; a second change on the same day goes after the first
+# (seconds of day, bumped past the latest one), so intraday changes are kept in order
+_PRICE_POINT_SQL = """
+    INSERT INTO price_points (listing_id, day, sec, price_eur)
+    SELECT ?1, ?2, MAX(?3, COALESCE(MAX(sec) + 1, 0)), ?4
+    FROM price_points WHERE listing_id = ?1 AND day = ?2
+"""
+
+def _upgrade_legacy_listings(cur):
+    """Brings a `listings` table from an older layout up to date, then moves it to listing_rows."""
+    try:
+        cur.execute("ALTER TABLE listings ADD COLUMN posted_at DATETIME")
+    except: pass
+    try:
+        cur.execute("ALTER TABLE listings ADD COLUMN actualized_at DATETIME")
+    except: pass
+    try:
+        cur.execute("ALTER TABLE listings ADD COLUMN is_active INTEGER DEFAULT 1")
+    except: pass
+    try:
+        cur.execute("ALTER TABLE listings ADD COLUMN property_id INTEGER")
+    except: pass
+    # Integer surrogate key for listings (rowid itself may change on VACUUM)
+    try:
+        cur.execute("ALTER TABLE listings ADD COLUMN id INTEGER")
+        cur.execute("UPDATE listings SET id = rowid")
+    except: pass
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'price_history'")
+    if cur.fetchone():
+        # Move the URL/datetime-keyed history into price_points, every change
+        # of it, in the order it was written
+        cur.execute("""
+            SELECT l.id, CAST(strftime('%s', ph.date) AS INTEGER), ph.price_eur
+            FROM price_history ph JOIN listings l ON l.url = ph.url
+            WHERE strftime('%s', ph.date) IS NOT NULL
+            ORDER BY ph.rowid
+        """)
+        points = []
+        last = {}
+        for listing_id, ts, price in cur.fetchall():
+            day, sec = divmod(ts, 86400)
+            # Same bump as _PRICE_POINT_SQL for changes within one second
+            sec = max(sec, last.get((listing_id, day), -1) + 1)
+            last[(listing_id, day)] = sec
+            points.append((listing_id, day, sec, price))
+        cur.executemany("INSERT INTO price_points (listing_id, day, sec, price_eur) VALUES (?, ?, ?, ?)", points)
+        cur.execute("DROP TABLE price_history")
+    migrate_legacy_listings(cur)
 
 def init_db():
     conn = get_connection()
     cur = conn.cursor()
-    # Table for raw listings
+    # Migrations run once per schema version, not on every import
+    cur.execute("PRAGMA user_version")
+    if cur.fetchone()[0] == SCHEMA_VERSION:
+        conn.close()
+        return
+    logger.info(f"Bringing the database schema up to version {SCHEMA_VERSION}...")
+    # WAL lets readers (the web app) run while a scrape worker writes; the setting sticks to the file
+    cur.execute("PRAGMA journal_mode=WAL")
+    # Price history: one row per price change, keyed by the integer listing
+    # id, the day as days since 1970-01-01 and the seconds into that day
+    cur.execute("PRAGMA table_info(price_points)")
+    columns = [r[1] for r in cur.fetchall()]
+    if columns and "sec" not in columns:
+        # First layout kept one row per listing and day: move those rows over.
+        # The rename would repoint the delete trigger at the old table; it is recreated below.
+        cur.execute("DROP TRIGGER IF EXISTS trg_price_points_delete")
+        cur.execute("ALTER TABLE price_points RENAME TO price_points_old")
     cur.execute("""
-        CREATE TABLE IF NOT EXISTS listings (
-            url TEXT PRIMARY KEY,
-            source TEXT,
-            district TEXT,
-            title TEXT,
+        CREATE TABLE IF NOT EXISTS price_points (
+            listing_id INTEGER,
+            day INTEGER,
+            sec INTEGER NOT NULL DEFAULT 0,
             price_eur REAL,
-            area_m2 REAL,
-            eur_m2 REAL,
-            search_type TEXT,
-            snippet TEXT,
-            first_seen DATETIME,
-            last_seen DATETIME,
-            typology TEXT,
-            posted_at DATETIME,
-            actualized_at DATETIME,
-            is_active INTEGER DEFAULT 1
-        )
+            PRIMARY KEY (listing_id, day, sec)
+        ) WITHOUT ROWID
     """)
-    # Table for historical prices (to track updates)
+    if columns and "sec" not in columns:
+        cur.execute("INSERT INTO price_points (listing_id, day, sec, price_eur) SELECT listing_id, day, 0, price_eur FROM price_points_old")
+        cur.execute("DROP TABLE price_points_old")
+    # Listings: integer-keyed listing_rows with dictionary-encoded
+    # source/district/search_type/typology, read through the `listings` view
+    cur.execute("SELECT type FROM sqlite_master WHERE name = 'listings'")
+    row = cur.fetchone()
+    if row and row[0] == "table":
+        _upgrade_legacy_listings(cur)
+    create_listings_schema(cur)
     cur.execute("""
-        CREATE TABLE IF NOT EXISTS price_history (
-            url TEXT,
-            price_eur REAL,
-            date DATETIME,
-            FOREIGN KEY(url) REFERENCES listings(url)
-        )
+        CREATE TRIGGER IF NOT EXISTS trg_price_points_delete AFTER DELETE ON listing_rows
+        BEGIN DELETE FROM price_points WHERE listing_id = OLD.id; END
     """)
     # Table for daily aggregate stats (historical trends)
     cur.execute("""
@@ -51,85 +130,256 @@ def init_db():
     
     # Migrations
     try:
-        cur.execute("ALTER TABLE listings ADD COLUMN posted_at DATETIME")
+        cur.execute("ALTER TABLE daily_stats ADD COLUMN unique_count INTEGER")
     except: pass
-    try:
-        cur.execute("ALTER TABLE listings ADD COLUMN actualized_at DATETIME")
-    except: pass
-    try:
-        cur.execute("ALTER TABLE listings ADD COLUMN is_active INTEGER DEFAULT 1")
-    except: pass
-    
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_listings_search_type ON listings(search_type)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_listings_district ON listings(district)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_listings_typology ON listings(typology)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_listings_posted_at ON listings(posted_at)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_price_history_url ON price_history(url)")
-    
+
+    # User marks (loved/discarded), one row per URL. A cleared mark stays as a
+    # NULL-state tombstone so clients syncing by revision see the removal.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS marks (
+            url TEXT PRIMARY KEY,
+            state TEXT,
+            updated_at DATETIME,
+            rev INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("PRAGMA table_info(marks)")
+    if "rev" not in [r[1] for r in cur.fetchall()]:
+        # First layout had `state NOT NULL` and no revisions: rebuild it
+        cur.execute("ALTER TABLE marks RENAME TO marks_old")
+        cur.execute("""
+            CREATE TABLE marks (
+                url TEXT PRIMARY KEY,
+                state TEXT,
+                updated_at DATETIME,
+                rev INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cur.execute("INSERT INTO marks (url, state, updated_at, rev) SELECT url, state, updated_at, 1 FROM marks_old")
+        cur.execute("DROP TABLE marks_old")
+    # Small key/value store for one-off flags
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+    # Cross-source dedupe: one row per physical property, MinHash signatures
+    # per listing and the LSH band buckets used to find candidates
+    create_dedupe_schema(cur)
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_marks_state ON marks(state)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_marks_rev ON marks(rev)")
+
+    # Analytics cube, maintained incrementally by triggers on listings
+    create_stats_cube(cur)
+    cur.execute("SELECT 1 FROM meta WHERE key = 'stats_cube_built'")
+    if not cur.fetchone():
+        rebuild_stats_cube(cur)
+        cur.execute("INSERT INTO meta (key, value) VALUES ('stats_cube_built', ?)", (datetime.datetime.now().isoformat(),))
+
+    # Scrape job queue shared by the web app and the workers
+    create_jobs_schema(cur)
+    # Change feed of new and repriced listings
+    create_changes_schema(cur)
+    # Saved searches and their inboxes, filled as listings are saved
+    create_saved_searches_schema(cur)
+    # Detail-page queue and cache for enrichment
+    create_details_schema(cur)
+    # Access log of listing queries, for warming the cache on start
+    create_query_log_schema(cur)
+
+    # R*Tree over listing coordinates, maintained by triggers on listing_rows
+    create_geo_index(cur)
+    cur.execute("SELECT 1 FROM meta WHERE key = 'geo_index_built'")
+    if not cur.fetchone():
+        rebuild_geo_index(cur)
+        cur.execute("INSERT INTO meta (key, value) VALUES ('geo_index_built', ?)", (datetime.datetime.now().isoformat(),))
+
+    # FTS5 index over title/snippet/description, maintained by triggers on listing_rows
+    create_search_index(cur)
+    cur.execute("SELECT 1 FROM meta WHERE key = 'search_index_built'")
+    if not cur.fetchone():
+        rebuild_search_index(cur)
+        cur.execute("INSERT INTO meta (key, value) VALUES ('search_index_built', ?)", (datetime.datetime.now().isoformat(),))
+
+    # Deal scores: €/m² against the median/MAD of the listing's group
+    create_deals_schema(cur)
+    cur.execute("SELECT 1 FROM meta WHERE key = 'deal_scores_built'")
+    if not cur.fetchone():
+        rebuild_deal_scores(cur)
+        cur.execute("INSERT INTO meta (key, value) VALUES ('deal_scores_built', ?)", (datetime.datetime.now().isoformat(),))
+
+    # Time-bucketed rollups for the history charts
+    create_rollups(cur)
+    cur.execute("SELECT 1 FROM meta WHERE key = 'rollups_built'")
+    if not cur.fetchone():
+        rebuild_rollups(cur)
+        cur.execute("INSERT INTO meta (key, value) VALUES ('rollups_built', ?)", (datetime.datetime.now().isoformat(),))
+
+    cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
 
+# date.toordinal() of 1970-01-01; price_points store days since then
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def _epoch_day(dt):
+    return dt.date().toordinal() - _EPOCH_ORDINAL
+
+def _day_seconds(dt):
+    return dt.hour * 3600 + dt.minute * 60 + dt.second
+
+def _fetch_existing(cur, urls):
+    """Current id/price/typology/dates for already-stored URLs, fetched in chunks."""
+    rows = {}
+    for i in range(0, len(urls), 500):
+        chunk = urls[i:i + 500]
+        cur.execute(f"""
+            SELECT url, id, price_eur, typology, posted_at, actualized_at
+            FROM listings WHERE url IN ({','.join('?' * len(chunk))})
+        """, chunk)
+        for r in cur.fetchall():
+            rows[r[0]] = r[1:]
+    return rows
+
+def _changed_listing(listing_id, kind, item, old_price, search_type, typology):
+    """What match_saved_searches needs to know about an inserted or repriced listing."""
+    return {
+        "id": listing_id, "kind": kind, "price_eur": item.get("price_eur"), "old_price_eur": old_price,
+        "district": item["district"], "search_type": search_type, "typology": typology,
+        "source": item["source"], "area_m2": item.get("area_m2"), "eur_m2": item.get("eur_m2"),
+    }
+
 def save_listings(items, search_type, typology):
+    """Upserts scraped items. Returns {"inserted": [urls], "repriced": [urls]}."""
     conn = get_connection()
     cur = conn.cursor()
-    now = datetime.datetime.now().isoformat()
+    now_dt = datetime.datetime.now()
+    now = now_dt.isoformat()
+    today = _epoch_day(now_dt)
+    sec = _day_seconds(now_dt)
+
+    by_url = {}
     for item in items:
         url = item.get("url")
-        if not url: continue
-        
-        cur.execute("SELECT price_eur, first_seen, typology, posted_at, actualized_at FROM listings WHERE url = ?", (url,))
+        if url:
+            by_url[url] = item
+
+    # The URL index settles most new URLs in O(1); only its hits cost a lookup
+    known, _ = URL_INDEX.split(list(by_url), cur)
+    inserted = []
+    repriced = []
+    events = []
+    changed = []
+    dims = {}
+
+    for url, item in by_url.items():
+        if url in known:
+            continue
+        item_price = item.get("price_eur")
+        item_typology = item.get("typology") or typology
+        ids = dimension_ids(cur, {
+            "source": item['source'], "district": item['district'],
+            "search_type": search_type, "typology": item_typology,
+        }, dims)
+        cur.execute("""
+            INSERT OR IGNORE INTO listing_rows (
+                url, source_id, district_id, title, price_eur, area_m2, eur_m2, 
+                search_type_id, snippet, first_seen, last_seen, typology_id, posted_at, actualized_at, is_active,
+                latitude, longitude
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+            RETURNING id
+        """, (
+            url, ids['source_id'], ids['district_id'], item['title'], 
+            item_price, item.get('area_m2'), item.get('eur_m2'), 
+            ids['search_type_id'], item.get('snippet'), now, now, ids['typology_id'],
+            item.get('posted_at'), item.get('actualized_at'), item.get('latitude'), item.get('longitude')
+        ))
         row = cur.fetchone()
-        
+        if row is None:
+            # Inserted meanwhile by another process the index hasn't heard of
+            known.add(url)
+            continue
+        cur.execute(_PRICE_POINT_SQL, (row[0], today, sec, item_price))
+        inserted.append(url)
+        events.append((row[0], "new", item_price, None, now))
+        changed.append(_changed_listing(row[0], "new", item, None, search_type, item_typology))
+
+    # Group new listings with likely duplicates from other portals
+    assign_properties(cur, inserted)
+
+    existing = _fetch_existing(cur, [u for u in by_url if u in known])
+    for url, row in existing.items():
+        item = by_url[url]
         item_price = item.get("price_eur")
         item_typology = item.get("typology") or typology
+
+        listing_id, old_price, old_typology, old_posted_at, old_actualized_at = row
+        if (item_typology == "T*" or not item_typology) and old_typology and old_typology != "T*":
+            item_typology = old_typology
         
-        if row:
-            old_price, first_seen, old_typology, old_posted_at, old_actualized_at = row
-            if (item_typology == "T*" or not item_typology) and old_typology and old_typology != "T*":
-                item_typology = old_typology
-            
-            item_posted_at = item.get('posted_at') or old_posted_at
-            item_actualized_at = item.get('actualized_at') or old_actualized_at
-            
-            cur.execute("""
-                UPDATE listings SET
-                    source = ?, district = ?, title = ?, price_eur = ?, 
-                    area_m2 = ?, eur_m2 = ?, search_type = ?, snippet = ?,
-                    last_seen = ?, typology = ?, posted_at = ?, actualized_at = ?, is_active = 1
-                WHERE url = ?
-            """, (
-                item['source'], item['district'], item['title'], item_price,
-                item.get('area_m2'), item.get('eur_m2'), search_type, item.get('snippet'),
-                now, item_typology, item_posted_at, item_actualized_at, url
-            ))
-            if item_price != old_price:
-                cur.execute("INSERT INTO price_history (url, price_eur, date) VALUES (?, ?, ?)", (url, item_price, now))
-        else:
-            cur.execute("""
-                INSERT INTO listings (
-                    url, source, district, title, price_eur, area_m2, eur_m2, 
-                    search_type, snippet, first_seen, last_seen, typology, posted_at, actualized_at, is_active
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-            """, (
-                url, item['source'], item['district'], item['title'], 
-                item_price, item.get('area_m2'), item.get('eur_m2'), 
-                search_type, item.get('snippet'), now, now, item_typology, item.get('posted_at'), item.get('actualized_at')
-            ))
-            cur.execute("INSERT INTO price_history (url, price_eur, date) VALUES (?, ?, ?)", (url, item_price, now))
-            
+        item_posted_at = item.get('posted_at') or old_posted_at
+        item_actualized_at = item.get('actualized_at') or old_actualized_at
+        
+        ids = dimension_ids(cur, {
+            "source": item['source'], "district": item['district'],
+            "search_type": search_type, "typology": item_typology,
+        }, dims)
+        cur.execute("""
+            UPDATE listing_rows SET
+                source_id = ?, district_id = ?, title = ?, price_eur = ?, 
+                area_m2 = ?, eur_m2 = ?, search_type_id = ?, snippet = ?,
+                last_seen = ?, typology_id = ?, posted_at = ?, actualized_at = ?, is_active = 1,
+                latitude = COALESCE(?, latitude), longitude = COALESCE(?, longitude)
+            WHERE id = ?
+        """, (
+            ids['source_id'], ids['district_id'], item['title'], item_price,
+            item.get('area_m2'), item.get('eur_m2'), ids['search_type_id'], item.get('snippet'),
+            now, ids['typology_id'], item_posted_at, item_actualized_at,
+            item.get('latitude'), item.get('longitude'), listing_id
+        ))
+        if item_price != old_price:
+            cur.execute(_PRICE_POINT_SQL, (listing_id, today, sec, item_price))
+            repriced.append(url)
+            events.append((listing_id, "price", item_price, old_price, now))
+            changed.append(_changed_listing(listing_id, "price", item, old_price, search_type, item_typology))
+
+    record_changes(cur, events)
+    match_saved_searches(cur, changed)
+    score_listings(cur, [c["id"] for c in changed])
     conn.commit()
     conn.close()
+    if events:
+        notify_changes()
+    URL_INDEX.add(inserted)
+    return {"inserted": inserted, "repriced": repriced}
 
-def get_listings_from_db(district, search_type, typology, limit=None, only_active=True):
+def get_listings_from_db(district, search_type, typology, limit=None, only_active=True, q=None, order=None):
+    """Listings of one search; `q` narrows them with a full-text query (see search.py).
+
+    order="deal" returns the best deal scores first, read in order from the
+    deal index, so `limit` keeps the top ones.
+    """
     conn = get_connection()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     
-    query = "SELECT * FROM listings WHERE district = ? AND search_type = ? AND typology = ?"
+    query = f"SELECT {', '.join(LIST_COLUMNS)} FROM listings l WHERE district = ? AND search_type = ? AND typology = ?"
     params = [district, search_type, typology]
     
     if only_active:
         query += " AND is_active = 1"
+
+    match_sql, match_params = text_match_sql(q)
+    if match_sql:
+        query += " AND " + match_sql
+        params += match_params
+
+    if order == "deal":
+        # NULLs sort last in descending order
+        query += " ORDER BY deal_score DESC"
         
     if limit is not None:
         query += " LIMIT ?"
@@ -140,15 +390,42 @@ def get_listings_from_db(district, search_type, typology, limit=None, only_activ
     conn.close()
     return [dict(r) for r in rows]
 
+def filter_known_urls(urls):
+    """Returns the subset of `urls` already stored in listings."""
+    return URL_INDEX.filter_known(urls)
+
 def get_listing_history(url):
     conn = get_connection()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
-    cur.execute("SELECT price_eur, date FROM price_history WHERE url = ? ORDER BY date ASC", (url,))
+    cur.execute("""
+        SELECT p.price_eur, strftime('%Y-%m-%dT%H:%M:%S', p.day * 86400 + p.sec, 'unixepoch') AS date
+        FROM listings l JOIN price_points p ON p.listing_id = l.id
+        WHERE l.url = ? ORDER BY p.day, p.sec
+    """, (url,))
     rows = cur.fetchall()
     conn.close()
     return [dict(r) for r in rows]
 
+def get_listing_histories(urls):
+    """Price histories for many listings at once: {url: [{"price_eur", "date"}, ...]}."""
+    conn = get_connection()
+    cur = conn.cursor()
+    out = {}
+    urls = list(dict.fromkeys(u for u in urls if u))
+    for i in range(0, len(urls), 500):
+        chunk = urls[i:i + 500]
+        cur.execute(f"""
+            SELECT l.url, p.price_eur, strftime('%Y-%m-%dT%H:%M:%S', p.day * 86400 + p.sec, 'unixepoch')
+            FROM listings l JOIN price_points p ON p.listing_id = l.id
+            WHERE l.url IN ({','.join('?' * len(chunk))})
+            ORDER BY l.id, p.day, p.sec
+        """, chunk)
+        for url, price, day in cur.fetchall():
+            out.setdefault(url, []).append({"price_eur": price, "date": day})
+    conn.close()
+    return out
+
 def optimize_db():
     conn = get_connection()
     cur = conn.cursor()
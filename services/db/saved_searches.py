@@ -0,0 +1,244 @@
+"""Saved searches, matched against listings as they are saved.
+
+A saved search holds the structured filters of /api/listings (district,
+search_type, typology, price/area bounds, a €/m² ceiling, a source). It is
+not re-run: `save_listings` hands every listing it inserts or reprices to
+`match_saved_searches` in the same transaction, and each matching search
+gets a row in its inbox (`saved_search_hits`). Listings stored before a
+search was created are not matched retroactively.
+
+Matching goes through SEARCH_INDEX, an in-memory index from
+(district, search_type, typology) to the searches using exactly those
+values, None standing for "any". A listing looks up the four keys that
+could apply to it and checks the price/area bounds of those searches
+only, so a save costs O(changed listings x matching searches) however
+many searches exist. Searches are never edited (delete and recreate), so
+(MAX(id), COUNT(*)) identifies the set; the index reloads when another
+process created or deleted one.
+"""
+import logging
+import datetime
+import sqlite3
+import threading
+from services.property_matcher import normalize_typology
+from .connection import get_connection
+
+logger = logging.getLogger("saved_searches")
+
+SEARCH_TYPES = ("rent", "buy")
+# (column, listing field, compare) of the bounds checked per candidate search
+_BOUNDS = (
+    ("min_price", "price_eur", lambda v, b: v >= b),
+    ("max_price", "price_eur", lambda v, b: v <= b),
+    ("min_area", "area_m2", lambda v, b: v >= b),
+    ("max_area", "area_m2", lambda v, b: v <= b),
+    ("max_eur_m2", "eur_m2", lambda v, b: v <= b),
+)
+_COLUMNS = ("name", "district", "search_type", "typology", "source") + tuple(b[0] for b in _BOUNDS)
+
+
+def create_saved_searches_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS saved_searches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            district TEXT,
+            search_type TEXT NOT NULL,
+            typology TEXT,
+            source TEXT,
+            min_price REAL,
+            max_price REAL,
+            min_area REAL,
+            max_area REAL,
+            max_eur_m2 REAL,
+            created_at DATETIME,
+            read_upto INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS saved_search_hits (
+            id INTEGER PRIMARY KEY,
+            search_id INTEGER NOT NULL,
+            listing_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            price_eur REAL,
+            old_price_eur REAL,
+            matched_at DATETIME
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_saved_search_hits_search ON saved_search_hits(search_id, id)")
+
+
+class SearchIndex:
+    """Process-wide predicate index: {(district, search_type, typology): [search, ...]}."""
+
+    def __init__(self):
+        self.version = None
+        self.by_key = {}
+        self.lock = threading.Lock()
+
+    def _refresh(self, cur):
+        cur.execute("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM saved_searches")
+        version = cur.fetchone()
+        if version == self.version:
+            return
+        cur.execute(f"SELECT id, {', '.join(_COLUMNS)} FROM saved_searches")
+        names = [d[0] for d in cur.description]
+        by_key = {}
+        for row in cur.fetchall():
+            s = dict(zip(names, row))
+            by_key.setdefault((s["district"], s["search_type"], s["typology"]), []).append(s)
+        self.by_key = by_key
+        self.version = version
+        logger.info(f"Saved-search index loaded: {version[1]} searches, {len(by_key)} keys")
+
+    def candidates(self, listing):
+        district, search_type, typology = listing["district"], listing["search_type"], listing["typology"]
+        for d in (district, None):
+            for t in (typology, None):
+                yield from self.by_key.get((d, search_type, t), ())
+
+    def match(self, cur, listings):
+        """(search_id, listing) pairs for the listings each search accepts."""
+        with self.lock:
+            self._refresh(cur)
+            if not self.by_key:
+                return []
+            out = []
+            for listing in listings:
+                for s in self.candidates(listing):
+                    if s["source"] and s["source"] != listing["source"]:
+                        continue
+                    ok = True
+                    for column, field, accepts in _BOUNDS:
+                        bound = s[column]
+                        if bound is None:
+                            continue
+                        value = listing.get(field)
+                        # As in apply_filters: a bound excludes listings without the value
+                        if value is None or not accepts(value, bound):
+                            ok = False
+                            break
+                    if ok:
+                        out.append((s["id"], listing))
+            return out
+
+
+SEARCH_INDEX = SearchIndex()
+
+
+def match_saved_searches(cur, listings):
+    """Files inserted/repriced listings into the inboxes of the searches they match; call inside the writing transaction.
+
+    Each listing is a dict with id, kind ("new"/"price"), price_eur,
+    old_price_eur, district, search_type, typology, source, area_m2 and
+    eur_m2. Returns the number of hits.
+    """
+    if not listings:
+        return 0
+    hits = SEARCH_INDEX.match(cur, listings)
+    now = datetime.datetime.now().isoformat()
+    cur.executemany("""
+        INSERT INTO saved_search_hits (search_id, listing_id, kind, price_eur, old_price_eur, matched_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(sid, l["id"], l["kind"], l["price_eur"], l["old_price_eur"], now) for sid, l in hits])
+    return len(hits)
+
+
+def create_saved_search(search):
+    """Stores a search from a dict of filters; "T*"/"" typology and empty values mean any. Returns it with its id.
+
+    The typology is normalized like a request's ("t2" -> "T2"), since listings carry normalized typologies.
+
+    Raises ValueError for an unknown search_type or a non-numeric bound.
+    """
+    values = {c: search.get(c) or None for c in _COLUMNS}
+    if values["search_type"] not in SEARCH_TYPES:
+        raise ValueError(f"invalid search_type: {values['search_type']}")
+    if values["typology"] is not None:
+        values["typology"] = normalize_typology(str(values["typology"]))
+    if values["typology"] == "T*":
+        values["typology"] = None
+    for column, _, _ in _BOUNDS:
+        if values[column] is not None:
+            values[column] = float(values[column])
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        INSERT INTO saved_searches ({', '.join(_COLUMNS)}, created_at)
+        VALUES ({', '.join('?' * len(_COLUMNS))}, ?)
+        RETURNING id, created_at
+    """, [values[c] for c in _COLUMNS] + [datetime.datetime.now().isoformat()])
+    search_id, created_at = cur.fetchone()
+    conn.commit()
+    conn.close()
+    return {"id": search_id, **values, "created_at": created_at, "unread": 0}
+
+
+def get_saved_searches():
+    """Every saved search with its inbox size and unread count."""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT s.*, COUNT(h.id) AS hits, COUNT(CASE WHEN h.id > s.read_upto THEN 1 END) AS unread
+        FROM saved_searches s LEFT JOIN saved_search_hits h ON h.search_id = s.id
+        GROUP BY s.id ORDER BY s.id
+    """)
+    rows = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+
+def delete_saved_search(search_id):
+    """Deletes a search and its inbox. Returns False if there was no such search."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM saved_searches WHERE id = ?", (search_id,))
+    deleted = cur.rowcount > 0
+    cur.execute("DELETE FROM saved_search_hits WHERE search_id = ?", (search_id,))
+    conn.commit()
+    conn.close()
+    return deleted
+
+
+def get_inbox(search_id, since=None, limit=100):
+    """Hits of one search after hit id `since` (default: the last one read), oldest first, with the listing's current data.
+
+    Returns {"hits": [...], "next": id to pass as `since`} or None for an unknown search.
+    """
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute("SELECT read_upto FROM saved_searches WHERE id = ?", (search_id,))
+    row = cur.fetchone()
+    if row is None:
+        conn.close()
+        return None
+    since = row["read_upto"] if since is None else since
+    cur.execute("""
+        SELECT h.id, h.kind, h.price_eur, h.old_price_eur, h.matched_at,
+               l.url, l.title, l.source, l.district, l.search_type, l.typology,
+               l.area_m2, l.eur_m2, l.property_id, l.is_active
+        FROM saved_search_hits h JOIN listings l ON l.id = h.listing_id
+        WHERE h.search_id = ? AND h.id > ?
+        ORDER BY h.id LIMIT ?
+    """, (search_id, since, limit))
+    hits = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return {"hits": hits, "next": hits[-1]["id"] if hits else since}
+
+
+def mark_inbox_read(search_id, upto=None):
+    """Marks hits up to id `upto` (default: all) as read. Returns False for an unknown search."""
+    conn = get_connection()
+    cur = conn.cursor()
+    if upto is None:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM saved_search_hits WHERE search_id = ?", (search_id,))
+        upto = cur.fetchone()[0]
+    # Never moves backwards
+    cur.execute("UPDATE saved_searches SET read_upto = MAX(read_upto, ?) WHERE id = ?", (upto, search_id))
+    found = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    return found
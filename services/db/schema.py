@@ -0,0 +1,250 @@
+"""Physical layout of the listings table.
+
+Listings live in `listing_rows`, keyed by an integer `id` (the rowid) with a
+unique index on `url`. The four low-cardinality text columns are
+dictionary-encoded: each row stores small integer ids into `sources`,
+`districts`, `search_types` and `typologies`. Id 0 in every dictionary
+stands for NULL, so the joins can always be inner joins and a filter on a
+name is resolved to an id first, then served from the integer indexes.
+
+`listings` is a view with the original columns (names instead of ids), so
+existing reads keep working. INSTEAD OF triggers route INSERT/UPDATE/DELETE
+on the view to `listing_rows`; hot paths write `listing_rows` directly.
+"""
+import logging
+
+logger = logging.getLogger("schema")
+
+# Encoded column -> dictionary table
+DIMENSIONS = {
+    "source": "sources",
+    "district": "districts",
+    "search_type": "search_types",
+    "typology": "typologies",
+}
+
+# Columns stored as-is, in the view's column order after `url`
+_PLAIN_COLUMNS = (
+    "title", "price_eur", "area_m2", "eur_m2", "snippet", "first_seen", "last_seen",
+    "posted_at", "actualized_at", "is_active", "property_id",
+)
+
+# Columns added to listing_rows after its first layout, with their types;
+# they follow _PLAIN_COLUMNS in the view. Filled by detail-page enrichment,
+# except deal_score (see deals.py).
+_ADDED_COLUMNS = (
+    ("description", "TEXT"),
+    ("floor", "TEXT"),
+    ("energy_rating", "TEXT"),
+    ("latitude", "REAL"),
+    ("longitude", "REAL"),
+    ("enriched_at", "DATETIME"),
+    ("deal_score", "REAL"),
+)
+
+# Everything the view exposes after the dimensions
+VIEW_COLUMNS = _PLAIN_COLUMNS + tuple(c for c, _ in _ADDED_COLUMNS)
+
+# What listing queries return: everything but the full description, which only detail views need
+LIST_COLUMNS = tuple(c for c in ("id", "url", *DIMENSIONS, *VIEW_COLUMNS) if c != "description")
+
+
+def dimension_name_sql(column, ref):
+    """SQL giving the name behind `{ref}.{column}_id` (NULL for id 0)."""
+    return f"(SELECT name FROM {DIMENSIONS[column]} WHERE id = {ref}.{column}_id)"
+
+
+def dimension_id_sql(column, value):
+    """SQL giving the dictionary id for the name expression `value` (0 for NULL/unknown)."""
+    return f"COALESCE((SELECT id FROM {DIMENSIONS[column]} WHERE name = {value}), 0)"
+
+
+def dimension_ids(cur, item, cache=None):
+    """{"source_id": .., "district_id": .., ...} for a dict of names, adding unseen names.
+
+    `cache` (a dict) saves the lookups for names already resolved in the
+    same transaction; don't keep it across transactions, as a rollback
+    would undo the ids it holds.
+    """
+    out = {}
+    for column, table in DIMENSIONS.items():
+        name = item.get(column)
+        key = (column, name)
+        if cache is not None and key in cache:
+            out[f"{column}_id"] = cache[key]
+            continue
+        if name is None:
+            dim_id = 0
+        else:
+            cur.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+            cur.execute(f"SELECT id FROM {table} WHERE name = ?", (name,))
+            dim_id = cur.fetchone()[0]
+        if cache is not None:
+            cache[key] = dim_id
+        out[f"{column}_id"] = dim_id
+    return out
+
+
+def _view_sql():
+    cols = ["r.id", "r.url"]
+    cols += [f"{table}.name AS {column}" for column, table in DIMENSIONS.items()]
+    cols += [f"r.{c}" for c in VIEW_COLUMNS]
+    joins = " ".join(f"JOIN {table} ON {table}.id = r.{column}_id" for column, table in DIMENSIONS.items())
+    return f"CREATE VIEW IF NOT EXISTS listings AS SELECT {', '.join(cols)} FROM listing_rows r {joins}"
+
+
+def _ensure_names_sql():
+    # Statements (inside a trigger) registering NEW's names in the dictionaries
+    return "".join(
+        f"INSERT OR IGNORE INTO {table} (name) SELECT NEW.{column} WHERE NEW.{column} IS NOT NULL;"
+        for column, table in DIMENSIONS.items()
+    )
+
+
+def _create_tables(cur):
+    for table in DIMENSIONS.values():
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE
+            )
+        """)
+        cur.execute(f"INSERT OR IGNORE INTO {table} (id, name) VALUES (0, NULL)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS listing_rows (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL UNIQUE,
+            source_id INTEGER NOT NULL DEFAULT 0,
+            district_id INTEGER NOT NULL DEFAULT 0,
+            search_type_id INTEGER NOT NULL DEFAULT 0,
+            typology_id INTEGER NOT NULL DEFAULT 0,
+            title TEXT,
+            price_eur REAL,
+            area_m2 REAL,
+            eur_m2 REAL,
+            snippet TEXT,
+            first_seen DATETIME,
+            last_seen DATETIME,
+            posted_at DATETIME,
+            actualized_at DATETIME,
+            is_active INTEGER DEFAULT 1,
+            property_id INTEGER
+        )
+    """)
+    cur.execute("PRAGMA table_info(listing_rows)")
+    have = {r[1] for r in cur.fetchall()}
+    for column, kind in _ADDED_COLUMNS:
+        if column not in have:
+            cur.execute(f"ALTER TABLE listing_rows ADD COLUMN {column} {kind}")
+
+
+def create_listings_schema(cur):
+    """Creates the dictionaries, listing_rows, the listings view and its write triggers."""
+    _create_tables(cur)
+    cur.execute("PRAGMA table_info(listings)")
+    view_cols = [r[1] for r in cur.fetchall()]
+    if view_cols and view_cols[len(DIMENSIONS) + 2:] != list(VIEW_COLUMNS):
+        # Columns were added to listing_rows: dropping the view drops its triggers too
+        cur.execute("DROP VIEW listings")
+    cur.execute(_view_sql())
+
+    dim_cols = [f"{c}_id" for c in DIMENSIONS]
+    dim_vals = [dimension_id_sql(c, f"NEW.{c}") for c in DIMENSIONS]
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_listings_view_insert INSTEAD OF INSERT ON listings
+        BEGIN
+            {_ensure_names_sql()}
+            INSERT INTO listing_rows (id, url, {', '.join(dim_cols)}, {', '.join(VIEW_COLUMNS)})
+            VALUES (NEW.id, NEW.url, {', '.join(dim_vals)}, {', '.join('NEW.' + c for c in VIEW_COLUMNS)});
+        END
+    """)
+    sets = [f"{c} = {v}" for c, v in zip(dim_cols, dim_vals)]
+    sets += [f"{c} = NEW.{c}" for c in ("id", "url") + VIEW_COLUMNS]
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_listings_view_update INSTEAD OF UPDATE ON listings
+        BEGIN
+            {_ensure_names_sql()}
+            UPDATE listing_rows SET {', '.join(sets)} WHERE id = OLD.id;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_listings_view_delete INSTEAD OF DELETE ON listings
+        BEGIN
+            DELETE FROM listing_rows WHERE id = OLD.id;
+        END
+    """)
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_listing_rows_dims ON listing_rows(district_id, search_type_id, typology_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_listing_rows_search_type ON listing_rows(search_type_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_listing_rows_posted_at ON listing_rows(posted_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_listing_rows_property_id ON listing_rows(property_id)")
+    create_listing_revisions(cur)
+
+
+def create_listing_revisions(cur):
+    """listing_revs: a revision number per listing, bumped by every write that changes the row.
+
+    Revisions are allocated inside the writing transaction, and SQLite has a
+    single writer, so they grow in commit order: a reader that has seen
+    everything up to revision N will find every later change above N. The
+    snapshot export uses them as its watermark (timestamps taken before the
+    write lock can commit out of order, and enrichment never moves last_seen).
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS listing_revs (
+            listing_id INTEGER PRIMARY KEY,
+            rev INTEGER NOT NULL
+        )
+    """)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_listing_revs_rev ON listing_revs(rev)")
+    bump = """
+        INSERT OR REPLACE INTO listing_revs (listing_id, rev)
+        VALUES (NEW.id, (SELECT COALESCE(MAX(rev), 0) + 1 FROM listing_revs));
+    """
+    columns = ("url", *(f"{c}_id" for c in DIMENSIONS), *VIEW_COLUMNS)
+    # Recreated so that columns added later are watched too
+    cur.execute("DROP TRIGGER IF EXISTS trg_listing_revs_update")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_listing_revs_insert AFTER INSERT ON listing_rows BEGIN {bump} END")
+    cur.execute(f"""
+        CREATE TRIGGER trg_listing_revs_update AFTER UPDATE ON listing_rows
+        WHEN {' OR '.join(f'OLD.{c} IS NOT NEW.{c}' for c in columns)}
+        BEGIN {bump} END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_listing_revs_delete AFTER DELETE ON listing_rows
+        BEGIN DELETE FROM listing_revs WHERE listing_id = OLD.id; END
+    """)
+    # Rows written before revisions existed
+    cur.execute("""
+        INSERT INTO listing_revs (listing_id, rev)
+        SELECT id, (SELECT COALESCE(MAX(rev), 0) FROM listing_revs) + ROW_NUMBER() OVER (ORDER BY id)
+        FROM listing_rows WHERE id NOT IN (SELECT listing_id FROM listing_revs)
+    """)
+
+
+def migrate_legacy_listings(cur):
+    """Moves a `listings` *table* (url TEXT PRIMARY KEY, text columns) into listing_rows.
+
+    Listing ids are kept, so price_points stay attached. The old table is
+    dropped (with its indexes and triggers); call create_listings_schema
+    afterwards to put the view in its place.
+    """
+    _create_tables(cur)
+    cur.execute("SELECT COUNT(*) FROM listings")
+    total = cur.fetchone()[0]
+    logger.info(f"Migrating {total} listings to listing_rows...")
+    for column, table in DIMENSIONS.items():
+        cur.execute(f"""
+            INSERT OR IGNORE INTO {table} (name)
+            SELECT DISTINCT {column} FROM listings WHERE {column} IS NOT NULL ORDER BY 1
+        """)
+    dim_cols = [f"{c}_id" for c in DIMENSIONS]
+    dim_vals = [dimension_id_sql(c, f"l.{c}") for c in DIMENSIONS]
+    cur.execute(f"""
+        INSERT INTO listing_rows (id, url, {', '.join(dim_cols)}, {', '.join(_PLAIN_COLUMNS)})
+        SELECT COALESCE(l.id, l.rowid), l.url, {', '.join(dim_vals)}, {', '.join('l.' + c for c in _PLAIN_COLUMNS)}
+        FROM listings l
+        ORDER BY l.id
+    """)
+    cur.execute("DROP TABLE listings")
+    logger.info("Listings migration done.")
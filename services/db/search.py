@@ -0,0 +1,97 @@
+"""Full-text search over listing titles, snippets and descriptions.
+
+`listing_fts` is an FTS5 index with `listing_rows` as its external
+content (nothing is stored twice), kept in sync by triggers. The
+`unicode61 remove_diacritics 2` tokenizer folds case and accents the way
+`slugify_pt` does, so "varanda", "Varanda" and "terraço"/"terraco" match
+each other, on both the indexed text and the query.
+
+Queries use a small search-box syntax translated into FTS5:
+
+    varanda garagem        both words
+    "vista mar"            the phrase
+    garag*                 prefix
+    -temporário            excluded
+"""
+import re
+import logging
+
+logger = logging.getLogger("search")
+
+_TERM_RE = re.compile(r'(-?)"([^"]*)"|(-?)(\S+)')
+
+
+def create_search_index(cur):
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS listing_fts USING fts5(
+            title, snippet, description,
+            content = 'listing_rows', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_listing_fts_insert AFTER INSERT ON listing_rows
+        BEGIN
+            INSERT INTO listing_fts (rowid, title, snippet, description)
+            VALUES (NEW.id, NEW.title, NEW.snippet, NEW.description);
+        END
+    """)
+    # External content: the old values must be handed back to remove a row
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_listing_fts_update AFTER UPDATE OF title, snippet, description ON listing_rows
+        WHEN OLD.title IS NOT NEW.title OR OLD.snippet IS NOT NEW.snippet OR OLD.description IS NOT NEW.description
+        BEGIN
+            INSERT INTO listing_fts (listing_fts, rowid, title, snippet, description)
+            VALUES ('delete', OLD.id, OLD.title, OLD.snippet, OLD.description);
+            INSERT INTO listing_fts (rowid, title, snippet, description)
+            VALUES (NEW.id, NEW.title, NEW.snippet, NEW.description);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_listing_fts_delete AFTER DELETE ON listing_rows
+        BEGIN
+            INSERT INTO listing_fts (listing_fts, rowid, title, snippet, description)
+            VALUES ('delete', OLD.id, OLD.title, OLD.snippet, OLD.description);
+        END
+    """)
+
+
+def rebuild_search_index(cur):
+    """Re-reads every listing into listing_fts."""
+    cur.execute("INSERT INTO listing_fts (listing_fts) VALUES ('rebuild')")
+    logger.info("Full-text index rebuilt.")
+
+
+def _fts_term(text, phrase):
+    prefix = not phrase and text.endswith("*")
+    # Keep word characters only; FTS5 operators and quotes have no place inside a term
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    term = '"' + " ".join(words) + '"'
+    return term + "*" if prefix else term
+
+
+def parse_search(q):
+    """(include, exclude) FTS5 expressions for a search-box query; either may be None."""
+    include, exclude = [], []
+    for m in _TERM_RE.finditer(q or ""):
+        negated = bool(m.group(1) or m.group(3))
+        phrase = m.group(2) is not None
+        term = _fts_term(m.group(2) if phrase else m.group(4), phrase)
+        if term:
+            (exclude if negated else include).append(term)
+    return (" AND ".join(include) or None), (" OR ".join(exclude) or None)
+
+
+def text_match_sql(q, ref="l"):
+    """SQL condition on `{ref}.id` matching query `q`, with its parameters; ("", []) for an empty query."""
+    include, exclude = parse_search(q)
+    sql, params = [], []
+    if include:
+        sql.append(f"{ref}.id IN (SELECT rowid FROM listing_fts WHERE listing_fts MATCH ?)")
+        params.append(include)
+    if exclude:
+        sql.append(f"{ref}.id NOT IN (SELECT rowid FROM listing_fts WHERE listing_fts MATCH ?)")
+        params.append(exclude)
+    return " AND ".join(sql), params
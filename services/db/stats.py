@@ -1,21 +1,380 @@
 import datetime
 import sqlite3
 from .connection import get_connection
+from .schema import dimension_name_sql
 
-def get_stats():
-    """Returns some interesting stats for the dynamic graphics."""
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    
-    # 1. Average price per m2 per district for Rent vs Buy
+# Dimensions of the pre-aggregated analytics cube. NULL dimension values are
+# stored as '' so they can be part of the primary key.
+CUBE_DIMENSIONS = ("district", "search_type", "typology", "source", "day")
+
+# Time buckets for the rollup tables, as SQL over a date/datetime column.
+# Weeks start on Monday.
+RESOLUTIONS = ("day", "week", "month")
+_BUCKET_SQL = {
+    "day": "date({col})",
+    "week": "date({col}, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m-01', {col})",
+}
+
+_SUM_COLUMNS = "n, n_eur_m2, sum_eur_m2, n_price, sum_price_eur"
+
+def _rollup_delta_sql(table, keys, ref, sign):
+    """Upsert adding (sign=+1) or removing (sign=-1) listing row `ref` (NEW/OLD) to/from a rollup.
+
+    `keys` are (column, SQL expression) pairs; `{ref}` in an expression is
+    replaced by NEW/OLD. Rows whose count drops to zero are removed.
+    """
+    cols = ", ".join(c for c, _ in keys)
+    exprs = ", ".join(e.format(ref=ref) for _, e in keys)
+    sql = f"""
+        INSERT INTO {table} ({cols}, {_SUM_COLUMNS})
+        VALUES ({exprs}, {sign},
+                {sign} * ({ref}.eur_m2 IS NOT NULL), {sign} * COALESCE({ref}.eur_m2, 0),
+                {sign} * ({ref}.price_eur IS NOT NULL), {sign} * COALESCE({ref}.price_eur, 0))
+        ON CONFLICT({cols}) DO UPDATE SET
+            n = n + excluded.n,
+            n_eur_m2 = n_eur_m2 + excluded.n_eur_m2,
+            sum_eur_m2 = sum_eur_m2 + excluded.sum_eur_m2,
+            n_price = n_price + excluded.n_price,
+            sum_price_eur = sum_price_eur + excluded.sum_price_eur;
+    """
+    if sign < 0:
+        sql += f"DELETE FROM {table} WHERE ({cols}) = ({exprs}) AND n <= 0;"
+    return sql
+
+def _changed_sql(columns):
+    return " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in columns)
+
+def _create_rollup_triggers(cur, table, keys, condition, columns):
+    """AFTER INSERT/DELETE/UPDATE triggers on listing_rows keeping `table` in step.
+
+    `condition` selects the rows counted (with `{ref}` for NEW/OLD); updates
+    only fire when one of `columns` changed.
+    """
+    def body(ref, sign):
+        return "".join(_rollup_delta_sql(table, k, ref, sign) for k in keys)
+    new_cond = condition.format(ref="NEW")
+    old_cond = condition.format(ref="OLD")
+    changed = _changed_sql(columns)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON listing_rows
+        WHEN {new_cond}
+        BEGIN {body("NEW", 1)} END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON listing_rows
+        WHEN {old_cond}
+        BEGIN {body("OLD", -1)} END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_update_old AFTER UPDATE ON listing_rows
+        WHEN {old_cond} AND ({changed})
+        BEGIN {body("OLD", -1)} END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_update_new AFTER UPDATE ON listing_rows
+        WHEN {new_cond} AND ({changed})
+        BEGIN {body("NEW", 1)} END
+    """)
+
+def _name(column):
+    return f"COALESCE({dimension_name_sql(column, '{ref}')}, '')"
+
+_CUBE_KEYS = [
+    ("district", _name("district")),
+    ("search_type", _name("search_type")),
+    ("typology", _name("typology")),
+    ("source", _name("source")),
+    ("day", "COALESCE(date({ref}.first_seen), '')"),
+]
+
+def _posted_keys(resolution):
+    return [
+        ("resolution", f"'{resolution}'"),
+        ("search_type", _name("search_type")),
+        ("typology", _name("typology")),
+        ("district", _name("district")),
+        ("bucket", "COALESCE(" + _BUCKET_SQL[resolution].format(col="{ref}.posted_at") + ", '')"),
+    ]
+
+def create_stats_cube(cur):
+    """Creates the analytics cube and the triggers that keep it in step with `listing_rows`.
+
+    The cube holds counts and sums of active listings per
+    (district, search_type, typology, source, first-seen day). Triggers apply
+    every insert/update/delete as a +/- delta, so it never needs a rescan.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stats_cube (
+            district TEXT,
+            search_type TEXT,
+            typology TEXT,
+            source TEXT,
+            day TEXT,
+            n INTEGER,
+            n_eur_m2 INTEGER,
+            sum_eur_m2 REAL,
+            n_price INTEGER,
+            sum_price_eur REAL,
+            PRIMARY KEY (district, search_type, typology, source, day)
+        )
+    """)
+    # Refreshing last_seen (the common update) must not touch the cube
+    _create_rollup_triggers(
+        cur, "stats_cube", [_CUBE_KEYS], "{ref}.is_active = 1",
+        ("is_active", "district_id", "search_type_id", "typology_id", "source_id", "first_seen", "eur_m2", "price_eur"),
+    )
+
+def rebuild_stats_cube(cur):
+    """Recomputes the cube from scratch (first run, or after bulk edits done with triggers off)."""
+    cur.execute("DELETE FROM stats_cube")
     cur.execute("""
-        SELECT district, search_type, AVG(eur_m2) as avg_eur_m2, COUNT(*) as count
+        INSERT INTO stats_cube (district, search_type, typology, source, day,
+                                n, n_eur_m2, sum_eur_m2, n_price, sum_price_eur)
+        SELECT COALESCE(district, ''), COALESCE(search_type, ''), COALESCE(typology, ''),
+               COALESCE(source, ''), COALESCE(date(first_seen), ''),
+               COUNT(*), COUNT(eur_m2), COALESCE(SUM(eur_m2), 0), COUNT(price_eur), COALESCE(SUM(price_eur), 0)
         FROM listings
-        WHERE eur_m2 IS NOT NULL AND is_active = 1
-        GROUP BY district, search_type
+        WHERE is_active = 1
+        GROUP BY 1, 2, 3, 4, 5
     """)
+
+def create_rollups(cur):
+    """Creates the time-bucketed rollups behind /api/history.
+
+    - `posted_rollup`: active listings per posted_at day/week/month, kept
+      current by triggers on listings like the stats cube.
+    - `history_rollup`: daily_stats snapshots folded into day/week/month
+      buckets; update_daily_stats refreshes the buckets of the day it writes.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS posted_rollup (
+            resolution TEXT,
+            search_type TEXT,
+            typology TEXT,
+            district TEXT,
+            bucket TEXT,
+            n INTEGER,
+            n_eur_m2 INTEGER,
+            sum_eur_m2 REAL,
+            n_price INTEGER,
+            sum_price_eur REAL,
+            PRIMARY KEY (resolution, search_type, typology, district, bucket)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS history_rollup (
+            resolution TEXT,
+            search_type TEXT,
+            typology TEXT,
+            district TEXT,
+            bucket TEXT,
+            days INTEGER,
+            sum_count INTEGER,
+            sum_unique INTEGER,
+            n_eur_m2 INTEGER,
+            sum_eur_m2 REAL,
+            n_price INTEGER,
+            sum_price_eur REAL,
+            PRIMARY KEY (resolution, search_type, typology, district, bucket)
+        ) WITHOUT ROWID
+    """)
+    _create_rollup_triggers(
+        cur, "posted_rollup", [_posted_keys(r) for r in RESOLUTIONS],
+        "{ref}.is_active = 1 AND {ref}.posted_at IS NOT NULL",
+        ("is_active", "district_id", "search_type_id", "typology_id", "posted_at", "eur_m2", "price_eur"),
+    )
+
+def rebuild_rollups(cur):
+    """Recomputes posted_rollup and history_rollup from scratch."""
+    cur.execute("DELETE FROM posted_rollup")
+    for res in RESOLUTIONS:
+        bucket = _BUCKET_SQL[res].format(col="posted_at")
+        cur.execute(f"""
+            INSERT INTO posted_rollup (resolution, search_type, typology, district, bucket, {_SUM_COLUMNS})
+            SELECT ?, COALESCE(search_type, ''), COALESCE(typology, ''), COALESCE(district, ''),
+                   COALESCE({bucket}, ''),
+                   COUNT(*), COUNT(eur_m2), COALESCE(SUM(eur_m2), 0), COUNT(price_eur), COALESCE(SUM(price_eur), 0)
+            FROM listings
+            WHERE is_active = 1 AND posted_at IS NOT NULL
+            GROUP BY 2, 3, 4, 5
+        """, (res,))
+    cur.execute("DELETE FROM history_rollup")
+    for res in RESOLUTIONS:
+        _rollup_history(cur, res)
+
+def _bucket_range(day, resolution):
+    """First and last day (ISO strings) of the bucket containing `day`."""
+    if resolution == "week":
+        start = day - datetime.timedelta(days=day.weekday())
+        end = start + datetime.timedelta(days=6)
+    elif resolution == "month":
+        start = day.replace(day=1)
+        end = (start + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+    else:
+        start = end = day
+    return start.isoformat(), end.isoformat()
+
+def _rollup_history(cur, resolution, day=None):
+    """(Re)writes history_rollup rows for every bucket, or only the one holding `day`."""
+    where, params = "", [resolution]
+    if day is not None:
+        start, end = _bucket_range(day, resolution)
+        cur.execute(
+            "DELETE FROM history_rollup WHERE resolution = ? AND bucket = ?", (resolution, start)
+        )
+        where = "WHERE date BETWEEN ? AND ?"
+        params += [start, end]
+    bucket = _BUCKET_SQL[resolution].format(col="date")
+    cur.execute(f"""
+        INSERT OR REPLACE INTO history_rollup (
+            resolution, search_type, typology, district, bucket, days, sum_count, sum_unique,
+            n_eur_m2, sum_eur_m2, n_price, sum_price_eur
+        )
+        SELECT ?, COALESCE(search_type, ''), COALESCE(typology, ''), COALESCE(district, ''), {bucket},
+               COUNT(*), SUM(count), SUM(unique_count),
+               SUM(CASE WHEN avg_eur_m2 IS NOT NULL THEN count END), SUM(avg_eur_m2 * count),
+               SUM(CASE WHEN avg_price_eur IS NOT NULL THEN count END), SUM(avg_price_eur * count)
+        FROM daily_stats
+        {where}
+        GROUP BY 2, 3, 4, 5
+    """, params)
+
+def downsample_lttb(rows, max_points, x_key="date", y_key="avg_eur_m2"):
+    """Largest-Triangle-Three-Buckets downsampling of a date-ordered series.
+
+    Keeps the first and last rows and, from each of `max_points - 2` equal
+    buckets in between, the row forming the largest triangle with its
+    neighbours, which preserves peaks and dips far better than striding.
+    """
+    n = len(rows)
+    if not max_points or max_points >= n or max_points < 3:
+        return rows
+
+    def xy(r):
+        try:
+            x = datetime.date.fromisoformat(r[x_key]).toordinal()
+        except (TypeError, ValueError):
+            x = 0
+        return x, (r[y_key] or 0.0)
+
+    points = [xy(r) for r in rows]
+    out = [rows[0]]
+    every = (n - 2) / (max_points - 2)
+    a = 0
+    for i in range(max_points - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # Average of the next bucket (or the last point) as the third vertex
+        nxt_start, nxt_end = end, min(int((i + 2) * every) + 1, n)
+        if nxt_start >= nxt_end:
+            nxt_start, nxt_end = n - 1, n
+        avg_x = sum(p[0] for p in points[nxt_start:nxt_end]) / (nxt_end - nxt_start)
+        avg_y = sum(p[1] for p in points[nxt_start:nxt_end]) / (nxt_end - nxt_start)
+        ax, ay = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, min(end, n - 1)):
+            bx, by = points[j]
+            area = abs((ax - avg_x) * (by - ay) - (ax - bx) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(rows[best])
+        a = best
+    out.append(rows[-1])
+    return out
+
+def get_cube_stats(by=("district", "search_type"), **filters):
+    """Aggregates from the cube, grouped by any of CUBE_DIMENSIONS.
+
+    `filters` are equality filters on dimensions (e.g. district="Lisboa"),
+    plus `day_from`/`day_to` (ISO dates, inclusive). Cost depends on the cube
+    size, not on the number of listings.
+    """
+    by = [d for d in by if d in CUBE_DIMENSIONS]
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+
+    cols = ", ".join(f"NULLIF({d}, '') AS {d}" for d in by)
+    query = f"""
+        SELECT {cols + ',' if cols else ''}
+            SUM(n) AS count,
+            SUM(n_eur_m2) AS count_eur_m2,
+            SUM(sum_eur_m2) / NULLIF(SUM(n_eur_m2), 0) AS avg_eur_m2,
+            SUM(sum_price_eur) / NULLIF(SUM(n_price), 0) AS avg_price_eur
+        FROM stats_cube WHERE 1=1
+    """
+    params = []
+    for d in CUBE_DIMENSIONS:
+        if filters.get(d) is not None:
+            query += f" AND {d} = ?"
+            params.append(filters[d])
+    if filters.get("day_from"):
+        query += " AND day >= ?"
+        params.append(filters["day_from"])
+    if filters.get("day_to"):
+        query += " AND day <= ?"
+        params.append(filters["day_to"])
+    if by:
+        query += " GROUP BY " + ", ".join(by) + " ORDER BY " + ", ".join(by)
+
+    cur.execute(query, params)
     rows = cur.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def get_yields(by="district", **filters):
+    """Gross rental yield (12 x rent €/m² / buy €/m²) per value of dimension `by`, from the cube."""
+    filters.pop("search_type", None)
+    rows = get_cube_stats(by=(by, "search_type"), **filters)
+    grouped = {}
+    for r in rows:
+        grouped.setdefault(r[by], {})[r["search_type"]] = r
+    yields = []
+    for key, s in grouped.items():
+        if "rent" in s and "buy" in s:
+            rent_m2 = s["rent"]["avg_eur_m2"]
+            buy_m2 = s["buy"]["avg_eur_m2"]
+            if rent_m2 is not None and buy_m2:
+                yields.append({
+                    by: key,
+                    'yield': (rent_m2 * 12) / buy_m2,
+                    'rent_m2': rent_m2,
+                    'buy_m2': buy_m2
+                })
+    return yields
+
+def get_stats(collapse=False):
+    """Returns some interesting stats for the dynamic graphics.
+
+    Served from the pre-aggregated cube. With `collapse`, listings of the same
+    property on several portals count once; that needs distinct property ids,
+    which the additive cube can't hold, so it queries `listings` directly.
+    """
+    if collapse:
+        conn = get_connection()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT district, search_type, AVG(eur_m2) as avg_eur_m2, COUNT(*) as count
+            FROM (
+                SELECT district, search_type, AVG(eur_m2) as eur_m2
+                FROM listings
+                WHERE eur_m2 IS NOT NULL AND is_active = 1
+                GROUP BY district, search_type, COALESCE(property_id, url)
+            )
+            GROUP BY district, search_type
+        """)
+        rows = [dict(r) for r in cur.fetchall()]
+        conn.close()
+    else:
+        # 1. Average price per m2 per district for Rent vs Buy
+        rows = [
+            {'district': r['district'], 'search_type': r['search_type'],
+             'avg_eur_m2': r['avg_eur_m2'], 'count': r['count_eur_m2']}
+            for r in get_cube_stats(by=("district", "search_type"))
+            if r['count_eur_m2']
+        ]
     
     district_stats = {}
     for r in rows:
@@ -40,7 +399,6 @@ def get_stats():
                     'buy_m2': buy_m2
                 })
     
-    conn.close()
     return {
         'district_stats': district_stats,
         'yields': yields
@@ -52,14 +410,15 @@ def update_daily_stats():
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     
-    today = datetime.date.today().isoformat()
+    today = datetime.date.today()
     
     cur.execute("""
         SELECT 
             district, search_type, typology, 
             AVG(eur_m2) as avg_eur_m2, 
             AVG(price_eur) as avg_price_eur,
-            COUNT(*) as count
+            COUNT(*) as count,
+            COUNT(DISTINCT COALESCE(property_id, url)) as unique_count
         FROM listings
         WHERE is_active = 1
         GROUP BY district, search_type, typology
@@ -70,71 +429,140 @@ def update_daily_stats():
         cur.execute("""
             INSERT OR REPLACE INTO daily_stats (
                 date, district, search_type, typology, 
-                avg_eur_m2, avg_price_eur, count
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                avg_eur_m2, avg_price_eur, count, unique_count
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, (
-            today, r['district'], r['search_type'], r['typology'],
-            r['avg_eur_m2'], r['avg_price_eur'], r['count']
+            today.isoformat(), r['district'], r['search_type'], r['typology'],
+            r['avg_eur_m2'], r['avg_price_eur'], r['count'], r['unique_count']
         ))
+
+    # Only today's day/week/month buckets can have changed
+    for res in RESOLUTIONS:
+        _rollup_history(cur, res, today)
         
     conn.commit()
     conn.close()
 
-def get_historical_stats(district=None, search_type=None, typology=None):
-    """Retrieves historical stats for plotting."""
+def get_slice_activity(window_days=14):
+    """Churn per (source, district, search_type, typology) slice over the last `window_days`.
+
+    {key: {"new": listings first seen, "changes": price changes after the
+    first day, "last_seen": latest time any of its listings was scraped}}.
+    New listings come from the cube (active listings only), so this stays
+    cheap; price changes and last_seen scan the listing tables.
+    """
+    since = datetime.date.today() - datetime.timedelta(days=window_days)
+    since_day = since.toordinal() - datetime.date(1970, 1, 1).toordinal()
+    conn = get_connection()
+    cur = conn.cursor()
+    out = {}
+
+    def slot(key):
+        return out.setdefault(key, {"new": 0, "changes": 0, "last_seen": None})
+
+    cur.execute("""
+        SELECT source, district, search_type, typology, SUM(n) FROM stats_cube
+        WHERE day >= ? GROUP BY source, district, search_type, typology
+    """, (since.isoformat(),))
+    for *key, n in cur.fetchall():
+        slot(tuple(key))["new"] = n
+
+    names = ", ".join(f"COALESCE({dimension_name_sql(c, 'g')}, '')" for c in ("source", "district", "search_type", "typology"))
+    cur.execute(f"""
+        SELECT {names}, g.changes FROM (
+            SELECT l.source_id, l.district_id, l.search_type_id, l.typology_id, COUNT(*) AS changes
+            FROM price_points p JOIN listing_rows l ON l.id = p.listing_id
+            WHERE p.day >= ? AND p.day > CAST(julianday(date(l.first_seen)) - 2440587.5 AS INTEGER)
+            GROUP BY 1, 2, 3, 4
+        ) g
+    """, (since_day,))
+    for *key, n in cur.fetchall():
+        slot(tuple(key))["changes"] += n
+
+    cur.execute(f"""
+        SELECT {names}, g.last_seen FROM (
+            SELECT source_id, district_id, search_type_id, typology_id, MAX(last_seen) AS last_seen
+            FROM listing_rows GROUP BY 1, 2, 3, 4
+        ) g
+    """)
+    for *key, last_seen in cur.fetchall():
+        slot(tuple(key))["last_seen"] = last_seen
+    conn.close()
+    return out
+
+def _rollup_filters(district, search_type, typology):
+    where, params = "", []
+    for col, value in (("district", district), ("search_type", search_type), ("typology", typology)):
+        if value:
+            where += f" AND {col} = ?"
+            params.append(value)
+    return where, params
+
+def get_historical_stats(district=None, search_type=None, typology=None, resolution=None, max_points=None):
+    """Retrieves historical stats for plotting.
+
+    Without `resolution`/`max_points` this returns the raw daily_stats rows
+    (one per day and group). Otherwise it returns one series, summed over the
+    matching groups, from history_rollup at day/week/month resolution and
+    LTTB-downsampled to at most `max_points` points. `count` is then the
+    average number of listings per snapshot in the bucket.
+    """
     conn = get_connection()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
-    
-    query = "SELECT * FROM daily_stats WHERE 1=1"
-    params = []
-    
-    if district:
-        query += " AND district = ?"
-        params.append(district)
-    if search_type:
-        query += " AND search_type = ?"
-        params.append(search_type)
-    if typology:
-        query += " AND typology = ?"
-        params.append(typology)
+
+    if resolution is None and not max_points:
+        query = "SELECT * FROM daily_stats WHERE 1=1"
+        params = []
         
-    query += " ORDER BY date ASC"
-    
-    cur.execute(query, params)
-    rows = cur.fetchall()
+        if district:
+            query += " AND district = ?"
+            params.append(district)
+        if search_type:
+            query += " AND search_type = ?"
+            params.append(search_type)
+        if typology:
+            query += " AND typology = ?"
+            params.append(typology)
+            
+        query += " ORDER BY date ASC"
+        
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        conn.close()
+        return [dict(r) for r in rows]
+
+    where, params = _rollup_filters(district, search_type, typology)
+    cur.execute(f"""
+        SELECT bucket AS date,
+               SUM(sum_eur_m2) / NULLIF(SUM(n_eur_m2), 0) AS avg_eur_m2,
+               SUM(sum_price_eur) / NULLIF(SUM(n_price), 0) AS avg_price_eur,
+               CAST(ROUND(1.0 * SUM(sum_count) / MAX(days)) AS INTEGER) AS count,
+               CAST(ROUND(1.0 * SUM(sum_unique) / MAX(days)) AS INTEGER) AS unique_count
+        FROM history_rollup
+        WHERE resolution = ?{where}
+        GROUP BY bucket ORDER BY bucket ASC
+    """, [resolution or "day"] + params)
+    rows = [dict(r) for r in cur.fetchall()]
     conn.close()
-    return [dict(r) for r in rows]
+    return downsample_lttb(rows, max_points)
 
-def get_posted_stats(district=None, search_type=None, typology=None):
-    """Retrieves historical stats based on the posted_at date."""
+def get_posted_stats(district=None, search_type=None, typology=None, resolution="day", max_points=None):
+    """Retrieves historical stats based on the posted_at date, from posted_rollup."""
     conn = get_connection()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
-    
-    query = """
-        SELECT 
-            date(posted_at) as date, 
-            AVG(eur_m2) as avg_eur_m2, 
-            AVG(price_eur) as avg_price_eur, 
-            COUNT(*) as count
-        FROM listings 
-        WHERE posted_at IS NOT NULL AND is_active = 1
-    """
-    params = []
-    if district:
-        query += " AND district = ?"
-        params.append(district)
-    if search_type:
-        query += " AND search_type = ?"
-        params.append(search_type)
-    if typology:
-        query += " AND typology = ?"
-        params.append(typology)
-        
-    query += " GROUP BY date ORDER BY date ASC"
-    
-    cur.execute(query, params)
-    rows = cur.fetchall()
+
+    where, params = _rollup_filters(district, search_type, typology)
+    cur.execute(f"""
+        SELECT NULLIF(bucket, '') AS date,
+               SUM(sum_eur_m2) / NULLIF(SUM(n_eur_m2), 0) AS avg_eur_m2,
+               SUM(sum_price_eur) / NULLIF(SUM(n_price), 0) AS avg_price_eur,
+               SUM(n) AS count
+        FROM posted_rollup
+        WHERE resolution = ?{where}
+        GROUP BY bucket ORDER BY bucket ASC
+    """, [resolution or "day"] + params)
+    rows = [dict(r) for r in cur.fetchall()]
     conn.close()
-    return [dict(r) for r in rows]
+    return downsample_lttb(rows, max_points)
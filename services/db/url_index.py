@@ -0,0 +1,154 @@
+import math
+import hashlib
+import logging
+import threading
+from .connection import get_connection
+
+logger = logging.getLogger("url_index")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one blake2b digest)."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def memory_bytes(self):
+        return len(self.bits)
+
+
+def lookup_known_urls(cur, urls):
+    """Exact membership check against listings (primary-key lookups, chunked)."""
+    known = set()
+    # Stay well under SQLite's bound-parameter limit
+    for i in range(0, len(urls), 500):
+        chunk = urls[i:i + 500]
+        cur.execute(f"SELECT url FROM listing_rows WHERE url IN ({','.join('?' * len(chunk))})", chunk)
+        known.update(r[0] for r in cur.fetchall())
+    return known
+
+
+class UrlIndex:
+    """Process-wide URL membership index for the listings table.
+
+    A Bloom filter answers "definitely new" in O(1) without touching the
+    database; only URLs it reports as present are confirmed with an exact
+    primary-key lookup, so false positives never leak out. Sized at
+    1% false positives, one million URLs take about 1.2 MB (a Python set of
+    the same URLs needs well over 100 MB).
+
+    Other processes (cron, workers) may insert rows this process has not
+    seen, so callers must still tolerate a "new" URL that already exists.
+    """
+
+    def __init__(self, capacity=1_000_000, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """(Re)builds the filter from listings.url, streaming rows from the cursor."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM listing_rows")
+        total = cur.fetchone()[0]
+        # Leave headroom so normal growth doesn't force an immediate rebuild
+        capacity = max(self.capacity, total * 2)
+        bloom = BloomFilter(capacity, self.error_rate)
+        cur.execute("SELECT url FROM listing_rows")
+        for (url,) in cur:
+            bloom.add(url)
+        conn.close()
+        with self.lock:
+            self.bloom = bloom
+        logger.info(f"URL index loaded: {total} URLs, {bloom.memory_bytes() / 1e6:.2f} MB")
+
+    @property
+    def loaded(self):
+        return self.bloom is not None
+
+    def _ensure_loaded(self):
+        if self.bloom is None:
+            self.load()
+
+    def add(self, urls):
+        self._ensure_loaded()
+        with self.lock:
+            for u in urls:
+                self.bloom.add(u)
+            full = self.bloom.count > self.bloom.capacity
+        if full:
+            # Past capacity the false-positive rate climbs quickly; rebuild bigger
+            self.load()
+
+    def maybe_contains(self, url):
+        self._ensure_loaded()
+        return url in self.bloom
+
+    def split(self, urls, cur=None):
+        """Splits URLs into (known, new) sets: Bloom first, exact check only on hits."""
+        self._ensure_loaded()
+        candidates = []
+        new = set()
+        for u in set(urls):
+            if not u:
+                continue
+            if u in self.bloom:
+                candidates.append(u)
+            else:
+                new.add(u)
+        known = set()
+        if candidates:
+            own_conn = cur is None
+            if own_conn:
+                conn = get_connection()
+                cur = conn.cursor()
+            known = lookup_known_urls(cur, candidates)
+            if own_conn:
+                conn.close()
+            new.update(u for u in candidates if u not in known)
+        return known, new
+
+    def filter_known(self, urls):
+        return self.split(urls)[0]
+
+    def stats(self):
+        self._ensure_loaded()
+        b = self.bloom
+        return {
+            "urls": b.count,
+            "capacity": b.capacity,
+            "bits": b.num_bits,
+            "hashes": b.num_hashes,
+            "memory_bytes": b.memory_bytes(),
+            # Expected false-positive rate at the current fill level
+            "false_positive_rate": (1 - math.exp(-b.num_hashes * b.count / b.num_bits)) ** b.num_hashes,
+        }
+
+
+URL_INDEX = UrlIndex()
@@ -0,0 +1,148 @@
+"""Optional detail-page enrichment, run next to the search scrape.
+
+With ENRICH_DETAILS=1 the scrape paths (`get_listings`, worker tasks) fill
+cards missing an area from cached detail pages before cleaning, and queue
+the detail pages of new and repriced listings after saving
+(services/db/details.py). `start_enrichment` (the worker's `--enrich`)
+then fetches them in background threads.
+
+Enrichment is bounded so it never slows the search scrape down:
+
+- at most `detail_concurrency` detail pages of a source in flight (a
+  scraper class attribute; 1 for Idealista);
+- at most ENRICH_SHARE of the source's current limiter rate, so it backs
+  off with the rate limiter when a portal pushes back;
+- limiter tokens are taken with `try_acquire(background=True)`, which
+  refuses while a search request is waiting for one, and nothing runs
+  while the source's circuit breaker is open.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from scrapers.throttle import SourceBlockedError
+from services.db import (
+    queue_details, claim_detail, store_detail, fail_detail, get_cached_details, save_listings, backoff,
+)
+from services.processor import clean_data
+from services import metrics
+
+logger = logging.getLogger("enrichment")
+
+ENRICH_DETAILS = os.environ.get("ENRICH_DETAILS") == "1"
+ENRICH_SHARE = float(os.environ.get("ENRICH_SHARE", "0.5"))
+# Idle wait when a source has nothing queued or no spare token
+IDLE_SECONDS = 2.0
+TOKEN_POLL_SECONDS = 0.25
+
+# source -> monotonic time before which its next detail request must not start
+_NEXT_AT = {}
+_PACE_LOCK = threading.Lock()
+
+
+def fill_from_details(items):
+    """Completes cards from cached detail pages (area, eur_m2, posted_at), in place, before clean_data."""
+    if not ENRICH_DETAILS:
+        return 0
+    missing = [x["url"] for x in items if x.get("url") and not x.get("area_m2")]
+    if not missing:
+        return 0
+    cached = get_cached_details(missing)
+    filled = 0
+    for x in items:
+        fields = cached.get(x.get("url"))
+        if not fields or not fields.get("area_m2"):
+            continue
+        x["area_m2"] = fields["area_m2"]
+        if x.get("price_eur") and x.get("eur_m2") is None:
+            x["eur_m2"] = round(x["price_eur"] / x["area_m2"], 2)
+        x["posted_at"] = x.get("posted_at") or fields.get("posted_at")
+        filled += 1
+    return filled
+
+
+def queue_after_save(items, saved, search_type, typology):
+    """Queues the detail pages worth fetching after a save (no-op unless ENRICH_DETAILS)."""
+    if not ENRICH_DETAILS:
+        return 0
+    return queue_details(items, saved, search_type, typology)
+
+
+def _pace(source, rate):
+    """Seconds to wait before this source's next detail request, reserving its slot."""
+    interval = 1.0 / max(1e-6, rate * ENRICH_SHARE)
+    with _PACE_LOCK:
+        now = time.monotonic()
+        start = max(now, _NEXT_AT.get(source, now))
+        _NEXT_AT[source] = start + interval
+    return start - now
+
+
+def enrich_one(scraper, job):
+    """Fetches, parses and stores one claimed detail page. Returns the outcome."""
+    url = job["url"]
+    status, html = scraper.fetch_detail(url)
+    if status in (404, 410):
+        fail_detail(url, f"HTTP {status}", gone=True)
+        return "gone"
+    fields = scraper.parse_detail(html)
+    content_hash = hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+    outcome = store_detail(url, fields, content_hash)
+    if outcome == "missing" and job["card"] and fields.get("area_m2"):
+        # A card dropped for lack of an area: store it now that we have one
+        card = job["card"]
+        card["area_m2"] = fields["area_m2"]
+        card["eur_m2"] = round(card["price_eur"] / card["area_m2"], 2)
+        card["posted_at"] = card.get("posted_at") or fields.get("posted_at")
+        cleaned = clean_data([card])
+        if cleaned:
+            save_listings(cleaned, job["search_type"], job["typology"])
+            store_detail(url, fields, content_hash)
+            outcome = "rescued"
+    return outcome
+
+
+def _run_slot(scraper, stop):
+    source = scraper.name
+    while not stop.is_set():
+        blocked_for = scraper.breaker.retry_in()
+        if blocked_for > 0:
+            stop.wait(blocked_for)
+            continue
+        job = claim_detail(source)
+        if job is None:
+            stop.wait(IDLE_SECONDS)
+            continue
+        stop.wait(_pace(source, scraper.limiter.rate))
+        while not stop.is_set() and not scraper.limiter.try_acquire(background=True):
+            stop.wait(TOKEN_POLL_SECONDS)
+        if stop.is_set():
+            # The lease expires and another slot picks the page up
+            return
+        try:
+            outcome = enrich_one(scraper, job)
+        except SourceBlockedError as e:
+            outcome = "blocked"
+            fail_detail(job["url"], str(e), scraper.breaker.retry_in() + backoff(1))
+        except Exception as e:
+            outcome = "error"
+            logger.warning(f"Detail page {job['url']} failed: {e}")
+            fail_detail(job["url"], f"{type(e).__name__}: {e}", backoff(job["attempts"]))
+        metrics.inc("detail_enrich_total", source=source, outcome=outcome)
+
+
+def start_enrichment(scrapers, stop):
+    """Starts `detail_concurrency` daemon threads per scraper, running until `stop` is set. Returns them."""
+    threads = []
+    for scraper in scrapers.values():
+        for i in range(scraper.detail_concurrency):
+            t = threading.Thread(
+                target=_run_slot, args=(scraper, stop), name=f"enrich-{scraper.name}-{i}", daemon=True,
+            )
+            t.start()
+            threads.append(t)
+    logger.info(f"Detail enrichment running on {len(threads)} threads (share {ENRICH_SHARE:.0%} of each source's rate)")
+    return threads
@@ -0,0 +1,172 @@
+"""In-process metrics for the listings pipeline, rendered in Prometheus text format.
+
+- `timer(name, **labels)` times a block into a histogram (seconds). Inside
+  a request opened with `start_request()` the duration is also added to
+  that request's stage totals, which `/api/listings` can send back as a
+  `Server-Timing` header.
+- `inc(name, value, **labels)` bumps a counter; `set_gauge` sets a gauge and
+  `set_total` mirrors a counter maintained elsewhere.
+
+Only the stdlib is used; everything lives in this process and resets on
+restart, which is what Prometheus expects from a scrape target.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+PREFIX = "imo_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LOCK = threading.Lock()
+_COUNTERS = {}
+_GAUGES = {}
+# (name, labels) -> [bucket counts..., +Inf count, sum]
+_HISTOGRAMS = {}
+_HELP = {}
+
+# Stage totals of the current request; a dict shared by reference, so
+# threads started with a copy of the context add to the same request
+_REQUEST = contextvars.ContextVar("metrics_request", default=None)
+
+
+def describe(name, text):
+    """Sets the # HELP line of a metric."""
+    _HELP[name] = text
+
+
+def _key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    with _LOCK:
+        k = (name, _key(labels))
+        _COUNTERS[k] = _COUNTERS.get(k, 0) + value
+
+
+def set_total(name, value, **labels):
+    """Sets a counter kept elsewhere (e.g. transport stats) to its current total."""
+    with _LOCK:
+        _COUNTERS[(name, _key(labels))] = value
+
+
+def set_gauge(name, value, **labels):
+    with _LOCK:
+        _GAUGES[(name, _key(labels))] = value
+
+
+def observe(name, seconds, **labels):
+    with _LOCK:
+        k = (name, _key(labels))
+        h = _HISTOGRAMS.get(k)
+        if h is None:
+            h = _HISTOGRAMS[k] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h[i] += 1
+        h[len(BUCKETS)] += 1
+        h[-1] += seconds
+
+
+@contextmanager
+def timer(name, timing=None, **labels):
+    """Times the block into histogram `name`; `timing` names it in Server-Timing (default: the stage label)."""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t
+        observe(name, elapsed, **labels)
+        req = _REQUEST.get()
+        if req is not None:
+            key = timing or labels.get("stage") or name
+            with _LOCK:
+                req[key] = req.get(key, 0.0) + elapsed
+
+
+def start_request():
+    """Starts collecting stage totals for the current request (context)."""
+    _REQUEST.set({})
+
+
+def request_timings():
+    """{stage: seconds} collected since start_request() in this context."""
+    req = _REQUEST.get()
+    if req is None:
+        return {}
+    with _LOCK:
+        return dict(req)
+
+
+def server_timing_header(timings):
+    """Formats {stage: seconds} as a Server-Timing header value (milliseconds)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _LOCK:
+        counters = dict(_COUNTERS)
+        gauges = dict(_GAUGES)
+        histograms = {k: list(v) for k, v in _HISTOGRAMS.items()}
+
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in _HELP:
+            lines.append(f"# HELP {PREFIX}{name} {_HELP[name]}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    for (name, key), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{PREFIX}{name}{_fmt_labels(key)} {value}")
+    for (name, key), value in sorted(gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{PREFIX}{name}{_fmt_labels(key)} {value}")
+    for (name, key), h in sorted(histograms.items()):
+        header(name, "histogram")
+        for i, bound in enumerate(BUCKETS):
+            lines.append(f"{PREFIX}{name}_bucket{_fmt_labels(key, [('le', repr(bound))])} {h[i]}")
+        lines.append(f"{PREFIX}{name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {h[len(BUCKETS)]}")
+        lines.append(f"{PREFIX}{name}_sum{_fmt_labels(key)} {h[-1]}")
+        lines.append(f"{PREFIX}{name}_count{_fmt_labels(key)} {h[len(BUCKETS)]}")
+    return "\n".join(lines) + "\n"
+
+
+describe("pipeline_stage_seconds", "Time spent in each get_listings stage.")
+describe("scraper_stage_seconds", "Time spent fetching and parsing result pages, per source.")
+describe("scraper_pages_total", "Result pages fetched, per source.")
+describe("scraper_bytes_total", "Bytes of HTML fetched, per source.")
+describe("scraper_listings_total", "Listings parsed from result pages, per source.")
+describe("scraper_errors_total", "Scrapes that failed, per source.")
+describe("listings_cache_requests_total", "get_listings query cache lookups, by result (hit/miss).")
+describe("listings_cache_warmed_total", "Queries preloaded into the get_listings cache on start.")
+describe("listings_saved_total", "Scraped listings stored, by outcome (inserted/refreshed).")
+describe("http_request_seconds", "Flask request latency, per endpoint.")
+describe("transport_requests_total", "HTTP requests sent by the scrapers, per host.")
+describe("transport_connections_total", "New TCP connections opened by the scrapers, per host.")
+describe("transport_tls_handshakes_total", "TLS handshakes done by the scrapers, per host.")
+describe("throttle_rate_per_second", "Current adaptive request rate, per source.")
+describe("breaker_open", "1 while a source's circuit breaker is open.")
+describe("detail_pages_total", "Listing detail pages fetched, per source.")
+describe("detail_enrich_total", "Detail-page enrichment attempts, per source and outcome.")
+describe("detail_queue", "Detail pages in the enrichment queue, per source and status.")
+describe("export_rows_total", "Listings streamed by /api/export, per format.")
+describe("url_index_urls", "URLs held in the in-memory URL index.")
+describe("url_index_false_positive_rate", "Expected false-positive rate of the URL index Bloom filter.")
@@ -55,7 +55,7 @@ def clean_data(items, district=None, search_type="rent"):
     return out
 
 def apply_sort(items, sort):
-    """Sorts data by price or eur_m2"""
+    """Sorts data by price, eur_m2 or deal score (best deals first)"""
     def key_eurm2(x):
         v = x.get("eur_m2")
         return (v is None, v if v is not None else 10**18)
@@ -64,6 +64,12 @@ def apply_sort(items, sort):
         v = x.get("price_eur")
         return (v is None, v if v is not None else 10**18)
 
+    def key_deal(x):
+        v = x.get("deal_score")
+        return (v is None, -v if v is not None else 0)
+
+    if sort == "deal":
+        return sorted(items, key=key_deal)
     if sort == "eur_m2_desc":
         return sorted(items, key=key_eurm2, reverse=True)
     if sort == "price_asc":
@@ -72,6 +78,25 @@ def apply_sort(items, sort):
         return sorted(items, key=key_price, reverse=True)
     return sorted(items, key=key_eurm2)
 
+def collapse_duplicates(items):
+    """Keeps the first listing of each property (so the current sort decides which);
+    the others are attached to it under `duplicates`."""
+    out = []
+    by_property = {}
+    for x in items:
+        pid = x.get("property_id")
+        if pid is None:
+            out.append(x)
+            continue
+        head = by_property.get(pid)
+        if head is None:
+            head = dict(x, duplicates=[])
+            by_property[pid] = head
+            out.append(head)
+        else:
+            head["duplicates"].append({"source": x.get("source"), "url": x.get("url"), "price_eur": x.get("price_eur")})
+    return out
+
 def calculate_stats(items):
     """Generates statistics from data"""
     by_source = {}
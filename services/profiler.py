@@ -0,0 +1,295 @@
+"""Opt-in sampling profiler for long runs (cron job, bulk scrapes).
+
+A background thread wakes every `interval` seconds and records the stack of
+every other thread (`sys._current_frames`). Each sample is weighted by the
+wall time since the previous one and, on Linux, by the CPU time the thread
+actually used in between (from /proc/self/task/<tid>/schedstat), giving a
+wall profile (includes time blocked on network and locks) and a CPU profile
+from the same pass. Nothing is traced, so the run is not slowed down beyond
+the sampler's own share, which is reported.
+
+    with profile("cron_bulk_scrape") as prof:
+        with prof.phase("bulk_scrape"):
+            bulk_scrape()
+
+writes, into PROFILE_DIR (default `profiles/`):
+
+- `<name>-<stamp>.wall.folded` / `.cpu.folded`: folded stacks in
+  microseconds, the input of flamegraph.pl, speedscope or inferno.
+- `<name>-<stamp>.json`: phases with durations and peak RSS, CPU time,
+  the top functions by self time, sampler overhead.
+
+`python -m services.profiler compare old.json new.json` prints the
+phase and function differences between two runs.
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import resource
+import threading
+from pathlib import Path
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger("profiler")
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR") or PROJECT_ROOT / "profiles")
+DEFAULT_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.01"))
+TOP_FUNCTIONS = 30
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _thread_cpu_ns(native_id):
+    """CPU time used so far by one thread, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/self/task/{native_id}/schedstat") as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        with open(f"/proc/self/task/{native_id}/stat") as f:
+            # Fields after the parenthesised comm: utime and stime are 12 and 13
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) * 1_000_000_000 // _CLOCK_TICKS
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{code.co_name}:{frame.f_lineno}"
+
+
+def _thread_label(name):
+    # "ThreadPoolExecutor-3_1" and "Thread-12 (process_request_thread)" group across runs
+    return re.sub(r"[-_]\d+", "", name).replace(";", ":").replace(" ", "_")
+
+
+class Profiler:
+    def __init__(self, name, out_dir=None, interval=None):
+        self.name = name
+        self.out_dir = Path(out_dir or PROFILE_DIR)
+        self.interval = interval or DEFAULT_INTERVAL
+        self.wall = {}  # folded stack -> microseconds
+        self.cpu = {}
+        self.samples = 0
+        self.phases = []
+        self._active = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._cpu_seen = {}
+        self._sampler_cpu = 0.0
+        self.paths = {}
+
+    # --- phases ---
+
+    @contextmanager
+    def phase(self, name):
+        """Records the duration and peak RSS of a block."""
+        entry = {"name": name, "seconds": None, "peak_rss_mb": None, "_peak": _rss_bytes() or 0}
+        with self._lock:
+            self.phases.append(entry)
+            self._active.append(entry)
+        t = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["seconds"] = round(time.perf_counter() - t, 3)
+            rss = _rss_bytes() or 0
+            with self._lock:
+                self._active.remove(entry)
+                entry["peak_rss_mb"] = round(max(entry.pop("_peak"), rss) / 1e6, 1)
+            logger.info(f"Phase {name} took {entry['seconds']}s (peak RSS {entry['peak_rss_mb']} MB)")
+
+    # --- sampling ---
+
+    def start(self):
+        self.started_at = datetime.datetime.now()
+        self._t0 = time.perf_counter()
+        self._cpu0 = resource.getrusage(resource.RUSAGE_SELF)
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._t0
+        self._cpu1 = resource.getrusage(resource.RUSAGE_SELF)
+
+    def _run(self):
+        me = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            t = time.thread_time()
+            now = time.perf_counter()
+            wall_us = int((now - last) * 1_000_000)
+            last = now
+            self._sample(me, wall_us)
+            self._sampler_cpu += time.thread_time() - t
+
+    def _sample(self, me, wall_us):
+        threads = {t.ident: t for t in threading.enumerate()}
+        frames = sys._current_frames()
+        for ident, frame in frames.items():
+            if ident == me:
+                continue
+            thread = threads.get(ident)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(_thread_label(thread.name if thread else str(ident)))
+            folded = ";".join(reversed(stack))
+            self.wall[folded] = self.wall.get(folded, 0) + wall_us
+
+            native_id = getattr(thread, "native_id", None)
+            cpu_ns = _thread_cpu_ns(native_id) if native_id else None
+            if cpu_ns is not None:
+                prev = self._cpu_seen.get(native_id)
+                self._cpu_seen[native_id] = cpu_ns
+                if prev is not None and cpu_ns > prev:
+                    self.cpu[folded] = self.cpu.get(folded, 0) + (cpu_ns - prev) // 1000
+        self.samples += 1
+
+        rss = _rss_bytes()
+        if rss is not None:
+            with self._lock:
+                for entry in self._active:
+                    entry["_peak"] = max(entry["_peak"], rss)
+
+    # --- output ---
+
+    @staticmethod
+    def _self_time(folded_counts):
+        """Microseconds per leaf function (self time), largest first."""
+        out = {}
+        for stack, us in folded_counts.items():
+            leaf = stack.rsplit(";", 1)[-1].rsplit(":", 1)[0]
+            out[leaf] = out.get(leaf, 0) + us
+        return dict(sorted(out.items(), key=lambda kv: -kv[1])[:TOP_FUNCTIONS])
+
+    def summary(self):
+        cpu_user = self._cpu1.ru_utime - self._cpu0.ru_utime
+        cpu_sys = self._cpu1.ru_stime - self._cpu0.ru_stime
+        return {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "elapsed_s": round(self.elapsed, 3),
+            "cpu_user_s": round(cpu_user, 3),
+            "cpu_system_s": round(cpu_sys, 3),
+            "peak_rss_mb": round(_peak_rss_bytes() / 1e6, 1),
+            "interval_s": self.interval,
+            "samples": self.samples,
+            "sampler_cpu_s": round(self._sampler_cpu, 3),
+            "phases": self.phases,
+            "unit": "microseconds",
+            "top_wall": self._self_time(self.wall),
+            "top_cpu": self._self_time(self.cpu),
+        }
+
+    def write(self):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stem = self.out_dir / f"{self.name}-{self.started_at.strftime('%Y%m%d-%H%M%S')}"
+        self.paths = {
+            "wall": Path(f"{stem}.wall.folded"),
+            "cpu": Path(f"{stem}.cpu.folded"),
+            "summary": Path(f"{stem}.json"),
+        }
+        for kind, counts in (("wall", self.wall), ("cpu", self.cpu)):
+            with open(self.paths[kind], "w") as f:
+                for stack, us in sorted(counts.items()):
+                    f.write(f"{stack} {us}\n")
+        with open(self.paths["summary"], "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        return self.paths
+
+
+class _NoProfiler:
+    def phase(self, name):
+        return nullcontext()
+
+
+@contextmanager
+def profile(name, enabled=True, out_dir=None, interval=None):
+    """Samples every thread while the block runs and writes the profile files at the end.
+
+    With enabled=False this costs nothing and `phase` is a no-op, so callers
+    can wrap their phases unconditionally.
+    """
+    if not enabled:
+        yield _NoProfiler()
+        return
+    prof = Profiler(name, out_dir, interval)
+    prof.start()
+    try:
+        yield prof
+    finally:
+        prof.stop()
+        paths = prof.write()
+        logger.info(
+            f"Profile of {name}: {prof.samples} samples over {prof.elapsed:.1f}s, "
+            f"sampler CPU {prof._sampler_cpu:.2f}s -> {paths['summary']}"
+        )
+
+
+def compare(old, new):
+    """Text report of phase and top-function differences between two summary files."""
+    lines = [f"{'phase':30} {'old s':>10} {'new s':>10} {'delta':>8}"]
+    old_phases = {p["name"]: p for p in old["phases"]}
+    for p in new["phases"]:
+        o = old_phases.get(p["name"])
+        if o and o["seconds"]:
+            lines.append(f"{p['name']:30} {o['seconds']:10.2f} {p['seconds']:10.2f} "
+                         f"{(p['seconds'] / o['seconds'] - 1) * 100:+7.1f}%")
+        else:
+            lines.append(f"{p['name']:30} {'-':>10} {p['seconds']:10.2f} {'':>8}")
+    lines.append(f"{'total elapsed':30} {old['elapsed_s']:10.2f} {new['elapsed_s']:10.2f}")
+    lines.append(f"{'cpu user':30} {old['cpu_user_s']:10.2f} {new['cpu_user_s']:10.2f}")
+    lines.append(f"{'peak rss (MB)':30} {old['peak_rss_mb']:10.1f} {new['peak_rss_mb']:10.1f}")
+    for key in ("top_cpu", "top_wall"):
+        lines.append("")
+        lines.append(f"{key + ' (s self)':60} {'old':>8} {'new':>8}")
+        names = sorted(set(old[key]) | set(new[key]), key=lambda n: -max(old[key].get(n, 0), new[key].get(n, 0)))
+        for fn in names[:15]:
+            lines.append(f"{fn[:60]:60} {old[key].get(fn, 0) / 1e6:8.2f} {new[key].get(fn, 0) / 1e6:8.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two profiler summaries.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    cmp = sub.add_parser("compare")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+    args = parser.parse_args()
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(compare(old, new))
+
+
+if __name__ == "__main__":
+    main()
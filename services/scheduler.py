@@ -0,0 +1,166 @@
+"""Churn-driven refresh planning: spend a fixed request budget where it finds the most.
+
+Every (source, district, search_type, typology) slice of the bulk sweep
+gets a churn rate from data already in the database: listings first seen
+and price changes over the last WINDOW_DAYS, smoothed towards the average
+of its source/search type so quiet or new slices still get a sensible
+rate. The events expected to be waiting since the slice was last scraped
+are rate x age (a Poisson arrival model). One request (one results page)
+can pick up at most one page of them, so page k of a slice is worth
+min(page size, expected - (k-1) x page size). The planner takes the
+`budget` best pages across all slices; because each slice's pages are
+worth less and less, taking them greedily is optimal.
+
+Freshness SLO: a slice is fresh while the events expected to be missing
+stay under SLO_MISSED_EVENTS, i.e. its target age is SLO_MISSED_EVENTS /
+rate, clamped to [SLO_MIN_HOURS, SLO_MAX_HOURS]. Busy Lisboa rentals get
+a target of an hour or two; a quiet Bragança T3 purchase gets days.
+"""
+import heapq
+import logging
+import datetime
+from cachetools import TTLCache, cached
+
+from services.aggregator import SCRAPERS, DISTRICTS, BULK_SEARCH_TYPES, BULK_TYPOLOGIES
+from services.db import get_slice_activity, get_refresh_history, enqueue_job
+
+logger = logging.getLogger("scheduler")
+
+WINDOW_DAYS = 14
+# Weight, in days of observation, of the source/search-type average in each slice's rate
+PRIOR_DAYS = 3.0
+# Never-scraped slices count as this stale
+MAX_AGE_HOURS = 7 * 24
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGES = 10
+SLO_MISSED_EVENTS = 5.0
+SLO_MIN_HOURS = 1.0
+SLO_MAX_HOURS = 7 * 24.0
+
+
+def _parse(ts):
+    try:
+        return datetime.datetime.fromisoformat(ts) if ts else None
+    except ValueError:
+        return None
+
+
+def estimate_slices(now=None):
+    """Churn, staleness and SLO state of every slice of the bulk sweep."""
+    now = now or datetime.datetime.now()
+    activity = get_slice_activity(WINDOW_DAYS)
+    refreshed, page_sizes = get_refresh_history()
+    window_hours = WINDOW_DAYS * 24.0
+
+    keys = [
+        (source, district, st, ty)
+        for source in SCRAPERS for district in DISTRICTS for st in BULK_SEARCH_TYPES for ty in BULK_TYPOLOGIES
+    ]
+    events = {}
+    group_events = {}
+    for key in keys:
+        a = activity.get(key, {})
+        events[key] = a.get("new", 0) + a.get("changes", 0)
+        g = group_events.setdefault((key[0], key[2]), [0, 0])
+        g[0] += events[key]
+        g[1] += 1
+
+    slices = []
+    for key in keys:
+        source, district, st, ty = key
+        total, n = group_events[(source, st)]
+        group_rate = total / (n * window_hours)
+        prior_hours = PRIOR_DAYS * 24
+        rate = (events[key] + group_rate * prior_hours) / (window_hours + prior_hours)
+
+        seen = [t for t in (_parse(activity.get(key, {}).get("last_seen")), _parse(refreshed.get(key))) if t]
+        last = max(seen) if seen else None
+        age = min(MAX_AGE_HOURS, (now - last).total_seconds() / 3600) if last else MAX_AGE_HOURS
+        expected = rate * age
+        slo = min(SLO_MAX_HOURS, max(SLO_MIN_HOURS, SLO_MISSED_EVENTS / rate)) if rate > 0 else SLO_MAX_HOURS
+        slices.append({
+            "source": source,
+            "district": district,
+            "search_type": st,
+            "typology": ty,
+            "events": events[key],
+            "rate_per_hour": round(rate, 4),
+            "last_refresh": last.isoformat(timespec="seconds") if last else None,
+            "age_hours": round(age, 2),
+            "expected_missed": round(expected, 2),
+            "slo_hours": round(slo, 2),
+            "fresh": age <= slo,
+            "page_size": page_sizes.get(source) or DEFAULT_PAGE_SIZE,
+        })
+    return slices
+
+
+def plan_refresh(budget, slices=None):
+    """Picks `budget` pages by expected new information. Returns [(slice, pages, expected gain)], best first."""
+    slices = estimate_slices() if slices is None else slices
+
+    def gain(s, page):
+        return min(s["page_size"], max(0.0, s["expected_missed"] - (page - 1) * s["page_size"]))
+
+    heap = [(-gain(s, 1), i, 1) for i, s in enumerate(slices) if gain(s, 1) > 0]
+    heapq.heapify(heap)
+    pages = {}
+    gains = {}
+    for _ in range(budget):
+        if not heap:
+            break
+        g, i, page = heapq.heappop(heap)
+        pages[i] = page
+        gains[i] = gains.get(i, 0.0) - g
+        if page < MAX_PAGES and gain(slices[i], page + 1) > 0:
+            heapq.heappush(heap, (-gain(slices[i], page + 1), i, page + 1))
+    plan = [(slices[i], pages[i], round(gains[i], 2)) for i in pages]
+    plan.sort(key=lambda p: -p[2])
+    return plan
+
+
+def enqueue_refresh(budget):
+    """Queues a refresh job for the workers spending at most `budget` page requests.
+
+    Each planned slice gets a task for page 1 with its planned page count as
+    the limit; pagination still stops early once pages bring nothing new.
+    Returns {"job_id", "created", "slices", "pages", "expected_events"}.
+    """
+    plan = plan_refresh(budget)
+    tasks = [(s["source"], s["district"], s["search_type"], s["typology"], pages) for s, pages, _ in plan]
+    if not tasks:
+        return {"job_id": None, "created": False, "slices": 0, "pages": 0, "expected_events": 0}
+    job = enqueue_job("refresh", {"budget": budget}, tasks)
+    if not job["created"]:
+        # A refresh with this budget is still open; its own plan stands
+        return job
+    job.update({
+        "slices": len(tasks),
+        "pages": sum(t[4] for t in tasks),
+        "expected_events": round(sum(g for _, _, g in plan), 1),
+    })
+    logger.info(
+        f"Refresh job {job['job_id']}: {job['pages']} pages over {job['slices']} slices, "
+        f"~{job['expected_events']} new listings/changes expected"
+    )
+    return job
+
+
+@cached(TTLCache(maxsize=1, ttl=60))
+def _estimates():
+    return estimate_slices()
+
+
+def freshness_report(**filters):
+    """SLO summary plus slices (stalest relative to their target first), optionally filtered by any slice key."""
+    slices = [s for s in _estimates() if all(s[k] == v for k, v in filters.items() if v)]
+    fresh = sum(1 for s in slices if s["fresh"])
+    return {
+        "window_days": WINDOW_DAYS,
+        "slo_missed_events": SLO_MISSED_EVENTS,
+        "slices": len(slices),
+        "fresh": fresh,
+        "fresh_ratio": round(fresh / len(slices), 4) if slices else None,
+        "expected_missed": round(sum(s["expected_missed"] for s in slices), 1),
+        "items": sorted(slices, key=lambda s: -s["age_hours"] / s["slo_hours"]),
+    }
@@ -0,0 +1,251 @@
+"""Read-only columnar snapshots of the database for analytics (Parquet or Arrow IPC).
+
+    python automation/export_snapshot.py                 # append what changed since the last run
+    python automation/export_snapshot.py --format arrow  # memory-mappable Arrow IPC files
+    python automation/export_snapshot.py --full          # everything, ignoring the saved watermarks
+
+Three datasets are written under EXPORT_DIR/<format> (default
+`exports/parquet`), each partitioned Hive-style by day and district, so
+pyarrow/DuckDB/Polars read them as one dataset with partition pruning:
+
+- `listings/seen_day=<day>/district=<name>/`: listings by their `last_seen`
+  day. Runs are incremental: each one appends the listings written since
+  the previous run (seen again, repriced or enriched), so a listing
+  reappears in later files; take the row with the highest `rev` per `id`
+  for the current state. `rev` comes from `listing_revs`, bumped in the
+  writing transaction, so unlike a timestamp it never commits out of order.
+- `price_history/date=<day>/district=<name>/`: one row per price change,
+  with its time in `changed_at` (from `price_points`).
+- `daily_stats/date=<day>/district=<name>/`: the daily snapshots.
+
+For price_history and daily_stats only finished days (before today) are
+written, so a day never needs rewriting. Every run adds a new
+`part-<stamp>` file per partition. The files are moved into place and the
+watermarks saved only once the whole run succeeded, so a failed run leaves
+nothing behind and the next run repeats it.
+
+Rows are read from a single read transaction (a consistent snapshot
+under WAL; the scrapers keep writing meanwhile) with `fetchmany`, and
+written batch by batch. The queries are ordered by partition, so only one
+file is open at a time and memory stays constant however large the
+database is.
+
+Needs `pyarrow`, imported only when an export runs.
+"""
+import os
+import json
+import sqlite3
+import logging
+import datetime
+from pathlib import Path
+from urllib.parse import quote
+
+from services.db import DB_PATH
+from services.db.schema import DIMENSIONS, VIEW_COLUMNS
+
+logger = logging.getLogger("snapshot")
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+EXPORT_DIR = Path(os.environ.get("EXPORT_DIR") or PROJECT_ROOT / "exports")
+BATCH_ROWS = 10_000
+STATE_FILE = "_export_state.json"
+TABLES = ("listings", "price_history", "daily_stats")
+_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+_LISTING_COLUMNS = ("id", "url", *DIMENSIONS, *VIEW_COLUMNS)
+_REAL = {"price_eur", "area_m2", "eur_m2", "latitude", "longitude", "deal_score", "avg_eur_m2", "avg_price_eur", "median_eur_m2"}
+_INTEGER = {"id", "rev", "listing_id", "is_active", "property_id", "count", "unique_count"}
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError:
+        raise RuntimeError("Snapshot export needs pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def _exports(watermarks, today):
+    """{table: (query, params, partition columns, watermark column)} selecting the rows past the watermarks.
+
+    Queries return the partition columns first, in partition order.
+    """
+    day_sql = "date(p.day * 86400, 'unixepoch')"
+    listing_cols = [c for c in _LISTING_COLUMNS if c != "district"]
+    return {
+        "listings": (
+            f"""
+            SELECT substr(l.last_seen, 1, 10) AS seen_day, l.district, {', '.join(f'l.{c}' for c in listing_cols)}, r.rev
+            FROM listings l JOIN listing_revs r ON r.listing_id = l.id
+            WHERE r.rev > ?
+            ORDER BY seen_day, l.district
+            """,
+            # A last_seen watermark from before revisions means starting over
+            [rev if isinstance(rev := watermarks.get("listings"), int) else 0],
+            ("seen_day", "district"),
+            "rev",
+        ),
+        "price_history": (
+            f"""
+            SELECT {day_sql} AS date, l.district, p.listing_id, l.url, l.source, l.search_type, l.typology, p.price_eur,
+                   strftime('%Y-%m-%dT%H:%M:%S', p.day * 86400 + p.sec, 'unixepoch') AS changed_at
+            FROM price_points p JOIN listings l ON l.id = p.listing_id
+            WHERE {day_sql} > ? AND {day_sql} < ?
+            ORDER BY p.day, l.district
+            """,
+            [watermarks.get("price_history") or "", today],
+            ("date", "district"),
+            "date",
+        ),
+        "daily_stats": (
+            """
+            SELECT date, district, search_type, typology, avg_eur_m2, avg_price_eur, median_eur_m2, count, unique_count
+            FROM daily_stats WHERE date > ? AND date < ?
+            ORDER BY date, district
+            """,
+            [watermarks.get("daily_stats") or "", today],
+            ("date", "district"),
+            "date",
+        ),
+    }
+
+
+def _arrow_type(pa, column):
+    if column in _REAL:
+        return pa.float64()
+    if column in _INTEGER:
+        return pa.int64()
+    return pa.string()
+
+
+def _partition_dir(root, names, values):
+    parts = [f"{n}={quote(str(v), safe=' ') if v is not None else _NULL_PARTITION}" for n, v in zip(names, values)]
+    return root.joinpath(*parts)
+
+
+class _PartitionWriter:
+    """Writes consecutive batches to one file per partition; the previous file is closed on a partition change."""
+
+    def __init__(self, pa, fmt, root, schema, stamp, files):
+        self.pa = pa
+        self.fmt = fmt
+        self.root = root
+        self.schema = schema
+        self.stamp = stamp
+        self.key = None
+        self.writer = None
+        self.files = files  # (temp path, final path), shared by the whole run
+
+    def write(self, key, partition_names, rows):
+        if key != self.key:
+            self.close()
+            self.key = key
+            directory = _partition_dir(self.root, partition_names, key)
+            directory.mkdir(parents=True, exist_ok=True)
+            final = directory / f"part-{self.stamp}.{self.fmt}"
+            tmp = directory / f".part-{self.stamp}.{self.fmt}.tmp"
+            if self.fmt == "parquet":
+                self.writer = self.pa.parquet.ParquetWriter(str(tmp), self.schema, compression="zstd")
+            else:
+                self.writer = self.pa.ipc.new_file(str(tmp), self.schema)
+            self.files.append((tmp, final))
+        columns = list(zip(*rows))
+        arrays = [self.pa.array(col, type=field.type) for col, field in zip(columns, self.schema)]
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.fmt == "parquet":
+            self.writer.write_table(self.pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def _export_table(pa, cur, fmt, root, stamp, files, query, params, partition_names, watermark_column, batch_rows):
+    """Streams one query into partition files, appending each to `files` as it is opened.
+
+    Returns (rows, partitions written, new watermark or None).
+    """
+    cur.execute(query, params)
+    names = [d[0] for d in cur.description]
+    n_part = len(partition_names)
+    data_names = names[n_part:]
+    schema = pa.schema([(c, _arrow_type(pa, c)) for c in data_names])
+    wm_index = names.index(watermark_column)
+    opened = len(files)
+    writer = _PartitionWriter(pa, fmt, root, schema, stamp, files)
+    total = 0
+    watermark = None
+    try:
+        while True:
+            rows = cur.fetchmany(batch_rows)
+            if not rows:
+                break
+            total += len(rows)
+            start = 0
+            for i in range(1, len(rows) + 1):
+                # Cut the batch where the partition changes (rows come ordered by partition)
+                if i == len(rows) or rows[i][:n_part] != rows[start][:n_part]:
+                    writer.write(tuple(rows[start][:n_part]), partition_names, [r[n_part:] for r in rows[start:i]])
+                    start = i
+            marks = [r[wm_index] for r in rows if r[wm_index] is not None]
+            if marks:
+                watermark = max(marks) if watermark is None else max(watermark, max(marks))
+    finally:
+        writer.close()
+    return total, len(files) - opened, watermark
+
+
+def export_snapshot(out_dir=None, fmt="parquet", tables=TABLES, full=False, batch_rows=BATCH_ROWS):
+    """Exports the tables past their watermarks (everything with full=True). Returns {table: rows written}."""
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError(f"unknown format: {fmt}")
+    pa = _import_pyarrow()
+    out_dir = Path(out_dir or EXPORT_DIR)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    state_path = out_dir / STATE_FILE
+    # The other format's watermarks (and those of tables not exported now) are kept even with full=True
+    state = json.loads(state_path.read_text()) if state_path.exists() else {}
+    saved_marks = state.get(fmt, {})
+    watermarks = {} if full else saved_marks
+    now = datetime.datetime.now()
+    stamp = now.strftime("%Y%m%d-%H%M%S")
+    today = now.date().isoformat()
+
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, isolation_level=None)
+    cur = conn.cursor()
+    # One read transaction: every table comes from the same point in time
+    cur.execute("BEGIN")
+    written = {}
+    files = []
+    new_marks = dict(saved_marks)
+    try:
+        for table, (query, params, partition_names, wm_column) in _exports(watermarks, today).items():
+            if table not in tables:
+                continue
+            # Files are recorded as they are opened, so a failure mid-table still removes them
+            rows, partitions, mark = _export_table(
+                pa, cur, fmt, out_dir / fmt / table, stamp, files, query, params, partition_names, wm_column, batch_rows,
+            )
+            written[table] = rows
+            if mark is not None:
+                new_marks[table] = mark
+            logger.info(f"Exported {rows} {table} rows into {partitions} partitions")
+    except BaseException:
+        for tmp, _ in files:
+            tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        conn.close()
+
+    for tmp, final in files:
+        os.replace(tmp, final)
+    state[fmt] = new_marks
+    tmp_state = state_path.with_name(STATE_FILE + ".tmp")
+    tmp_state.write_text(json.dumps(state, indent=2))
+    os.replace(tmp_state, state_path)
+    return written
@@ -33,6 +33,16 @@ export async function getHistory(params) {
   return res.json();
 }
 
+export async function getListingHistories(urls) {
+  const res = await fetch('/api/listing_history/bulk', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ urls })
+  });
+  if (!res.ok) throw new Error("Falha a carregar históricos de preços");
+  return res.json();
+}
+
 export async function getListingHistory(url) {
   const res = await fetch(`/api/listing_history?url=${encodeURIComponent(url)}`);
   if (!res.ok) throw new Error("Falha a carregar histórico do anúncio");
@@ -45,6 +55,23 @@ export async function getMarks() {
   return res.json();
 }
 
+// Changes after revision `since`: { rev, changes: { url: state|null } }
+export async function getMarksSince(since) {
+  const res = await fetch(`/api/marks?since=${encodeURIComponent(since || 0)}`);
+  if (!res.ok) throw new Error("Falha a sincronizar marcações");
+  return res.json();
+}
+
+// Many changes in one request/transaction: [{ url, state }]
+export async function postMarksBatch(changes) {
+  const res = await fetch('/api/marks/batch', {
+    method: 'POST', headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ changes })
+  });
+  if (!res.ok) throw new Error("Falha a guardar marcações");
+  return res.json();
+}
+
 export async function postMark(url, state) {
   try {
     await fetch('/api/marks', {
@@ -1,27 +1,76 @@
 // Repository for Loved/Discarded marks with localStorage + server sync
+// Sync is incremental: the server numbers every change with a revision, we
+// only ask for changes after the last revision seen and push clicks in batches.
 import { emit } from './eventBus.js';
-import { getMarks as apiGetMarks, postMark as apiPostMark } from './apiClient.js';
+import { getMarksSince as apiGetMarksSince, postMarksBatch as apiPostMarksBatch } from './apiClient.js';
 
 const LS_KEY = 'imo_marks';
+const LS_REV_KEY = 'imo_marks_rev';
+const LS_PENDING_KEY = 'imo_marks_pending';
+const FLUSH_DELAY_MS = 400;
+
 let MARKS = {};
+let REV = 0;
+let PENDING = {};   // url -> state ('' clears) not yet acknowledged by the server
+let flushTimer = null;
 
 function loadLocal() {
   try { MARKS = JSON.parse(localStorage.getItem(LS_KEY) || '{}') || {}; }
   catch (_) { MARKS = {}; }
+  try { PENDING = JSON.parse(localStorage.getItem(LS_PENDING_KEY) || '{}') || {}; }
+  catch (_) { PENDING = {}; }
+  REV = parseInt(localStorage.getItem(LS_REV_KEY) || '0', 10) || 0;
 }
 
 function saveLocal() {
-  try { localStorage.setItem(LS_KEY, JSON.stringify(MARKS)); } catch (_) {}
+  try {
+    localStorage.setItem(LS_KEY, JSON.stringify(MARKS));
+    localStorage.setItem(LS_PENDING_KEY, JSON.stringify(PENDING));
+    localStorage.setItem(LS_REV_KEY, String(REV));
+  } catch (_) {}
+}
+
+function applyChanges(changes) {
+  for (const [url, state] of Object.entries(changes || {})) {
+    if (url in PENDING) continue; // local click not yet synced wins
+    if (state) MARKS[url] = state;
+    else delete MARKS[url];
+  }
+}
+
+async function flush() {
+  flushTimer = null;
+  const batch = PENDING;
+  const changes = Object.entries(batch).map(([url, state]) => ({ url, state }));
+  if (!changes.length) return;
+  try {
+    await apiPostMarksBatch(changes);
+    // Drop only what was sent; clicks made meanwhile stay queued
+    for (const [url, state] of Object.entries(batch)) {
+      if (PENDING[url] === state) delete PENDING[url];
+    }
+    saveLocal();
+  } catch (_) { /* offline: keep queued, retried on next click or load */ }
+}
+
+function scheduleFlush() {
+  if (flushTimer) clearTimeout(flushTimer);
+  flushTimer = setTimeout(flush, FLUSH_DELAY_MS);
 }
 
 export async function load() {
   loadLocal();
   try {
-    const remote = await apiGetMarks();
-    if (remote && typeof remote === 'object') {
-      MARKS = Object.assign({}, MARKS, remote);
-      saveLocal();
+    await flush();
+    const { rev, changes } = await apiGetMarksSince(REV);
+    if (REV === 0) {
+      // First sync: the server's full set wins over what was cached locally
+      MARKS = Object.assign({}, MARKS, changes);
+    } else {
+      applyChanges(changes);
     }
+    REV = rev;
+    saveLocal();
   } catch (_) { /* offline */ }
   emit('marksChanged', MARKS);
 }
@@ -36,7 +85,8 @@ export async function set(url, state) {
   } else {
     delete MARKS[url];
   }
+  PENDING[url] = state || '';
   saveLocal();
   emit('marksChanged', MARKS);
-  try { await apiPostMark(url, state || ''); } catch (_) {}
+  scheduleFlush();
 }
@@ -1,6 +1,6 @@
 import { money, num } from '../utils/format.js';
 import { get as getMark, set as setMark } from '../marksRepository.js';
-import { getListingHistory } from '../apiClient.js';
+import { getListingHistory, getListingHistories } from '../apiClient.js';
 
 let priceHistoryChart = null;
 
@@ -50,6 +50,40 @@ async function showPriceHistory(url) {
   list.innerHTML = table;
 }
 
+// Price histories already fetched for the sparklines, by URL (per result set)
+const historyCache = new Map();
+let historyCacheData = null;
+
+function sparkline(history) {
+  if (!history || history.length < 2) return '';
+  const prices = history.map(h => h.price_eur).filter(p => p != null);
+  if (prices.length < 2) return '';
+  const w = 60, h = 16;
+  const min = Math.min(...prices), max = Math.max(...prices);
+  const span = max - min || 1;
+  const pts = prices.map((p, i) =>
+    `${(i / (prices.length - 1) * w).toFixed(1)},${(h - (p - min) / span * h).toFixed(1)}`
+  ).join(' ');
+  const trend = prices[prices.length - 1] < prices[0] ? 'down' : 'up';
+  return `<svg class="sparkline sparkline-${trend}" width="${w}" height="${h}" viewBox="0 -1 ${w} ${h + 2}"><polyline points="${pts}" fill="none" stroke-width="1.5"/></svg>`;
+}
+
+async function loadSparklines(urls) {
+  const missing = urls.filter(u => !historyCache.has(u));
+  if (missing.length) {
+    try {
+      const histories = await getListingHistories(missing);
+      for (const u of missing) historyCache.set(u, histories[u] || []);
+    } catch (e) {
+      console.error(e);
+      return;
+    }
+  }
+  document.querySelectorAll('#tbody .spark-slot').forEach(el => {
+    el.innerHTML = sparkline(historyCache.get(el.getAttribute('data-url')));
+  });
+}
+
 function sourceBadge(src) {
   const s = (src || '').toLowerCase();
   const cls = `bg-${s}`;
@@ -130,7 +164,7 @@ export function renderTable(data) {
         </div>
         <div class="text-secondary small mt-1 text-truncate" style="max-width: 400px;">${x.snippet || ''}</div>
       </td>
-      <td class="text-end mono">${money(x.price_eur)}</td>
+      <td class="text-end mono">${money(x.price_eur)}<div class="spark-slot" data-url="${x.url}"></div></td>
       <td class="text-end mono">${x.area_m2 ? num(x.area_m2) + ' m²' : '—'}</td>
       <td class="text-end mono">${x.eur_m2 ? num(x.eur_m2) : '—'}</td>
       <td class="small text-secondary">${x.posted_at ? new Date(x.posted_at).toLocaleDateString('pt-PT') : '—'}</td>
@@ -160,6 +194,13 @@ export function renderTable(data) {
   // Update sort icons
   updateSortIcons();
 
+  // One request draws the price sparklines of every visible row
+  if (data !== historyCacheData) {
+    historyCache.clear();
+    historyCacheData = data;
+  }
+  loadSparklines(filtered.map(x => x.url));
+
   return { filteredCount: filtered.length };
 }
 
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# services.db opens DB_PATH and runs init_db on import: point it at a scratch database first
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="tests-"), "data.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
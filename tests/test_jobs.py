@@ -0,0 +1,17 @@
+from services.db import enqueue_job, claim_task, get_job
+from services.db.jobs import MAX_ATTEMPTS
+
+
+def test_task_failed_by_lease_expiry_finishes_its_job():
+    params = {"pages": 1}
+    job = enqueue_job("bulk_scrape", params, [("olx", "Leiria", "rent", "T2", 1)])
+    assert job["created"]
+
+    # Every claim's lease is already expired, as if the worker died each time
+    for _ in range(MAX_ATTEMPTS):
+        assert claim_task("w", lease_seconds=-1)["job_id"] == job["job_id"]
+    assert claim_task("w") is None
+
+    assert get_job(job["job_id"])["status"] == "done"
+    again = enqueue_job("bulk_scrape", params, [("olx", "Leiria", "rent", "T2", 1)])
+    assert again["created"] and again["job_id"] != job["job_id"]
@@ -0,0 +1,46 @@
+import sqlite3
+
+from services.db import connection, init_db, save_listings, get_listing_history
+
+
+def _item(url, price):
+    return {"url": url, "source": "olx", "district": "Leiria", "title": "T2", "price_eur": price, "area_m2": 80, "eur_m2": price / 80}
+
+
+def test_same_day_price_changes_are_all_kept():
+    url = "https://example.com/same-day"
+    save_listings([_item(url, 1000)], "rent", "T2")
+    save_listings([_item(url, 900)], "rent", "T2")
+    save_listings([_item(url, 950)], "rent", "T2")
+    assert [h["price_eur"] for h in get_listing_history(url)] == [1000, 900, 950]
+
+
+def test_legacy_price_history_is_migrated_in_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(connection, "DB_PATH", tmp_path / "legacy.db")
+    conn = sqlite3.connect(connection.DB_PATH)
+    conn.execute("""
+        CREATE TABLE listings (
+            url TEXT PRIMARY KEY, source TEXT, district TEXT, title TEXT, price_eur REAL, area_m2 REAL,
+            eur_m2 REAL, search_type TEXT, snippet TEXT, first_seen DATETIME, last_seen DATETIME, typology TEXT
+        )
+    """)
+    conn.execute("CREATE TABLE price_history (url TEXT, price_eur REAL, date DATETIME)")
+    history = []
+    for n in range(20):
+        url = f"https://example.com/legacy/{n}"
+        conn.execute("INSERT INTO listings (url, source, district, price_eur) VALUES (?, 'olx', 'Leiria', 100)", (url,))
+        # 16 changes each, several per day and two within the same second
+        for i in range(16):
+            history.append((url, 100 + i, f"2024-03-{1 + i // 4:02d}T10:{i % 4:02d}:00"))
+        history.append((url, 99, "2024-03-04T10:03:00"))
+    conn.executemany("INSERT INTO price_history VALUES (?, ?, ?)", history)
+    conn.commit()
+    conn.close()
+
+    init_db()
+
+    conn = sqlite3.connect(connection.DB_PATH)
+    assert conn.execute("SELECT COUNT(*) FROM price_points").fetchone()[0] == len(history)
+    conn.close()
+    prices = [h["price_eur"] for h in get_listing_history("https://example.com/legacy/0")]
+    assert prices == [100 + i for i in range(16)] + [99]
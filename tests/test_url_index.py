@@ -0,0 +1,17 @@
+from services.db.url_index import UrlIndex, BloomFilter
+
+
+def test_false_positive_estimate_matches_measured_rate():
+    index = UrlIndex(capacity=20_000, error_rate=0.01)
+    index.bloom = BloomFilter(index.capacity, index.error_rate)
+    for i in range(index.capacity):
+        index.bloom.add(f"https://example.com/listing/{i}")
+
+    probes = 50_000
+    hits = sum(f"https://example.com/other/{i}" in index.bloom for i in range(probes))
+    measured = hits / probes
+    estimate = index.stats()["false_positive_rate"]
+
+    # At design load both sit near the configured 1%
+    assert 0.005 < measured < 0.02
+    assert abs(estimate - measured) < 0.005